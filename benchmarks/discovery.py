@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Compares throughput of the discovery engines against a local listener farm
+
+    $ python benchmarks/discovery.py --http 200 --https 50 --delay 0.2
+
+"""
+import argparse
+import logging
+import tempfile
+import time
+
+from farm import Farm
+
+from pukpuk import (
+    base,
+    logs,
+)
+
+
+def bench(engine, farm, args):
+    with tempfile.TemporaryDirectory() as output_dir:
+        app = base.Application(
+            output_dir=output_dir,
+            engine=engine,
+            workers=args.workers,
+            connections=args.connections,
+            socket_timeout=args.socket_timeout,
+            sweep=args.sweep,
+        )
+        hosts = {host for host, _, _ in farm.services}
+        ports = [(port, None) for _, port, _ in farm.services] + [(port, None) for port in farm.closed]
+        accepted = farm.accepted
+        started = time.perf_counter()
+        results = app.get_discovery_targets([(host, None, None) for host in hosts], ports)
+        elapsed = time.perf_counter() - started
+    return set(results), elapsed, farm.accepted - accepted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--http', type=int, default=200, help='Number of HTTP listeners')
+    parser.add_argument('--https', type=int, default=50, help='Number of HTTPS listeners')
+    parser.add_argument('--closed', type=int, default=0, help='Number of closed ports to include')
+    parser.add_argument('--delay', type=float, default=0.2, help='Response delay of every listener in seconds')
+    parser.add_argument('--workers', type=int, default=base.Application.DEFAULT_WORKERS)
+    parser.add_argument('--connections', type=int, default=base.Application.DEFAULT_CONNECTIONS)
+    parser.add_argument('--socket-timeout', type=float, default=base.Application.DEFAULT_SOCKET_TIMEOUT)
+    parser.add_argument('--sweep', action='store_true', help='Sweep targets before discovery')
+    args = parser.parse_args()
+    logs.logger.setLevel(logging.WARNING)
+    with Farm(http=args.http, https=args.https, closed=args.closed, delay=args.delay) as farm:
+        expected = set(farm.services)
+        results = dict()
+        for engine in base.Application.ENGINES:
+            found, elapsed, accepted = bench(engine, farm, args)
+            results[engine] = found
+            print(
+                f'{engine:>10}: {len(expected)} targets in {elapsed:.2f}s ({len(expected) / elapsed:.1f} targets/s), '
+                f'{accepted / len(expected):.2f} connections/target, found {len(found & expected)}/{len(expected)}'
+            )
+    if len(set(map(frozenset, results.values()))) != 1:
+        print('Results differ between engines!')
+        return 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,185 @@
+"""Local listener farm used by the benchmarks, serves HTTP(S) and misbehaving TCP ports on loopback from a single
+event loop
+
+"""
+import asyncio
+import functools
+import ipaddress
+import pathlib
+import socket
+import ssl
+import struct
+import threading
+
+
+CERT_PATH = pathlib.Path(__file__).parent.parent / 'tests' / 'dockers' / 'http' / 'server.pem'
+RESPONSE = (
+    'HTTP/1.1 200 OK\r\n'
+    'Content-Type: text/html\r\n'
+    'Content-Length: {length}\r\n'
+    'Connection: {connection}\r\n'
+    '\r\n'
+    '{body}'
+)
+BODY = '<!DOCTYPE html><html><head><title>Farm</title></head><body>{port}</body></html>'
+BANNER = b'SSH-2.0-Farm\r\n'
+PLAIN = 'plain'
+RESET = 'reset'
+BLACKHOLE = 'blackhole'
+# NOTE: Connections filling the accept queue of a black-holed port, further SYNs are dropped and connects time out
+BLACKHOLE_FILLERS = 2
+
+
+class Farm:
+    """Listeners spread over loopback addresses, all of 127.0.0.0/8 is routed to the loopback interface on Linux
+
+    HTTP(S) listeners, including slow ones, are listed in `services`. Ports which are not HTTP (a banner of another
+    protocol), reset connections or never complete the handshake are listed in `others`, closed ports in `closed`.
+
+    """
+
+    def __init__(
+        self,
+        http=100,
+        https=0,
+        closed=0,
+        delay=0.0,
+        host='127.0.0.1',
+        name='localhost',
+        plain=0,
+        slow=0,
+        slow_delay=1.0,
+        reset=0,
+        blackhole=0,
+        addresses=1
+    ):
+        # NOTE: Services of a single address are reported by name so that the reverse DNS lookups do not skew the
+        # measurements, with more addresses the benchmark has to take care of that
+        self.host = host
+        self.name = name
+        self.hosts = [str(ipaddress.IPv4Address(host) + index) for index in range(addresses)]
+        self.http = http
+        self.https = https
+        self.plain = plain
+        self.slow = slow
+        self.slow_delay = slow_delay
+        self.reset = reset
+        self.blackhole = blackhole
+        self.closed = list()
+        self.closed_count = closed
+        self.delay = delay
+        self.services = list()
+        self.others = list()
+        self.accepted = 0
+        self.sockets = list()
+        self.listeners = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ssl_ctx.load_cert_chain(CERT_PATH)
+
+    def next_host(self):
+        host = self.hosts[self.listeners % len(self.hosts)]
+        self.listeners += 1
+        return host
+
+    def get_name(self, host):
+        return self.name if len(self.hosts) == 1 else host
+
+    async def handle(self, delay, reader, writer):
+        self.accepted += 1
+        port = writer.get_extra_info('sockname')[1]
+        try:
+            while True:
+                request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+                keep_alive = b'HTTP/1.1' in request.partition(b'\r\n')[0] and b'connection: close' not in request.lower()
+                await asyncio.sleep(delay)
+                body = BODY.format(port=port)
+                connection = 'keep-alive' if keep_alive else 'close'
+                writer.write(RESPONSE.format(length=len(body), connection=connection, body=body).encode('ascii'))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, OSError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_plain(self, reader, writer):
+        self.accepted += 1
+        try:
+            writer.write(BANNER)
+            await writer.drain()
+            await asyncio.wait_for(reader.read(4096), 10)
+        except (asyncio.TimeoutError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_reset(self, reader, writer):
+        self.accepted += 1
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        writer.transport.abort()
+
+    async def listen(self, proto, handler=None, name=None):
+        host = self.next_host()
+        server = await asyncio.start_server(
+            handler or functools.partial(self.handle, self.delay),
+            host,
+            0,
+            ssl=self.ssl_ctx if proto == 'https' else None,
+        )
+        port = server.sockets[0].getsockname()[1]
+        (self.services if name is None else self.others).append((self.get_name(host), port, name or proto))
+        return server
+
+    def listen_blackhole(self):
+        host = self.next_host()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind((host, 0))
+        sock.listen(0)
+        port = sock.getsockname()[1]
+        self.sockets.append(sock)
+        for _ in range(BLACKHOLE_FILLERS):
+            filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            filler.setblocking(False)
+            filler.connect_ex((host, port))
+            self.sockets.append(filler)
+        self.others.append((self.get_name(host), port, BLACKHOLE))
+
+    async def start_servers(self):
+        self.servers = [await self.listen('http') for _ in range(self.http)]
+        self.servers.extend([await self.listen('https') for _ in range(self.https)])
+        slow = functools.partial(self.handle, self.slow_delay)
+        self.servers.extend([await self.listen('http', slow) for _ in range(self.slow)])
+        self.servers.extend([await self.listen(None, self.handle_plain, PLAIN) for _ in range(self.plain)])
+        self.servers.extend([await self.listen(None, self.handle_reset, RESET) for _ in range(self.reset)])
+
+    def reserve_closed(self):
+        """Finds ports nobody listens on by binding and releasing them
+
+        """
+        for _ in range(self.closed_count):
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                sock.bind((self.host, 0))
+                self.closed.append(sock.getsockname()[1])
+
+    def start(self):
+        self.reserve_closed()
+        for _ in range(self.blackhole):
+            self.listen_blackhole()
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.start_servers(), self.loop).result()
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        for sock in self.sockets:
+            sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args, **kwargs):
+        self.stop()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Compares fetching many paths per host with a new session per request and with the pooled session of `Responses`
+
+    $ python benchmarks/responses.py --http 10 --https 10 --paths 50
+
+"""
+import argparse
+import concurrent.futures
+import logging
+import tempfile
+import time
+
+import requests
+
+from farm import Farm
+
+from pukpuk import (
+    base,
+    logs,
+    mods,
+)
+
+
+def fetch_all(get, urls, workers):
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        responses = list(executor.map(lambda url: get(url, verify=False, timeout=10).status_code, urls))
+    return time.perf_counter() - started, responses.count(200)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--http', type=int, default=10, help='Number of HTTP listeners')
+    parser.add_argument('--https', type=int, default=10, help='Number of HTTPS listeners')
+    parser.add_argument('--paths', type=int, default=50, help='Number of paths requested from every listener')
+    parser.add_argument('--workers', type=int, default=base.Application.DEFAULT_WORKERS)
+    parser.add_argument('--pool-size', type=int, default=base.Application.DEFAULT_POOL_SIZE)
+    args = parser.parse_args()
+    logs.logger.setLevel(logging.WARNING)
+    with Farm(http=args.http, https=args.https) as farm:
+        urls = [f'{proto}://{host}:{port}/{path}' for path in range(args.paths) for host, port, proto in farm.services]
+        with tempfile.TemporaryDirectory() as output_dir:
+            app = base.Application(output_dir=output_dir, response_workers=args.workers, pool_size=args.pool_size)
+            module = mods.Responses(app)
+            for name, get in (('per request', requests.get), ('pooled', module.session.get)):
+                accepted = farm.accepted
+                elapsed, succeeded = fetch_all(get, urls, args.workers)
+                print(
+                    f'{name:>12}: {len(urls)} URLs in {elapsed:.2f}s ({len(urls) / elapsed:.1f} URLs/s), '
+                    f'{farm.accepted - accepted} connections, {succeeded} succeeded'
+                )
+            module.close()
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
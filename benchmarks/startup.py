@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Measures cold startup of the command line tool and lists the slowest imports, fails if it is over budget or if
+dependencies of the scanning stages are imported at startup
+
+    $ python benchmarks/startup.py --runs 20 --budget 150
+
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+# NOTE: Loaded by the stages needing them, none of them is needed to parse arguments or print the version
+DEFERRED = ('requests', 'urllib3', 'dns.resolver', 'dns.asyncresolver', 'netaddr', 'OpenSSL', 'cryptography.x509', 'PIL.Image', 'asyncio')
+
+
+def run_version():
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'pukpuk.cli', '-v'], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def get_imports():
+    """Returns cumulative import times in microseconds of modules imported by the command line tool
+
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import pukpuk.cli'], check=True, capture_output=True, text=True)
+    imports = dict()
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            imports[fields[2].strip()] = int(fields[1])
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='Number of measured runs of `pukpuk -v`')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest imports listed')
+    parser.add_argument('--budget', type=float, help='Maximum median startup time in milliseconds')
+    args = parser.parse_args()
+    baseline = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    interpreter = time.perf_counter() - baseline
+    times = [run_version() for _ in range(args.runs)]
+    median = statistics.median(times) * 1000
+    print(f'pukpuk -v: median {median:.1f} ms, min {min(times) * 1000:.1f} ms over {args.runs} runs (bare interpreter {interpreter * 1000:.1f} ms)')
+    imports = get_imports()
+    for name, cumulative in sorted(imports.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f'{cumulative / 1000:>10.1f} ms  {name}')
+    failed = False
+    deferred = [name for name in DEFERRED if name in imports]
+    if deferred:
+        print(f'Imported at startup: {", ".join(deferred)}')
+        failed = True
+    if args.budget is not None and median > args.budget:
+        print(f'Over budget of {args.budget:.1f} ms')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
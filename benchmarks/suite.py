@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""Runs discovery and modules against a local farm of well-behaved and misbehaving listeners, reports throughput,
+latency percentiles, peak memory and accuracy of every engine as JSON
+
+    $ python benchmarks/suite.py --http 1000 --https 200 --plain 100 --slow 50 --reset 50 --blackhole 20 --addresses 8 -o results.json
+
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import pathlib
+import platform
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+from farm import Farm
+
+from pukpuk import (
+    base,
+    database,
+    logs,
+    version,
+)
+
+
+LATENCIES = ('connect_seconds', 'port_test_seconds', 'discovery_seconds', 'responses_seconds', 'screens_seconds')
+DISCOVERY_STAGES = ('sweep', 'discovery')
+
+
+def raise_open_files():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def scan(options, hosts, ports):
+    """Runs a complete scan, called in a fresh process so that its peak memory does not include the farm
+
+    """
+    raise_open_files()
+    logs.logger.setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as output_dir:
+        app = base.Application(output_dir=output_dir, progress_interval=0, **options)
+        for host in hosts:
+            # NOTE: Addresses of the farm have no PTR records, a lookup would only measure the resolver
+            app.ptr_cache.set(host, None, app.ptr_cache.NEGATIVE_TTL)
+        started = time.perf_counter()
+        try:
+            app.run([(host, None, None) for host in hosts], [(port, None) for port in ports])
+        except SystemExit:
+            pass
+        elapsed = time.perf_counter() - started
+        connection = sqlite3.connect(pathlib.Path(output_dir, database.Database.FILENAME))
+        responses = dict(connection.execute('SELECT url, status FROM responses'))
+        connection.close()
+    return {
+        'found': app.discovered.unique(),
+        'responses': responses,
+        'metrics': app.metrics.to_dict(),
+        'elapsed': elapsed,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def get_latencies(histograms):
+    return {
+        name: [{key: value for key, value in entry.items() if key != 'buckets'} for entry in histograms[name]]
+        for name in LATENCIES if name in histograms
+    }
+
+
+def get_accuracy(expected, found, responses):
+    found = set(found)
+    ports = {(host, port) for host, port, _ in expected}
+    ok = sum(1 for host, port, proto in expected if responses.get(f'{proto}://{host}:{port}') == 200)
+    return {
+        'expected': len(expected),
+        'found': len(found & expected),
+        'missed': len(expected - found),
+        'false_positives': len(found - expected),
+        'wrong_protocol': sum(1 for host, port, _ in found - expected if (host, port) in ports),
+        'precision': len(found & expected) / len(found) if found else None,
+        'recall': len(found & expected) / len(expected) if expected else None,
+        'responses_ok': ok,
+    }
+
+
+def bench(engine, farm, args):
+    options = {
+        'engine': engine,
+        'workers': args.workers,
+        'connections': args.connections,
+        'socket_timeout': args.socket_timeout,
+        'connect_timeout': args.connect_timeout,
+        'sweep': args.sweep,
+        'adaptive': args.adaptive,
+        'pipeline': args.pipeline,
+        'skip_screens': not args.screens,
+    }
+    hosts = sorted({host for host, _, _ in farm.services + farm.others})
+    ports = sorted({port for _, port, _ in farm.services + farm.others} | set(farm.closed))
+    accepted = farm.accepted
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        result = pool.apply(scan, (options, hosts, ports))
+    counters = result['metrics']['counters']
+    stages = {entry['labels']['stage']: entry['value'] for entry in counters.get('stage_seconds_total', list())}
+    discovery_time = sum(stages.get(stage, 0) for stage in DISCOVERY_STAGES)
+    targets = len(hosts) * len(ports)
+    urls = len(result['found'])
+    modules_time = result['elapsed'] - discovery_time
+    return {
+        'engine': engine,
+        'options': options,
+        'elapsed': result['elapsed'],
+        'discovery': {
+            'targets': targets,
+            'seconds': discovery_time,
+            'targets_per_second': targets / discovery_time if discovery_time else None,
+            'stages': stages,
+            'connections': farm.accepted - accepted,
+        },
+        'modules': {
+            'urls': urls,
+            'seconds': modules_time,
+            'urls_per_second': urls / modules_time if modules_time > 0 else None,
+        },
+        'latency': get_latencies(result['metrics']['histograms']),
+        'peak_rss_kb': result['peak_rss_kb'],
+        'accuracy': get_accuracy(set(farm.services), map(tuple, result['found']), result['responses']),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--http', type=int, default=200, help='Number of HTTP listeners')
+    parser.add_argument('--https', type=int, default=50, help='Number of HTTPS listeners')
+    parser.add_argument('--plain', type=int, default=20, help='Number of listeners sending a banner of another protocol')
+    parser.add_argument('--slow', type=int, default=10, help='Number of HTTP listeners replying after `--slow-delay`')
+    parser.add_argument('--reset', type=int, default=10, help='Number of listeners resetting every connection')
+    parser.add_argument('--blackhole', type=int, default=5, help='Number of ports never completing the TCP handshake')
+    parser.add_argument('--closed', type=int, default=10, help='Number of closed ports')
+    parser.add_argument('--addresses', type=int, default=1, help='Number of loopback addresses the listeners are spread over')
+    parser.add_argument('--delay', type=float, default=0.05, help='Response delay of every HTTP listener in seconds')
+    parser.add_argument('--slow-delay', type=float, default=1.0, help='Response delay of slow listeners in seconds')
+    parser.add_argument('-e', '--engine', action='append', choices=base.Application.ENGINES, help='Engine to benchmark, can be repeated [Default: all]')
+    parser.add_argument('--workers', type=int, default=base.Application.DEFAULT_WORKERS)
+    parser.add_argument('--connections', type=int, default=base.Application.DEFAULT_CONNECTIONS)
+    parser.add_argument('--socket-timeout', type=float, default=base.Application.DEFAULT_SOCKET_TIMEOUT)
+    parser.add_argument('--connect-timeout', type=float, default=base.Application.DEFAULT_CONNECT_TIMEOUT)
+    parser.add_argument('--sweep', action='store_true', help='Sweep targets before discovery')
+    parser.add_argument('--adaptive', action='store_true', help='Adapt probes per subnet to timeouts')
+    parser.add_argument('--pipeline', action='store_true', help='Run modules while discovery is running')
+    parser.add_argument('--screens', action='store_true', help='Grab screens too, needs the browser')
+    parser.add_argument('-o', '--output', help='Path of the JSON report [Default: standard output]')
+    args = parser.parse_args()
+    raise_open_files()
+    logs.logger.setLevel(logging.WARNING)
+    farm = Farm(
+        http=args.http,
+        https=args.https,
+        plain=args.plain,
+        slow=args.slow,
+        slow_delay=args.slow_delay,
+        reset=args.reset,
+        blackhole=args.blackhole,
+        closed=args.closed,
+        delay=args.delay,
+        addresses=args.addresses,
+    )
+    report = {
+        'version': version.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'farm': {
+            'http': args.http,
+            'https': args.https,
+            'plain': args.plain,
+            'slow': args.slow,
+            'reset': args.reset,
+            'blackhole': args.blackhole,
+            'closed': args.closed,
+            'addresses': args.addresses,
+            'delay': args.delay,
+            'slow_delay': args.slow_delay,
+        },
+        'runs': list(),
+    }
+    with farm:
+        for engine in args.engine or base.Application.ENGINES:
+            run = bench(engine, farm, args)
+            report['runs'].append(run)
+            accuracy = run['accuracy']
+            print(
+                f'{engine:>10}: {run["discovery"]["targets"]} targets in {run["discovery"]["seconds"]:.2f}s, '
+                f'{run["modules"]["urls"]} URLs in {run["modules"]["seconds"]:.2f}s, peak RSS {run["peak_rss_kb"] // 1024} MiB, '
+                f'found {accuracy["found"]}/{accuracy["expected"]} with {accuracy["false_positives"]} false positives',
+                file=sys.stderr
+            )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -35,6 +35,7 @@ setuptools.setup(
     install_requires=(
         'netaddr==0.8.0',
         'pyOpenSSL==22.0.0',
+        'cryptography==37.0.4',
         'dnspython==2.2.1',
         'requests==2.28.1',
         'Pillow==9.2.0',
@@ -0,0 +1,282 @@
+import asyncio
+import socket
+import time
+
+import dns.asyncresolver
+
+from pukpuk import (
+    logs,
+    throttle,
+    tls,
+)
+
+
+async def consume(items, worker, concurrency, queue_size_factor):
+    """Feeds items through a bounded queue to a fixed number of worker tasks
+
+    """
+    queue = asyncio.Queue(maxsize=concurrency * queue_size_factor)
+
+    async def run():
+        while True:
+            item = await queue.get()
+            try:
+                await worker(item)
+            except Exception as exc:
+                logs.logger.debug(f'Exception: {exc}')
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(run()) for _ in range(concurrency)]
+    try:
+        if hasattr(items, '__aiter__'):
+            async for item in items:
+                await queue.put(item)
+        else:
+            for item in items:
+                await queue.put(item)
+        await queue.join()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def throttled(app, host, connect):
+    """Awaits `connect` returning result and outcome of a connection attempt, paced by the throttle if enabled
+
+    """
+    attempt = 0
+    while True:
+        ticket = await app.throttle.acquire_async(host) if app.throttle else None
+        started = time.monotonic()
+        result, outcome = await connect()
+        app.metrics.observe('connect_seconds', time.monotonic() - started, outcome=outcome)
+        if ticket is None:
+            return result
+        app.throttle.release(ticket, host, outcome, time.monotonic() - started)
+        if not app.throttle.should_retry(host, outcome, attempt):
+            return result
+        attempt += 1
+        logs.logger.debug(f'Retrying `{host}` which replied before')
+
+
+class ReverseLookup:
+    """PTR lookups on an event loop sharing cache of the application, concurrent lookups of an address are merged
+
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.nameserver = dns.asyncresolver.Resolver(configure=True)
+        self.nameserver.timeout = self.app.socket_timeout
+        self.pending = dict()
+
+    async def lookup(self, address):
+        started = time.monotonic()
+        try:
+            response = await self.nameserver.resolve_address(address)
+        except self.app.get_resolver_errors():
+            logs.logger.debug(f'Could not resolve `{address}`')
+            name, ttl = None, self.app.ptr_cache.NEGATIVE_TTL
+            self.app.metrics.observe('ptr_lookup_seconds', time.monotonic() - started, outcome='missing')
+        else:
+            name, ttl = self.app.get_ptr_name(response), response.rrset.ttl
+            self.app.metrics.observe('ptr_lookup_seconds', time.monotonic() - started, outcome='found')
+        self.app.ptr_cache.set(address, name, ttl)
+        return name
+
+    async def resolve(self, address):
+        found, name = self.app.ptr_cache.get(address)
+        if found:
+            return name
+        task = self.pending.get(address)
+        if task is None:
+            task = self.pending[address] = asyncio.create_task(self.lookup(address))
+            task.add_done_callback(lambda _: self.pending.pop(address, None))
+        return await task
+
+    def run(self, addresses):
+        asyncio.run(consume(addresses, self.resolve, self.app.connections, self.app.QUEUE_SIZE_FACTOR))
+
+
+class Discovery:
+    """Discovery engine running the probes on an event loop instead of a thread pool
+
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.reverse_lookup = ReverseLookup(app)
+
+    async def connect(self, host, port):
+        logs.logger.debug(f'Connecting to `{host}:{port}`')
+        try:
+            return await asyncio.wait_for(asyncio.open_connection(host, port), self.app.socket_timeout), throttle.CONNECTED
+        except Exception as exc:
+            logs.logger.debug(f'Error when connecting to `{host}:{port}`: {exc}')
+            return (None, None), throttle.get_outcome(exc)
+
+    async def open_connection(self, host, port):
+        return await throttled(self.app, host, lambda: self.connect(host, port))
+
+    async def close(self, writer):
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    async def recv(self, reader):
+        return await asyncio.wait_for(reader.read(4096), self.app.socket_timeout)
+
+    async def head(self, host, port):
+        """Sends plaintext HEAD request over a new connection, returns the reply
+
+        """
+        reader, writer = await self.open_connection(host, port)
+        if writer is None:
+            return b''
+        request = 'HEAD / HTTP/1.0\r\nHost: {}\r\nAccept: text/html\r\n\r\n'.format(host)
+        try:
+            writer.write(request.encode('ascii'))
+            await writer.drain()
+            return await self.recv(reader)
+        except (ConnectionResetError, asyncio.TimeoutError):
+            return b''
+        finally:
+            await self.close(writer)
+
+    async def tls_handshake(self, reader, writer, host):
+        """Performs TLS handshake over connected stream, returns the handshake state
+
+        """
+        handshake = tls.Handshake(self.app.ssl_ctx, host)
+        try:
+            while not handshake.step():
+                writer.write(handshake.pending())
+                await writer.drain()
+                if not handshake.receive(await self.recv(reader)):
+                    break
+        except (*self.app.TLS_ERRORS, asyncio.TimeoutError) as exc:
+            logs.logger.debug(f'TLS handshake with `{host}` failed: {exc}')
+        return handshake
+
+    async def port_test(self, host, port, reader, writer):
+        """Check if given service is HTTP(S) using connected stream, returns protocol (None otherwise) and certificate
+
+        """
+        logs.logger.debug(f'Checking if `{host}:{port}` is encrypted')
+        handshake = await self.tls_handshake(reader, writer, host)
+        if handshake.done:
+            return self.app.PROTO_HTTPS, handshake.certificate()
+        if handshake.encrypted:
+            logs.logger.debug(f'Encrypted but not completed handshake `{host}:{port}`')
+            return self.app.PROTO_UNKNOWN, None
+        logs.logger.debug(f'Probably not encrypted `{host}:{port}`')
+        if handshake.plaintext and self.app.is_http(handshake.plaintext):
+            return self.app.PROTO_HTTP, None
+        if b'HTTP' in await self.head(host, port):
+            return self.app.PROTO_HTTP, None
+        return self.app.PROTO_UNKNOWN, None
+
+    async def discover_target(self, target):
+        try:
+            with self.app.metrics.track('discovery'):
+                await self.discover(target)
+        finally:
+            self.app.release_target(target)
+        self.app.journal.target_done(target)
+
+    async def discover(self, target):
+        """Adds successfully connected ports to targets, parse HTTPS certificate if applicable
+
+        """
+        logs.logger.debug(f'Discovering `{target}`')
+        host, port, proto = target
+        started = time.monotonic()
+        reader, writer = await self.open_connection(host, port)
+        if writer is None:
+            return
+        cert = None
+        try:
+            if not proto:
+                port_test_started = time.monotonic()
+                proto, cert = await self.port_test(host, port, reader, writer)
+                self.app.metrics.observe('port_test_seconds', time.monotonic() - port_test_started, proto=proto or 'unknown')
+            elif proto == self.app.PROTO_HTTPS:
+                handshake = await self.tls_handshake(reader, writer, host)
+                if handshake.done:
+                    cert = handshake.certificate()
+                else:
+                    logs.logger.debug(f'Probably not encrypted `{host}:{port}`')
+        finally:
+            await self.close(writer)
+
+        if proto is self.app.PROTO_UNKNOWN:
+            return
+
+        self.app.add_service(host, port, proto, cert, time.monotonic() - started)
+        if not self.app.bulk_ptr and self.app.is_address(host):
+            self.app.add_resolved_host(host, port, proto, await self.reverse_lookup.resolve(host))
+
+    def run(self, targets):
+        asyncio.run(consume(targets, self.discover_target, self.app.connections, self.app.QUEUE_SIZE_FACTOR))
+
+
+class Sweep:
+    """Liveness sweep classifying ports as open, closed or filtered using non-blocking connects
+
+    """
+
+    OPEN = 'open'
+    CLOSED = 'closed'
+    FILTERED = 'filtered'
+
+    def __init__(self, app):
+        self.app = app
+        self.open = list()
+        self.counts = {
+            self.OPEN: 0,
+            self.CLOSED: 0,
+            self.FILTERED: 0,
+        }
+
+    async def connect(self, host, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(
+                asyncio.get_running_loop().sock_connect(sock, (host, port)),
+                self.app.connect_timeout
+            )
+        except ConnectionRefusedError as exc:
+            return self.CLOSED, throttle.get_outcome(exc)
+        except (OSError, asyncio.TimeoutError) as exc:
+            return self.FILTERED, throttle.get_outcome(exc)
+        finally:
+            sock.close()
+        return self.OPEN, throttle.CONNECTED
+
+    async def probe(self, target):
+        host, port, _ = target
+        try:
+            with self.app.metrics.track('sweep'):
+                state = await throttled(self.app, host, lambda: self.connect(host, port))
+        finally:
+            self.app.release_target(target)
+        logs.logger.debug(f'Port `{host}:{port}` is {state}')
+        self.counts[state] += 1
+        if state == self.OPEN:
+            self.open.append(target)
+
+    def run(self, targets):
+        """Returns targets with open ports
+
+        """
+        asyncio.run(consume(targets, self.probe, self.app.connections, self.app.QUEUE_SIZE_FACTOR))
+        logs.logger.info(
+            f'Sweep finished, {self.counts[self.OPEN]} open, {self.counts[self.CLOSED]} closed '
+            f'and {self.counts[self.FILTERED]} filtered'
+        )
+        return self.open
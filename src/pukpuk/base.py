@@ -1,31 +1,53 @@
 import argparse
+import array
 import atexit
 import concurrent.futures
 import concurrent.futures.thread
 import errno
+import heapq
+import itertools
+import os
 import pathlib
 import random
 import socket
 import ssl
+import subprocess
 import sys
 import threading
+import time
+import urllib.parse
 from datetime import datetime
 
-import dns.exception
-import dns.resolver
-import dns.reversename
-import netaddr
-import requests
-import urllib3
-from OpenSSL import crypto
-
 from pukpuk import (
+    blobs,
+    certificates,
+    changes,
+    database,
+    journal,
+    lazy,
     logs,
-    mods,
+    metrics,
+    names,
+    ptr,
+    sequences,
+    tls,
+    validators,
     version,
 )
 
 
+# NOTE: Loaded by the stages using them, a scan of URLs skips discovery and `-v` or a wrong argument needs none
+aio = lazy.Module('pukpuk.aio')
+merge = lazy.Module('pukpuk.merge')
+mods = lazy.Module('pukpuk.mods')
+throttle = lazy.Module('pukpuk.throttle')
+dns_exception = lazy.Module('dns.exception')
+dns_resolver = lazy.Module('dns.resolver')
+netaddr = lazy.Module('netaddr')
+requests = lazy.Module('requests')
+urllib3 = lazy.Module('urllib3')
+
+
 class ParserError(Exception):
 
     pass
@@ -37,23 +59,261 @@ class CustomArgumentParser(argparse.ArgumentParser):
         raise ParserError(message)
 
 
+def shard(value):
+    index, _, count = value.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid shard `{value}`, expected I/N')
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f'invalid shard `{value}`, I must be between 1 and N')
+    return index, count
+
+
+class ResultsShard:
+    """Records of a part of the hosts packed in arrays, host names are kept once in a table of their own
+
+    Records are deduplicated using an open addressing table of their indexes, the packed arrays hold the only copy.
+
+    """
+
+    __slots__ = ('hosts', 'services', 'sequences', 'table', 'names', 'name_codes', 'lock')
+
+    TABLE_SIZE = 8
+    EMPTY = -1
+
+    def __init__(self):
+        self.hosts = array.array('q')
+        self.services = array.array('l')
+        self.sequences = array.array('q')
+        self.table = array.array('i', [self.EMPTY]) * self.TABLE_SIZE
+        self.names = list()
+        self.name_codes = dict()
+        self.lock = threading.Lock()
+
+    def find(self, code, service):
+        """Returns slot of the record in the table or of the empty one where it belongs, and True if it is there
+
+        """
+        mask = len(self.table) - 1
+        slot = hash((code, service)) & mask
+        while True:
+            index = self.table[slot]
+            if index == self.EMPTY:
+                return slot, False
+            if self.hosts[index] == code and self.services[index] == service:
+                return slot, True
+            slot = (slot + 1) & mask
+
+    def grow(self):
+        self.table = array.array('i', [self.EMPTY]) * (len(self.table) * 2)
+        for index, (code, service) in enumerate(zip(self.hosts, self.services)):
+            slot, _ = self.find(code, service)
+            self.table[slot] = index
+
+    def add(self, host, address, service, sequence):
+        """Appends record unless it is there already, returns True if it was added
+
+        """
+        with self.lock:
+            if address is None:
+                code = self.name_codes.get(host)
+                if code is None:
+                    # NOTE: Negative codes tell names from IPv4 addresses packed as integers
+                    code = self.name_codes[host] = -len(self.names) - 1
+                    self.names.append(sys.intern(host))
+            else:
+                code = address
+            slot, found = self.find(code, service)
+            if found:
+                return False
+            self.table[slot] = len(self.hosts)
+            self.hosts.append(code)
+            self.services.append(service)
+            self.sequences.append(next(sequence))
+            # NOTE: Table is kept at most half full so that probing stays short
+            if len(self.hosts) * 2 > len(self.table):
+                self.grow()
+        return True
+
+    def get_host(self, code):
+        if code < 0:
+            return self.names[-code - 1]
+        return socket.inet_ntoa(code.to_bytes(4, 'big'))
+
+    def iter_indexes(self, count):
+        """Yields (sequence number, index, shard) of the first `count` records, ready to be merged with other shards
+
+        """
+        for index in range(count):
+            yield self.sequences[index], index, self
+
+
 class Results:
+    """Unique (host, port, protocol) tuples in order of insertion, shared by discovery workers
+
+    Tuples are deduplicated on insert and stored packed: IPv4 addresses as integers, host names once per name, port
+    and protocol as a single integer. Hosts are spread over shards locked independently, a global sequence number
+    keeps the order of insertion. Iterating does not copy the records, records added meanwhile are not included.
+
+    """
+
+    __slots__ = ('shards', 'protos', 'proto_codes', 'protos_lock', 'sequence', 'callback')
+
+    SHARDS = 16
+    PROTO_BITS = 8
+    SERVICE_BITS = 16 + PROTO_BITS
 
     def __init__(self):
-        self._items = list()
-        self._lock = threading.Lock()
+        self.shards = [ResultsShard() for _ in range(self.SHARDS)]
+        self.protos = [None]
+        self.proto_codes = {None: 0}
+        self.protos_lock = threading.Lock()
+        self.sequence = itertools.count()
+        self.callback = None
+
+    def add_proto(self, proto):
+        with self.protos_lock:
+            code = self.proto_codes.get(proto)
+            if code is None:
+                code = self.proto_codes[proto] = len(self.protos)
+                self.protos.append(proto)
+        return code
+
+    def pack_address(self, host):
+        """Returns IPv4 address as integer, None for host names and addresses not written in the canonical form
+
+        """
+        try:
+            packed = socket.inet_aton(host)
+        except OSError:
+            return None
+        if socket.inet_ntoa(packed) != host:
+            return None
+        return int.from_bytes(packed, 'big')
 
     def add(self, item):
-        with self._lock:
-            self._items.append(item)
+        host, port, proto = item
+        address = self.pack_address(host)
+        shard = self.shards[(hash(host) if address is None else address) % self.SHARDS]
+        code = self.proto_codes.get(proto)
+        if code is None:
+            code = self.add_proto(proto)
+        service = (port << self.PROTO_BITS) | code
+        if shard.add(host, address, service, self.sequence) and self.callback:
+            self.callback(item)
+
+    def __iter__(self):
+        shards = list()
+        for shard in self.shards:
+            with shard.lock:
+                shards.append((shard, len(shard.sequences)))
+        mask = (1 << self.PROTO_BITS) - 1
+        for _, index, shard in heapq.merge(*(shard.iter_indexes(count) for shard, count in shards)):
+            service = shard.services[index]
+            yield shard.get_host(shard.hosts[index]), service >> self.PROTO_BITS, self.protos[service & mask]
+
+    def __len__(self):
+        return sum(len(shard.sequences) for shard in self.shards)
 
     def get(self):
-        with self._lock:
-            return self._items
+        return list(self)
 
     def unique(self):
-        with self._lock:
-            return list(set(self._items))
+        return list(self)
+
+
+class Stage:
+    """Thread pool of a single module, optionally with a bounded queue blocking the submitter when full
+
+    A list of items can be fed from a thread of the stage, so that a full queue does not hold back other stages. An
+    error listed in `fatal` stops the stage, items not started yet are dropped and the error is kept in `error`.
+
+    """
+
+    def __init__(self, name, func, workers, queue_size=None, journal=None, metrics=None, fatal=()):
+        self.name = name
+        self.func = func
+        self.journal = journal
+        self.metrics = metrics
+        self.fatal = fatal
+        self.error = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.slots = None if queue_size is None else threading.BoundedSemaphore(queue_size)
+        self.feeder = None
+        self.stopped = threading.Event()
+
+    def feed(self, items):
+        self.feeder = threading.Thread(target=self.submit_all, args=(items,), name=f'{self.name}-feeder', daemon=True)
+        self.feeder.start()
+
+    def submit_all(self, items):
+        for item in items:
+            if self.stopped.is_set():
+                break
+            self.submit(item)
+
+    def submit(self, item):
+        if self.stopped.is_set():
+            return
+        if self.journal and self.journal.is_executed(self.name, item):
+            logs.logger.debug(f'Skipping {item} in {self.name}, already done')
+            return
+        if self.slots:
+            self.slots.acquire()
+        try:
+            future = self.executor.submit(self.run, item)
+        except RuntimeError:
+            # NOTE: Executor was shut down on cancel or error while waiting for a free slot
+            if self.slots:
+                self.slots.release()
+            return
+        future.add_done_callback(lambda future: self.done(future, item))
+        if self.metrics:
+            self.metrics.count('queued_total', stage=self.name.lower())
+
+    def run(self, item):
+        if not self.metrics:
+            return self.func(item)
+        with self.metrics.track(self.name.lower()):
+            return self.func(item)
+
+    def done(self, future, item):
+        try:
+            if future.cancelled():
+                return
+            try:
+                future.result()
+            except self.fatal as exc:
+                self.stop(exc)
+            except Exception as exc:
+                logs.logger.debug(f'Exception in {self.name}: {exc}')
+            else:
+                if self.journal:
+                    self.journal.module_done(self.name, item)
+        finally:
+            if self.slots:
+                self.slots.release()
+
+    def stop(self, error):
+        if self.error is None:
+            self.error = error
+        self.stopped.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def join(self):
+        """Waits until all fed items are queued
+
+        """
+        if self.feeder:
+            self.feeder.join()
+            self.feeder = None
+
+    def close(self, cancel=False):
+        if cancel:
+            self.stop(None)
+        self.join()
+        self.executor.shutdown(wait=not cancel)
 
 
 class Application:
@@ -65,14 +325,41 @@ class Application:
         PROTO_HTTP: 80,
         PROTO_HTTPS: 443,
     }
+    ENGINE_THREADS = 'threads'
+    ENGINE_ASYNCIO = 'asyncio'
+    ENGINES = (ENGINE_THREADS, ENGINE_ASYNCIO)
+    PROBE_ALPN_PROTOCOLS = ('http/1.1', '\r\n\r\n')
+    TLS_ERRORS = (OSError, ConnectionResetError, socket.timeout, ssl.SSLError)
     OUTPUT_DIR_EXT = '.pukpuk'
     OUTPUT_URLS_FILENAME = 'urls.txt'
+    SHARDS_DIRNAME = 'shards'
+    SOURCE_SCAN = 'scan'
+    SOURCE_CERTIFICATE = 'certificate'
+    SOURCE_RESOLVER = 'resolver'
     DEFAULT_BROWSER = 'chromium'
     DEFAULT_PORTS = ('80/http', '443/https')
     DEFAULT_WORKERS = 15
+    DEFAULT_ENGINE = ENGINE_THREADS
+    DEFAULT_CONNECTIONS = 500
     DEFAULT_PROCESS_TIMEOUT = 20
     DEFAULT_SOCKET_TIMEOUT = 3
+    DEFAULT_CONNECT_TIMEOUT = 1
+    DEFAULT_MIN_CONCURRENCY = 1
+    DEFAULT_MIN_RATE = 10
+    DEFAULT_MAX_RATE = 1000
+    DEFAULT_MAX_HOST_PROBES = 0
+    DEFAULT_MAX_SUBNET_PROBES = 0
+    DEFAULT_PROCESSES = 1
+    DEFAULT_PROGRESS_INTERVAL = 10
+    QUEUE_SIZE_FACTOR = 4
     DEFAULT_GRABBING_ATTEMPTS = 3
+    DEFAULT_BROWSER_POOL = 0
+    DEFAULT_BROWSER_PAGES = 100
+    BROWSER_MEMORY = 256 * 1024 * 1024
+    MEMINFO_PATH = '/proc/meminfo'
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_MAX_BODY_SIZE = 10 * 1024 * 1024
+    DEFAULT_RESPONSE_TIMEOUT = 30
 
     def __init__(
         self,
@@ -85,7 +372,34 @@ class Application:
         process_timeout=None,
         socket_timeout=None,
         skip_screens=False,
-        attempts=None
+        attempts=None,
+        engine=None,
+        connections=None,
+        sweep=False,
+        connect_timeout=None,
+        pipeline=False,
+        browser_pool=None,
+        browser_pages=None,
+        response_workers=None,
+        screen_workers=None,
+        pool_size=None,
+        max_body_size=None,
+        response_timeout=None,
+        baseline=None,
+        store=None,
+        bulk_ptr=False,
+        ptr_cache=None,
+        resolve_names=False,
+        adaptive=False,
+        min_concurrency=None,
+        min_rate=None,
+        max_rate=None,
+        max_host_probes=None,
+        max_subnet_probes=None,
+        shard=None,
+        processes=None,
+        progress_interval=None,
+        metrics_port=None
     ):
         self.patch()
         self.browser = self.DEFAULT_BROWSER if browser is None else browser
@@ -96,19 +410,69 @@ class Application:
         self.process_timeout = self.DEFAULT_PROCESS_TIMEOUT if process_timeout is None else process_timeout
         self.socket_timeout = self.DEFAULT_SOCKET_TIMEOUT if socket_timeout is None else socket_timeout
         self.time_budget = int(self.process_timeout * 1000)
-        self.nameserver = dns.resolver.Resolver(configure=True)
-        self.nameserver.timeout = self.socket_timeout
+        self.nameserver = None
+        self.bulk_ptr = bulk_ptr
+        self.resolve_names = resolve_names
+        self.resolver = names.Resolver()
+        self.ptr_cache_file = ptr_cache
+        self.ptr_cache = ptr.Cache()
+        self.certificates = certificates.Cache()
+        self.certificate_targets = set()
+        self.certificate_targets_lock = threading.Lock()
         self.workers = self.DEFAULT_WORKERS if workers is None else workers
+        self.response_workers = self.workers if response_workers is None else response_workers
+        self.screen_workers = self.get_screen_workers() if screen_workers is None else screen_workers
+        self.pool_size = self.DEFAULT_POOL_SIZE if pool_size is None else pool_size
+        self.max_body_size = self.DEFAULT_MAX_BODY_SIZE if max_body_size is None else max_body_size
+        self.response_timeout = self.DEFAULT_RESPONSE_TIMEOUT if response_timeout is None else response_timeout
         self.attempts = self.DEFAULT_GRABBING_ATTEMPTS if attempts is None else attempts
-        self.headers = requests.utils.default_headers()
-        self.user_agent = self.headers['User-Agent'] if user_agent is None else user_agent
+        self.engine = self.DEFAULT_ENGINE if engine is None else engine
+        self.connections = self.DEFAULT_CONNECTIONS if connections is None else connections
+        self.sweep = sweep
+        self.connect_timeout = self.DEFAULT_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        self.pipeline = pipeline
+        self.adaptive = adaptive
+        self.min_concurrency = self.DEFAULT_MIN_CONCURRENCY if min_concurrency is None else min_concurrency
+        self.min_rate = self.DEFAULT_MIN_RATE if min_rate is None else min_rate
+        self.max_rate = self.DEFAULT_MAX_RATE if max_rate is None else max_rate
+        self.throttle = None
+        self.max_host_probes = self.DEFAULT_MAX_HOST_PROBES if max_host_probes is None else max_host_probes
+        self.max_subnet_probes = self.DEFAULT_MAX_SUBNET_PROBES if max_subnet_probes is None else max_subnet_probes
+        self.scheduler = None
+        self.shard = shard
+        self.processes = self.DEFAULT_PROCESSES if processes is None else processes
+        self.metrics = metrics.Metrics()
+        self.metrics_port = metrics_port
+        self.progress_interval = self.DEFAULT_PROGRESS_INTERVAL if progress_interval is None else progress_interval
+        self.progress = None
+        self.progress_stage = None
+        self.progress_total = None
+        self.progress_started = None
+        self.expected_hosts = 0
+        self.baseline = baseline
+        self.changes = None
+        self.validators = validators.Validators()
+        self.store = store
+        self.blobs = None
+        self.index = blobs.Index()
+        self.db = database.Database()
+        self.browser_pool = self.DEFAULT_BROWSER_POOL if browser_pool is None else browser_pool
+        self.browser_pages = self.DEFAULT_BROWSER_PAGES if browser_pages is None else browser_pages
+        self.urls_lock = threading.Lock()
+        self.headers = None
+        self.user_agent = user_agent
         self.output_dir = self.get_output_dir() if output_dir is None else output_dir
         self.discovered = Results()
         self.urls = list()
         self.ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
         self.ssl_ctx.check_hostname = False
         self.ssl_ctx.verify_mode = ssl.CERT_NONE
+        # NOTE: Line terminators in ClientHello make line based plaintext servers reply instead of waiting for more
+        self.ssl_ctx.set_alpn_protocols(self.PROBE_ALPN_PROTOCOLS)
         self.modules = None
+        self.stages = list()
+        self.journal = journal.Journal()
+        self.args = list()
 
     def get_parser(self):
         parser = CustomArgumentParser(
@@ -130,12 +494,41 @@ class Application:
         parser.add_argument('-U', '--urls', help='Loads specific URLs from a file, skips discovery and ignores the `-p` argument for these')
         parser.add_argument('-p', '--ports', default=','.join(self.ports), help='Comma separated port list for HTTP service discovery [Default: ' + ', '.join(self.ports) + ']')
         parser.add_argument('-b', '--browser', default=self.browser, help='Chromium browser path for headless screen grabbing [Default: ' + self.browser + ']')
+        parser.add_argument('--browser-pool', default=self.browser_pool, type=int, help='Number of long-lived browsers driven over DevTools protocol, 0 starts a new browser for every screen [Default: ' + str(self.browser_pool) + ']')
+        parser.add_argument('--browser-pages', default=self.browser_pages, type=int, help='Number of pages after which a pooled browser is restarted [Default: ' + str(self.browser_pages) + ']')
         parser.add_argument('-r', '--randomize', action='store_true', default=self.randomize, help='Randomize scanning order')
         parser.add_argument('-o', '--output-dir', default=self.output_dir, help='Path where results (text files, images) will be stored [Default: ' + self.output_dir + ']')
-        parser.add_argument('-u', '--user-agent', default=self.user_agent, help='Browser User-Agent header [Default: ' + self.user_agent + ']')
-        parser.add_argument('-w', '--workers', default=self.workers, type=int, help='Number of concurrent workers [Default: ' + str(self.workers) + ']')
+        parser.add_argument('-u', '--user-agent', default=self.user_agent, help='Browser User-Agent header [Default: ' + (self.user_agent or 'the one of python-requests') + ']')
+        parser.add_argument('-w', '--workers', default=self.workers, type=int, help='Number of concurrent discovery workers [Default: ' + str(self.workers) + ']')
+        parser.add_argument('--response-workers', type=int, help='Number of concurrent HTTP requests [Default: same as `-w`]')
+        parser.add_argument('--pool-size', default=self.pool_size, type=int, help='Number of keep-alive HTTP connections per IP address and port [Default: ' + str(self.pool_size) + ']')
+        parser.add_argument('--screen-workers', default=self.screen_workers, type=int, help='Number of concurrent screen grabs [Default: based on CPU count and available memory]')
+        parser.add_argument('-e', '--engine', default=self.engine, choices=self.ENGINES, help='Discovery engine, `asyncio` keeps many connections in flight on a single event loop [Default: ' + self.engine + ']')
+        parser.add_argument('-c', '--connections', default=self.connections, type=int, help='Number of concurrent connections for the `asyncio` discovery engine [Default: ' + str(self.connections) + ']')
         parser.add_argument('--process-timeout', type=float, default=self.process_timeout, help='Process timeout in seconds [Default: ' + str(self.process_timeout) + ']')
+        parser.add_argument('--max-body-size', default=self.max_body_size, type=int, help='Maximum number of response body bytes stored, longer bodies are truncated [Default: ' + str(self.max_body_size) + ']')
+        parser.add_argument('--response-timeout', type=float, default=self.response_timeout, help='Maximum time in seconds spent reading a single response body [Default: ' + str(self.response_timeout) + ']')
         parser.add_argument('--socket-timeout', type=float, default=self.socket_timeout, help='Socket timeout in seconds [Default: ' + str(self.socket_timeout) + ']')
+        parser.add_argument('--sweep', action='store_true', default=self.sweep, help='Sweep all targets with non-blocking connects first and examine open ports only')
+        parser.add_argument('--connect-timeout', type=float, default=self.connect_timeout, help='Connect timeout in seconds for the sweep [Default: ' + str(self.connect_timeout) + ']')
+        parser.add_argument('--max-host-probes', default=self.max_host_probes, type=int, help='Maximum number of discovery probes of a single host at once, 0 means no limit [Default: ' + str(self.max_host_probes) + ']')
+        parser.add_argument('--max-subnet-probes', default=self.max_subnet_probes, type=int, help='Maximum number of discovery probes of a single /24 subnet at once, 0 means no limit [Default: ' + str(self.max_subnet_probes) + ']')
+        parser.add_argument('--adaptive', action='store_true', default=self.adaptive, help='Adapt number of probes in flight and probes per second of every /24 subnet to timeouts and resets, between the minimums and `-w` or `-c` and `--max-rate`')
+        parser.add_argument('--min-concurrency', default=self.min_concurrency, type=int, help='Minimum number of probes in flight per subnet in adaptive mode [Default: ' + str(self.min_concurrency) + ']')
+        parser.add_argument('--min-rate', default=self.min_rate, type=float, help='Minimum number of probes per second per subnet in adaptive mode [Default: ' + str(self.min_rate) + ']')
+        parser.add_argument('--max-rate', default=self.max_rate, type=float, help='Maximum number of probes per second per subnet in adaptive mode [Default: ' + str(self.max_rate) + ']')
+        parser.add_argument('--bulk-ptr', action='store_true', default=self.bulk_ptr, help='Resolve PTR records of all discovered addresses concurrently once discovery finishes instead of for every open port')
+        parser.add_argument('--ptr-cache', metavar='FILE', help='Keeps PTR records in a file which can be shared by scans, records are reused until their TTL expires')
+        parser.add_argument('--resolve-names', action='store_true', default=self.resolve_names, help='Look up host names from certificates and PTR records in DNS instead of requesting them from the address they were found on')
+        parser.add_argument('--pipeline', action='store_true', default=self.pipeline, help='Run modules for every URL as soon as it is discovered instead of waiting for discovery to finish')
+        parser.add_argument('--baseline', metavar='OUTPUT_DIR', help='Compares results with a previous scan, unchanged files are linked to the ones in its output directory and differences are listed in `changes.txt`')
+        parser.add_argument('--store', metavar='DIRECTORY', help='Keeps response bodies and screens in a content-addressed store which can be shared by scans, `index.jsonl` in the output directory maps URLs to stored files')
+        parser.add_argument('--shard', metavar='I/N', type=shard, help='Scans only the I-th of N parts of the targets, hosts are assigned to parts by their hash so that shards can run on different machines')
+        parser.add_argument('-P', '--processes', default=self.processes, type=int, help='Number of processes scanning a shard each, their results are merged into the output directory [Default: ' + str(self.processes) + ']')
+        parser.add_argument('--merge', metavar='OUTPUT_DIR', nargs='+', help='Merges results of shards into the output directory instead of scanning')
+        parser.add_argument('--resume', metavar='OUTPUT_DIR', help='Resumes interrupted scan skipping targets and URLs already done, arguments of the scan are loaded from the journal in its output directory')
+        parser.add_argument('--progress', dest='progress_interval', metavar='SECONDS', default=self.progress_interval, type=float, help='Interval of progress lines with throughput, probes in flight and estimated time left, 0 disables them [Default: ' + str(self.progress_interval) + ']')
+        parser.add_argument('--metrics-port', metavar='PORT', type=int, help='Serves counters and latency histograms in Prometheus text format on a local port while scanning, `metrics.json` in the output directory has them at the end regardless')
         parser.add_argument('--skip-screens', action='store_true', default=self.skip_screens, help='Skip screen grabbing')
         parser.add_argument('--grabbing-attempts', default=self.attempts, type=int, help='Number of screen grabbing attempts [Default: ' + str(self.attempts) + ']')
         parser.add_argument('-v', '--version', action='version', version=version.__version__, help='Print version')
@@ -146,11 +539,10 @@ class Application:
 
     def patch(self):
         logs.logger.debug(f'Patching')
-        urllib3.disable_warnings()
         atexit.unregister(concurrent.futures.thread._python_exit)
 
     def targets_from_network(self, network):
-        """Converts network string to list of IP addresses
+        """Converts network string to lazily generated IP addresses, in pseudorandom order if randomizing
 
         """
         logs.logger.debug(f'Targets from `network` argument: {network}')
@@ -160,24 +552,38 @@ class Application:
         except (netaddr.core.AddrFormatError, ValueError):
             pass
         try:
-            ips = netaddr.iter_iprange(*network.split('-'))
-        except TypeError:
+            ips = netaddr.IPRange(*network.split('-'))
+        except (netaddr.core.AddrFormatError, TypeError):
             pass
         if ips:
-            for ip in ips:
-                yield (str(ip), None, None)
+            self.expected_hosts += ips.size
+            return self.iter_addresses(ips)
         else:
             logs.logger.error(f'Invalid `network` argument: {network}')
             sys.exit(errno.EINVAL)
 
+    def iter_addresses(self, ips):
+        if self.randomize:
+            for index in sequences.Permutation(ips.size):
+                yield (str(ips[index]), None, None)
+        else:
+            for ip in ips:
+                yield (str(ip), None, None)
+
     def targets_from_file(self, path):
-        """Loads list of IP addresses and host names from a text file
+        """Loads list of IP addresses and host names from a text file, shuffled within a window if randomizing
 
         """
         logs.logger.debug(f'Targets from file `{path}`')
+        targets = self.iter_file(path)
+        if self.randomize:
+            targets = sequences.shuffled(targets)
+        for line in targets:
+            yield (line.strip(), None, None)
+
+    def iter_file(self, path):
         with open(path) as fil:
-            for line in fil:
-                yield (line.strip(), None, None)
+            yield from fil
 
     def urls_from_file(self, path):
         """Loads list of URLs from a text file
@@ -188,6 +594,12 @@ class Application:
             for line in fil:
                 yield line.strip()
 
+    def in_shard(self, host):
+        return self.shard is None or sequences.in_shard(host, self.shard)
+
+    def in_shard_url(self, url):
+        return self.in_shard(urllib.parse.urlsplit(url).hostname or '')
+
     def get_url(self, host, port, proto):
         """Converts (host, port, protocol) tuple to URL
 
@@ -205,52 +617,196 @@ class Application:
         return name
 
     def sock_connect(self, host, port):
-        logs.logger.debug(f'Connecting to `{host}:{port}`')
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(self.socket_timeout)
-        try:
-            sock.connect((host, port))
-        except Exception as exc:
-            logs.logger.debug(f'Error when connecting to `{host}:{port}`: {exc}')
-        else:
-            return sock
+        for attempt in itertools.count():
+            ticket = self.throttle.acquire(host) if self.throttle else None
+            logs.logger.debug(f'Connecting to `{host}:{port}`')
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(self.socket_timeout)
+            started = time.monotonic()
+            try:
+                sock.connect((host, port))
+            except Exception as exc:
+                logs.logger.debug(f'Error when connecting to `{host}:{port}`: {exc}')
+                sock.close()
+                sock, outcome = None, throttle.get_outcome(exc)
+            else:
+                outcome = throttle.CONNECTED
+            self.metrics.observe('connect_seconds', time.monotonic() - started, outcome=outcome)
+            if ticket is None:
+                return sock
+            self.throttle.release(ticket, host, outcome, time.monotonic() - started)
+            if not self.throttle.should_retry(host, outcome, attempt):
+                return sock
+            logs.logger.debug(f'Retrying `{host}:{port}` of host which replied before')
 
-    def port_test(self, host, port):
-        """Check if given service is HTTP(S), returns None otherwise
+    def head(self, host, port):
+        """Sends plaintext HEAD request over a new connection, returns the reply
 
         """
         sock = self.sock_connect(host, port)
+        if not sock:
+            return b''
         request = 'HEAD / HTTP/1.0\r\nHost: {}\r\nAccept: text/html\r\n\r\n'.format(host)
-        sock.sendall(request.encode('ascii'))
-        check_https = False
         try:
-            response = sock.recv(4096)
-        except ConnectionResetError:
-            check_https = True
-            response = ''
-        else:
-            if response:
-                if b'400' in response and b'Bad Request' in response:
-                    check_https = True
-            else:
-                check_https = True
-        sock.close()
-
-        if check_https:
-            logs.logger.debug(f'Checking if `{host}:{port}` is encrypted')
-            sock = self.sock_connect(host, port)
-            try:
-                ssock = self.ssl_ctx.wrap_socket(sock, server_hostname=host)
-                ssock.getpeercert(True)
-            except (ConnectionResetError, socket.timeout, ssl.SSLError):
-                logs.logger.debug(f'Probably not encrypted `{host}:{port}`')
-            else:
-                return self.PROTO_HTTPS
+            sock.sendall(request.encode('ascii'))
+            return sock.recv(4096)
+        except (ConnectionResetError, socket.timeout):
+            return b''
+        finally:
             sock.close()
-        else:
-            if b'HTTP' in response:
-                return self.PROTO_HTTP
-        return self.PROTO_UNKNOWN
+
+    def tls_handshake(self, sock, host):
+        """Performs TLS handshake over connected socket, returns the handshake state
+
+        """
+        handshake = tls.Handshake(self.ssl_ctx, host)
+        try:
+            while not handshake.step():
+                sock.sendall(handshake.pending())
+                if not handshake.receive(sock.recv(4096)):
+                    break
+        except self.TLS_ERRORS as exc:
+            logs.logger.debug(f'TLS handshake with `{host}` failed: {exc}')
+        return handshake
+
+    def is_http(self, response):
+        return response.startswith(b'HTTP/')
+
+    def port_test(self, host, port, sock):
+        """Check if given service is HTTP(S) using connected socket, returns protocol (None otherwise) and certificate
+
+        Sends TLS ClientHello first, a plaintext reply is examined as is and only if it is inconclusive a separate
+        plaintext request is made.
+
+        """
+        logs.logger.debug(f'Checking if `{host}:{port}` is encrypted')
+        handshake = self.tls_handshake(sock, host)
+        if handshake.done:
+            return self.PROTO_HTTPS, handshake.certificate()
+        if handshake.encrypted:
+            logs.logger.debug(f'Encrypted but not completed handshake `{host}:{port}`')
+            return self.PROTO_UNKNOWN, None
+        logs.logger.debug(f'Probably not encrypted `{host}:{port}`')
+        if handshake.plaintext and self.is_http(handshake.plaintext):
+            return self.PROTO_HTTP, None
+        if b'HTTP' in self.head(host, port):
+            return self.PROTO_HTTP, None
+        return self.PROTO_UNKNOWN, None
+
+    def is_address(self, host):
+        try:
+            netaddr.IPAddress(host)
+        except netaddr.core.AddrFormatError:
+            logs.logger.debug(f'`{host}` is not IP address')
+            return False
+        return True
+
+    def add_certificate(self, cert):
+        """Returns DER encoded certificate parsed once per fingerprint, new ones are recorded in the database
+
+        """
+        started = time.monotonic()
+        certificate, parsed = self.certificates.get(cert)
+        if parsed:
+            self.metrics.observe('certificate_parse_seconds', time.monotonic() - started)
+            self.db.add_certificate(certificate)
+        self.metrics.count('certificates_total', cache='miss' if parsed else 'hit')
+        return certificate
+
+    def add_certificate_hosts(self, host, port, proto, certificate):
+        # NOTE: Certificate served on many addresses yields the same targets for every one of them
+        with self.certificate_targets_lock:
+            if (certificate.fingerprint, port, proto) in self.certificate_targets:
+                return
+            self.certificate_targets.add((certificate.fingerprint, port, proto))
+        logs.logger.debug(f'Adding hosts from certificate of `{host}:{port}`')
+        for cert_host in certificate.hosts():
+            if cert_host != host:
+                self.pin_host(cert_host, host)
+                self.discovered.add((cert_host, port, proto))
+                self.db.add_service(cert_host, port, proto, self.SOURCE_CERTIFICATE)
+                logs.logger.info(f'Added `{proto}://{cert_host}:{port}` to discoveries (from certificate)')
+
+    def get_ptr_name(self, response):
+        try:
+            return list(response.rrset.items.keys())[0].to_text().rstrip('.').lower()
+        except (KeyError, IndexError):
+            return None
+
+    def get_resolver_errors(self):
+        return (dns_resolver.NXDOMAIN, dns_resolver.NoNameservers, dns_resolver.NoAnswer, dns_exception.Timeout)
+
+    def get_nameserver(self):
+        if self.nameserver is None:
+            nameserver = dns_resolver.Resolver(configure=True)
+            nameserver.timeout = self.socket_timeout
+            self.nameserver = nameserver
+        return self.nameserver
+
+    def lookup_address(self, address):
+        """Queries PTR record of address, returns the name (None if there is none) and TTL of the answer
+
+        """
+        started = time.monotonic()
+        try:
+            response = self.get_nameserver().resolve_address(address)
+        except self.get_resolver_errors():
+            logs.logger.debug(f'Could not resolve `{address}`')
+            self.metrics.observe('ptr_lookup_seconds', time.monotonic() - started, outcome='missing')
+            return None, self.ptr_cache.NEGATIVE_TTL
+        self.metrics.observe('ptr_lookup_seconds', time.monotonic() - started, outcome='found')
+        return self.get_ptr_name(response), response.rrset.ttl
+
+    def pin_host(self, name, host):
+        """Makes modules request host name derived from a discovered host from that host, without a DNS lookup
+
+        """
+        if not self.resolve_names and self.resolver.pin(name, host):
+            self.journal.add_pinned(name, host)
+
+    def add_resolved_host(self, host, port, proto, fqdn_host):
+        if fqdn_host and names.is_host_name(fqdn_host):
+            self.pin_host(fqdn_host, host)
+            logs.logger.info(f'Added `{proto}://{fqdn_host}:{port}` to discoveries (from resolver)')
+            self.discovered.add((fqdn_host, port, proto))
+            self.db.add_service(fqdn_host, port, proto, self.SOURCE_RESOLVER)
+
+    def add_service(self, host, port, proto, cert, probe_time):
+        """Adds service examined by discovery, if HTTPS add all extra host names from the certificate too
+
+        """
+        self.discovered.add((host, port, proto))
+        logs.logger.info(f'Added `{proto}://{host}:{port}` to discoveries')
+        certificate = self.add_certificate(cert) if cert else None
+        self.db.add_service(host, port, proto, self.SOURCE_SCAN, probe_time, certificate and certificate.fingerprint)
+        if certificate:
+            self.add_certificate_hosts(host, port, proto, certificate)
+
+    def schedule(self, targets, concurrency):
+        """Limits probes per host and per subnet if requested
+
+        """
+        if not (self.max_host_probes or self.max_subnet_probes):
+            return targets
+        self.scheduler = throttle.Scheduler(
+            targets,
+            self.max_host_probes,
+            self.max_subnet_probes,
+            concurrency * self.QUEUE_SIZE_FACTOR,
+        )
+        return self.scheduler
+
+    def release_target(self, target):
+        if self.scheduler:
+            self.scheduler.release(target)
+
+    def discover_target(self, target):
+        try:
+            with self.metrics.track('discovery'):
+                self.discover(target)
+        finally:
+            self.release_target(target)
+        self.journal.target_done(target)
 
     def discover(self, target):
         """Adds successfully connected ports to targets, parse HTTPS certificate if applicable
@@ -258,101 +814,310 @@ class Application:
         """
         logs.logger.debug(f'Discovering `{target}`')
         host, port, proto = target
-        if not proto:
-            proto = self.port_test(host, port)
+        started = time.monotonic()
+        sock = self.sock_connect(host, port)
+        if not sock:
+            return
+        cert = None
+        try:
+            if not proto:
+                port_test_started = time.monotonic()
+                proto, cert = self.port_test(host, port, sock)
+                self.metrics.observe('port_test_seconds', time.monotonic() - port_test_started, proto=proto or 'unknown')
+            elif proto == self.PROTO_HTTPS:
+                handshake = self.tls_handshake(sock, host)
+                if handshake.done:
+                    cert = handshake.certificate()
+                else:
+                    logs.logger.debug(f'Probably not encrypted `{host}:{port}`')
+        finally:
+            sock.close()
 
         if proto is self.PROTO_UNKNOWN:
             return
 
-        sock = self.sock_connect(host, port)
-        if sock:
-            self.discovered.add((host, port, proto))
-            logs.logger.info(f'Added `{proto}://{host}:{port}` to discoveries')
-            # NOTE: If HTTPS extract certificate details and add all extra host names to the list
-            if proto == self.PROTO_HTTPS:
-                try:
-                    ssock = self.ssl_ctx.wrap_socket(sock, server_hostname=host)
-                    cert = ssock.getpeercert(True)
-                except (OSError, ConnectionResetError, socket.timeout, ssl.SSLError):
-                    logs.logger.debug(f'Probably not encrypted `{host}:{port}`')
-                else:
-                    logs.logger.debug(f'Parsing certificate for `{host}:{port}`')
-                    x509 = crypto.load_certificate(crypto.FILETYPE_ASN1, cert)
-                    for i in range(0, x509.get_extension_count()):
-                        ext = x509.get_extension(i)
-                        if 'subjectAltName' in str(ext.get_short_name()):
-                            for alt in [alt.split(':')[1] for alt in str(ext).split(',')]:
-                                if not ('*' in alt or '@' in alt):
-                                    try:
-                                        int(alt)
-                                    except ValueError:
-                                        cert_host = alt.lower()
-                                        if cert_host != host:
-                                            self.discovered.add((cert_host, port, proto))
-                                            logs.logger.info(f'Added `{proto}://{cert_host}:{port}` to discoveries (from certificate)')
+        self.add_service(host, port, proto, cert, time.monotonic() - started)
+        if not self.bulk_ptr and self.is_address(host):
+            self.add_resolved_host(host, port, proto, self.ptr_cache.resolve(host, self.lookup_address))
+
+    def resolve_discovered(self):
+        """Resolves PTR records of all discovered addresses at once, names are added with ports of their addresses
+
+        """
+        services = [target for target in self.discovered.unique() if self.is_address(target[0])]
+        addresses = set(host for host, _, _ in services)
+        logs.logger.info(f'Resolving {len(addresses)} addresses')
+        aio.ReverseLookup(self).run(addresses)
+        for host, port, proto in services:
+            self.add_resolved_host(host, port, proto, self.ptr_cache.get(host)[1])
+
+    def expand_target(self, target, services):
+        if all(target):
+            return (target,)
+        host, port, proto = target
+        if port is None and proto:
+            return ((host, self.PROTO_PORTS[proto], proto),)
+        return ((host, port, proto) for port, proto in services)
+
+    def expand_groups(self, targets, services):
+        """Pairs targets lacking port or protocol with services, yields lazy groups of unique (host, port, protocol)
+        tuples, one group per target
+
+        """
+        seen = sequences.TargetFilter()
+        for target in targets:
+            if not self.in_shard(target[0]):
+                continue
+            yield (discovery_target for discovery_target in self.expand_target(target, services) if seen.add(discovery_target))
+
+    def expand_targets(self, targets, services):
+        return itertools.chain.from_iterable(self.expand_groups(targets, services))
+
+    def submit_all(self, executor, func, items, workers):
+        """Submits items to executor keeping a bounded number of them queued
+
+        """
+        pending = set()
+        try:
+            for item in items:
+                if len(pending) >= workers * self.QUEUE_SIZE_FACTOR:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    self.collect(done)
+                pending.add(executor.submit(func, item))
+            self.collect(concurrent.futures.as_completed(pending))
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def collect(self, futures):
+        for future in futures:
             try:
-                netaddr.IPAddress(host)
-            except netaddr.core.AddrFormatError:
-                logs.logger.debug(f'`{host}` is not IP address')
-            else:
-                try:
-                    response = self.nameserver.resolve_address(host)
-                except (dns.resolver.NXDOMAIN, dns.resolver.NoNameservers, dns.resolver.NoAnswer, dns.exception.Timeout):
-                    logs.logger.debug(f'Could not resolve `{host}`')
-                else:
-                    try:
-                        fqdn = list(response.rrset.items.keys())[0].to_text().rstrip('.')
-                    except KeyError:
-                        pass
-                    else:
-                        fqdn_host = fqdn.lower()
-                        logs.logger.info(f'Added `{proto}://{fqdn_host}:{port}` to discoveries (from resolver)')
-                        self.discovered.add((fqdn_host, port, proto))
-            sock.close()
+                future.result()
+            except Exception as exc:
+                logs.logger.debug(f'Exception: {exc}')
 
     def get_discovery_targets(self, targets, services):
-        discovery_targets = list()
-        for target in targets:
-            if all(target):
-                discovery_targets.append(target)
-            else:
-                host, port, proto = target
-                if port is None and proto:
-                    discovery_targets.append((host, self.PROTO_PORTS[proto], proto))
-                else:
-                    for port, proto in services:
-                        discovery_targets.append((host, port, proto))
-        discovery_targets = set(discovery_targets)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-            futures = [
-                executor.submit(self.discover, target) for target in discovery_targets
-            ]
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    future.result()
-                except KeyboardInterrupt:
-                    executor.shutdown(wait=False, cancel_futures=True)
-                except Exception as exc:
-                    logs.logger.debug(f'Exception: {exc}')
+        for name, host in self.journal.pinned.items():
+            self.resolver.pin(name, host)
+        for target in self.journal.discovered:
+            self.discovered.add(target)
+        concurrency = self.connections if self.engine == self.ENGINE_ASYNCIO else self.workers
+        groups = self.expand_groups(targets, services)
+        if self.randomize:
+            discovery_targets = sequences.shuffled(itertools.chain.from_iterable(groups))
+        else:
+            # NOTE: Ports of consecutive hosts take turns instead of all workers probing the same host
+            discovery_targets = sequences.interleaved(groups, self.connections if self.sweep else concurrency)
+        discovery_targets = self.skip_done(discovery_targets)
+        if self.adaptive:
+            self.throttle = throttle.Throttle(
+                self.min_concurrency,
+                self.connections if self.sweep else concurrency,
+                self.min_rate,
+                self.max_rate,
+            )
+        total = self.get_expected_targets(services)
+        if self.sweep:
+            self.set_progress_stage('sweep', total)
+            discovery_targets = aio.Sweep(self).run(self.schedule(discovery_targets, self.connections))
+            total = len(discovery_targets)
+        self.set_progress_stage('discovery', total)
+        if self.engine == self.ENGINE_ASYNCIO:
+            aio.Discovery(self).run(self.schedule(discovery_targets, concurrency))
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                self.submit_all(executor, self.discover_target, self.schedule(discovery_targets, concurrency), self.workers)
+        self.set_progress_stage(None, None)
+        self.scheduler = None
+        if self.throttle:
+            self.throttle.report()
+            self.throttle = None
+        if self.bulk_ptr:
+            self.resolve_discovered()
         result = self.discovered.unique()
         if self.randomize:
             random.shuffle(result)
         return result
 
+    def skip_done(self, targets):
+        for target in targets:
+            if self.journal.is_target_done(target):
+                self.metrics.count('skipped_targets_total')
+            else:
+                yield target
+
+    def get_expected_targets(self, services):
+        """Estimates number of discovery targets from the size of network ranges and host files, None if unknown
+
+        """
+        if not self.expected_hosts:
+            return None
+        total = self.expected_hosts * len(services)
+        if self.shard:
+            total //= self.shard[1]
+        return total
+
+    def set_progress_stage(self, stage, total):
+        if self.progress_stage:
+            self.metrics.count('stage_seconds_total', time.monotonic() - self.progress_started, stage=self.progress_stage)
+        self.progress_stage = stage
+        self.progress_total = total
+        self.progress_started = time.monotonic()
+
+    def describe_progress(self):
+        """Returns progress line with throughput of the running discovery stage, targets in flight, estimated time
+        left and number of URLs done by every module
+
+        """
+        parts = list()
+        stage = self.progress_stage
+        if stage:
+            done = self.metrics.get_count(f'{stage}_seconds')
+            elapsed = time.monotonic() - self.progress_started
+            rate = done / elapsed if elapsed else 0
+            total = self.progress_total
+            if total and (stage == 'sweep' or not self.sweep):
+                # NOTE: Targets done before resuming are skipped ahead of the sweep, the estimate counts them too
+                total = max(total - self.metrics.get('skipped_targets_total'), done)
+            parts.append(
+                f'{stage.capitalize()} {done}{"/" + str(total) if total else ""} targets ({rate:.1f}/s), '
+                f'{self.metrics.in_flight(stage)} in flight'
+            )
+            if total and rate:
+                parts.append(f'ETA {metrics.format_duration(max(total - done, 0) / rate)}')
+        for stage in self.stages:
+            name = stage.name.lower()
+            parts.append(f'{name} {self.metrics.get_count(name + "_seconds")}/{self.metrics.get("queued_total", stage=name)}')
+        return 'Progress: ' + ', '.join(parts)
+
+    def get_screen_workers(self):
+        """Number of concurrent browsers the machine can afford, based on CPU count and available memory
+
+        """
+        workers = os.cpu_count() or 1
+        available = self.get_available_memory()
+        if available is not None:
+            workers = min(workers, available // self.BROWSER_MEMORY)
+        return max(workers, 1)
+
+    def get_available_memory(self):
+        """Memory available for new processes without swapping, i.e. including reclaimable page cache, None if unknown
+
+        """
+        try:
+            with open(self.MEMINFO_PATH) as fil:
+                for line in fil:
+                    key, _, value = line.partition(':')
+                    if key == 'MemAvailable':
+                        return int(value.split()[0]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        # NOTE: Free pages only, undercounts on hosts with page cache, used where /proc/meminfo is missing
+        try:
+            return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (AttributeError, ValueError, OSError):
+            return None
+
     def execute(self, url):
-        for module in self.modules:
-            module.execute(url)
+        """Queues URL to the stage of every module, each stage runs at its own pace
+
+        """
+        for stage in self.stages:
+            stage.submit(url)
+
+    def execute_all(self, urls):
+        """Feeds URLs to the stage of every module from its own thread, a stage with a full queue, e.g. screens, does
+        not hold back the others
+
+        """
+        for stage in self.stages:
+            stage.feed(urls)
+        for stage in self.stages:
+            stage.join()
 
     def run(self, targets, services=None):
         self.finished = False
+        if self.baseline:
+            self.changes = changes.Changes(self, self.baseline)
+            if not self.changes.load():
+                logs.logger.error(f'Error: no results found in `{self.baseline}`')
+                sys.exit(errno.ENOENT)
+            self.validators.load(self.baseline)
+        if self.ptr_cache_file:
+            self.ptr_cache.load(self.ptr_cache_file)
+        urllib3.disable_warnings()
+        self.headers = requests.utils.default_headers()
+        if self.user_agent is None:
+            self.user_agent = self.headers['User-Agent']
+        self.headers['User-Agent'] = self.user_agent
         self.modules = [
             mods.Responses(self),
         ]
         if not self.skip_screens:
             self.modules.append(mods.Screens(self))
         if self.randomize:
-            random.shuffle(targets)
             random.shuffle(services)
+        # NOTE: Modules are fed while discovery is still running in pipelined mode, queues cannot block the discovery
+        self.stages = [
+            Stage(
+                module.name,
+                module.execute,
+                module.workers,
+                None if self.pipeline else module.workers * self.QUEUE_SIZE_FACTOR,
+                self.journal,
+                self.metrics,
+                module.FATAL_ERRORS,
+            )
+            for module in self.modules
+        ]
+        if self.metrics_port is not None:
+            self.metrics.serve(self.metrics_port)
+        self.progress = metrics.Progress(self.describe_progress, self.progress_interval)
+        self.progress.start()
+        self.journal.open(self.output_dir, self.args)
+        self.validators.open(self.output_dir)
+        self.db.open(self.output_dir)
+        if self.store:
+            self.blobs = blobs.BlobStore(self.store)
+            self.index.open(self.output_dir)
+        self.discovered.callback = self.on_discovered
+        cancel = False
+        try:
+            if self.pipeline:
+                self.run_pipelined(targets, services)
+            else:
+                self.run_sequential(targets, services)
+        except KeyboardInterrupt:
+            cancel = True
+            raise
+        finally:
+            self.discovered.callback = None
+            for stage in self.stages:
+                stage.close(cancel)
+            for module in self.modules:
+                module.close()
+            self.journal.close()
+            self.validators.close()
+            self.index.close()
+            self.db.close()
+            if self.ptr_cache_file:
+                self.ptr_cache.save(self.ptr_cache_file)
+            self.progress.stop()
+            self.metrics.write(self.output_dir)
+            self.metrics.close()
+            if self.changes and not cancel:
+                self.changes.report(self.urls)
+        for stage in self.stages:
+            if stage.error:
+                logs.logger.error(stage.error)
+                sys.exit(1)
+        self.finished = True
+        logs.logger.info(f'Finished, results in `{self.output_dir}`')
+
+    def run_sequential(self, targets, services):
+        """Runs modules once discovery is finished
+
+        """
         logs.logger.info(f'Discovery in progress')
         discovery_targets = self.get_discovery_targets(targets, services)
         self.urls.extend([self.get_url(*target) for target in discovery_targets])
@@ -362,42 +1127,136 @@ class Application:
             logs.logger.info(f'Nothing to do!')
             sys.exit()
         pathlib.Path(self.output_dir, self.OUTPUT_URLS_FILENAME).write_text('\n'.join(self.urls))
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-            futures = [
-                executor.submit(self.execute, url) for url in self.urls
-            ]
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    future.result()
-                except KeyboardInterrupt:
-                    executor.shutdown(wait=False, cancel_futures=True)
-                except Exception as exc:
-                    logs.logger.debug(f'Exception: {exc}')
-        self.finished = True
-        logs.logger.info(f'Finished, results in `{self.output_dir}`')
+        self.execute_all(self.urls)
 
-    def parse(self, args):
-        parser = self.get_parser()
+    def run_pipelined(self, targets, services):
+        """Runs modules in a separate pool for every URL as soon as it is added to discoveries
+
+        """
+        urls_path = pathlib.Path(self.output_dir, self.OUTPUT_URLS_FILENAME)
+        urls_path.write_text('')
+        for url in list(self.urls):
+            self.queue_url(url)
+        logs.logger.info(f'Discovery in progress, running modules')
+        self.get_discovery_targets(targets, services)
+        logs.logger.info(f'Discovery finished, waiting for modules')
+        if not self.urls:
+            logs.logger.info(f'Nothing to do!')
+            sys.exit()
+
+    def on_discovered(self, target):
+        self.journal.add_discovered(target)
+        if self.pipeline:
+            self.queue_url(self.get_url(*target), discovered=True)
+
+    def queue_url(self, url, discovered=False):
+        with self.urls_lock:
+            if discovered:
+                self.urls.append(url)
+            with open(pathlib.Path(self.output_dir, self.OUTPUT_URLS_FILENAME), 'a') as fil:
+                fil.write(url + '\n')
+        self.execute(url)
+
+    def run_shards(self):
+        """Runs the scan in a process per shard and merges their results
+
+        """
+        directories = [
+            str(pathlib.Path(self.output_dir, self.SHARDS_DIRNAME, str(index))) for index in range(1, self.processes + 1)
+        ]
+        logs.logger.info(f'Running {self.processes} shards in `{pathlib.Path(self.output_dir, self.SHARDS_DIRNAME)}`')
+        # NOTE: Later arguments take precedence, browsers of all shards share the machine
+        processes = [
+            subprocess.Popen([
+                sys.executable, '-m', 'pukpuk.cli',
+                '--screen-workers', str(max(self.screen_workers // self.processes, 1)),
+                *self.args,
+                '--processes', '1',
+                '--shard', f'{index}/{self.processes}',
+                '--output-dir', directory,
+            ])
+            for index, directory in enumerate(directories, 1)
+        ]
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.wait()
+            raise
+        merge.Merge(self, directories).run()
+
+    def parse_args(self, parser, args):
         try:
-            parsed = parser.parse_args(args)
+            return parser.parse_args(args)
         except ParserError as exc:
             logs.logger.error(f'Error: {exc}')
             sys.exit(errno.EINVAL)
+
+    def parse(self, args):
+        parser = self.get_parser()
+        parsed = self.parse_args(parser, args)
+        if parsed.resume:
+            if not self.journal.load(parsed.resume):
+                logs.logger.error(f'Error: no journal found in `{parsed.resume}`')
+                sys.exit(errno.ENOENT)
+            # NOTE: Arguments given on resume take precedence over the ones of the interrupted scan
+            args = (self.journal.args or list()) + list(args)
+            parsed = self.parse_args(parser, args)
+            parsed.output_dir = parsed.resume
+        self.args = list(args)
         pathlib.Path(parsed.output_dir).mkdir(parents=True, exist_ok=True)
         logs.init(parsed.loglevel, parsed.output_dir)
+        if parsed.resume:
+            logs.logger.info(
+                f'Resuming scan, {len(self.journal.discovered)} discoveries and '
+                f'{len(self.journal.executed)} module executions already done'
+            )
         self.browser = parsed.browser
+        self.browser_pool = parsed.browser_pool
+        self.browser_pages = parsed.browser_pages
         self.randomize = parsed.randomize
         self.attempts = parsed.grabbing_attempts
         self.skip_screens = parsed.skip_screens
         self.output_dir = parsed.output_dir
         self.user_agent = parsed.user_agent
-        self.headers['User-Agent'] = self.user_agent
         self.workers = parsed.workers
+        self.response_workers = self.workers if parsed.response_workers is None else parsed.response_workers
+        self.screen_workers = parsed.screen_workers
+        self.pool_size = parsed.pool_size
+        self.max_body_size = parsed.max_body_size
+        self.response_timeout = parsed.response_timeout
+        self.engine = parsed.engine
+        self.connections = parsed.connections
         self.process_timeout = parsed.process_timeout
         self.socket_timeout = parsed.socket_timeout
+        self.sweep = parsed.sweep
+        self.connect_timeout = parsed.connect_timeout
+        self.max_host_probes = parsed.max_host_probes
+        self.max_subnet_probes = parsed.max_subnet_probes
+        self.adaptive = parsed.adaptive
+        self.min_concurrency = parsed.min_concurrency
+        self.min_rate = parsed.min_rate
+        self.max_rate = parsed.max_rate
+        self.pipeline = parsed.pipeline
+        self.baseline = parsed.baseline
+        self.store = parsed.store
+        self.bulk_ptr = parsed.bulk_ptr
+        self.resolve_names = parsed.resolve_names
+        self.ptr_cache_file = parsed.ptr_cache
+        self.shard = parsed.shard
+        self.processes = parsed.processes
+        self.progress_interval = parsed.progress_interval
+        self.metrics_port = parsed.metrics_port
+        if parsed.merge:
+            merge.Merge(self, parsed.merge).run()
+            return
+        if self.processes > 1 and not self.shard:
+            self.run_shards()
+            return
         # NOTE: Skip discovery for URLs provided in a file
         if parsed.urls:
-            self.urls.extend(self.urls_from_file(parsed.urls))
+            self.urls.extend(url for url in self.urls_from_file(parsed.urls) if self.in_shard_url(url))
         ports = parsed.ports.split(',')
         services = [(int(service[0]), service[2]) for port in ports if (service := port.partition('/'))]
         for service in services:
@@ -405,9 +1264,10 @@ class Application:
             if proto and proto not in (self.PROTO_HTTP, self.PROTO_HTTPS):
                 logs.logger.error(f'Error: invalid service `{proto}`')
                 sys.exit(errno.EINVAL)
-        targets = list()
+        sources = list()
         if parsed.network:
-            targets.extend(self.targets_from_network(parsed.network))
+            sources.append(self.targets_from_network(parsed.network))
         if parsed.hosts:
-            targets.extend(self.targets_from_file(parsed.hosts))
-        self.run(targets, services)
+            self.expected_hosts += sum(1 for line in self.iter_file(parsed.hosts) if line.strip())
+            sources.append(self.targets_from_file(parsed.hosts))
+        self.run(itertools.chain.from_iterable(sources), services)
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+
+from pukpuk import logs
+
+
+class BlobStore:
+    """Content-addressed store keeping every distinct file once under its SHA-256
+
+    The store may be shared by any number of scans, blobs are never modified once written.
+
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    MODE = 0o644
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get_path(self, digest):
+        return pathlib.Path(self.directory, digest[:2], digest)
+
+    def temp_file(self):
+        """Opens a file to be added to the store once written
+
+        """
+        return tempfile.NamedTemporaryFile(dir=self.directory, prefix='.', delete=False)
+
+    def get_digest(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as fil:
+            for chunk in iter(lambda: fil.read(self.CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def is_stored(self, digest, size):
+        """Returns True if blob exists and has the size of the content
+
+        Blobs are moved in place once complete, so one of the right size is not read again. A blob of another size is
+        damaged and removed to be stored again, `verify` checks the content itself.
+
+        """
+        path = self.get_path(digest)
+        try:
+            stored_size = os.stat(path).st_size
+        except FileNotFoundError:
+            return False
+        if stored_size == size:
+            return True
+        logs.logger.warning(f'Size of `{path}` does not match its content, storing it again')
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return False
+
+    def verify(self, digest):
+        """Returns True if content of blob matches its digest
+
+        """
+        path = self.get_path(digest)
+        return path.exists() and self.get_digest(path) == digest
+
+    def commit(self, temp_path, digest):
+        """Moves written file under its digest unless the same content is already stored
+
+        """
+        path = self.get_path(digest)
+        if self.is_stored(digest, os.path.getsize(temp_path)):
+            os.unlink(temp_path)
+        else:
+            path.parent.mkdir(exist_ok=True)
+            os.chmod(temp_path, self.MODE)
+            os.replace(temp_path, path)
+        return path
+
+    def add_file(self, path):
+        """Adds existing file to the store and replaces it with a hard link to the blob, returns the digest
+
+        """
+        digest = self.get_digest(path)
+        blob_path = self.get_path(digest)
+        try:
+            if blob_path.exists() and os.path.samefile(blob_path, path):
+                return digest
+            if not self.is_stored(digest, os.path.getsize(path)):
+                blob_path.parent.mkdir(exist_ok=True)
+                try:
+                    os.link(path, blob_path)
+                except FileExistsError:
+                    pass
+            if not os.path.samefile(blob_path, path):
+                temp_path = path.with_name(path.name + '.link')
+                os.link(blob_path, temp_path)
+                os.replace(temp_path, path)
+        except OSError as exc:
+            # NOTE: Store on another file system cannot be linked, the file is kept as is
+            logs.logger.debug(f'Could not link `{path}` to `{blob_path}`: {exc}')
+            if not blob_path.exists():
+                shutil.copyfile(path, blob_path)
+        return digest
+
+
+class Index:
+    """URL to blob digest mapping of a scan with metadata of every result, kept in its output directory
+
+    """
+
+    FILENAME = 'index.jsonl'
+
+    def __init__(self):
+        self.fil = None
+        self.lock = threading.Lock()
+
+    def open(self, directory):
+        self.fil = open(pathlib.Path(directory, self.FILENAME), 'a')
+
+    def close(self):
+        with self.lock:
+            if self.fil:
+                self.fil.close()
+                self.fil = None
+
+    def add(self, module, url, digest, **metadata):
+        entry = {'module': module, 'url': url, 'digest': digest, **metadata}
+        with self.lock:
+            if self.fil:
+                self.fil.write(json.dumps(entry) + '\n')
+                self.fil.flush()
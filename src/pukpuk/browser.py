@@ -0,0 +1,272 @@
+import base64
+import fcntl
+import json
+import os
+import queue
+import select
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from urllib import parse
+
+from pukpuk import (
+    logs,
+    names,
+)
+
+
+class BrowserError(Exception):
+
+    pass
+
+
+class BrowserNotFound(Exception):
+    """Browser is not installed, no screen can be grabbed
+
+    """
+
+    def __init__(self, browser):
+        super().__init__(f'Error occured when grabbing the screen. Is `{browser}` installed?')
+
+
+def get_resolver_rules(pinned):
+    """Argument making Chromium connect to pinned host names using their targets
+
+    """
+    return '--host-resolver-rules=' + ','.join(
+        f'MAP {host} {target}' for host, target in pinned.items() if names.is_host_name(host) and names.is_host_name(target)
+    )
+
+
+class Browser:
+    """Long-lived headless Chromium driven over the DevTools protocol
+
+    Uses `--remote-debugging-pipe`, i.e. null terminated JSON messages over file descriptors 3 and 4 of the browser
+    process, so no extra dependencies or listening ports are needed.
+
+    """
+
+    WINDOW_SIZE = (1000, 1000)
+    # NOTE: All rules go in one argument, which cannot be longer than 128 KiB (MAX_ARG_STRLEN), the browser is
+    # restarted with the next batch when a name outside of them comes up
+    RESOLVER_RULES = 256
+    TRAMPOLINE = 'import os, sys; os.dup2(int(sys.argv[1]), 3); os.dup2(int(sys.argv[2]), 4); os.execvp(sys.argv[3], sys.argv[3:])'
+
+    def __init__(self, app):
+        self.app = app
+        self.process = None
+        self.user_data_dir = None
+        self.reader = None
+        self.writer = None
+        self.buffer = b''
+        self.message_id = 0
+        self.events = list()
+        self.pages = 0
+        self.pinned = dict()
+
+    def get_args(self):
+        args = [
+            self.app.browser,
+            '--headless',
+            '--disable-gpu',
+            f'--window-size={self.WINDOW_SIZE[0]},{self.WINDOW_SIZE[1]}',
+            '--ignore-certificate-errors',
+            '--run-all-compositor-stages-before-draw',
+            '--no-first-run',
+            '--no-default-browser-check',
+            '--remote-debugging-pipe',
+            f'--user-data-dir={self.user_data_dir}',
+            f'--user-agent={self.app.user_agent}',
+        ]
+        if self.pinned:
+            args.append(get_resolver_rules(self.pinned))
+        args.append('about:blank')
+        return args
+
+    def resolves(self, url):
+        """Returns False if host of URL is pinned to an address but was not passed to the browser when it started
+
+        """
+        host = parse.urlsplit(url).hostname
+        return self.process is None or host in self.pinned or not self.app.resolver.get_pinned((host,))
+
+    def get_pinned(self, url):
+        """Returns host name of URL with its target and names pinned after it, their URLs are likely to come next
+
+        """
+        if url is None:
+            return dict()
+        return self.app.resolver.get_pinned_batch(parse.urlsplit(url).hostname, self.RESOLVER_RULES)
+
+    def move_fd(self, fd):
+        """Duplicates descriptor above 4 so that moving pipe ends to descriptors 3 and 4 cannot overwrite each other
+
+        """
+        moved = fcntl.fcntl(fd, fcntl.F_DUPFD_CLOEXEC, 5)
+        os.close(fd)
+        return moved
+
+    def start(self, url=None):
+        if not shutil.which(self.app.browser):
+            raise BrowserNotFound(self.app.browser)
+        self.user_data_dir = tempfile.mkdtemp(prefix='pukpuk-')
+        self.pinned = self.get_pinned(url)
+        to_browser, self.writer = os.pipe()
+        self.reader, from_browser = os.pipe()
+        to_browser, from_browser = self.move_fd(to_browser), self.move_fd(from_browser)
+        # NOTE: A trampoline moves the pipe ends to descriptors 3 and 4, `preexec_fn` is not safe to use in threads
+        exec_args = [sys.executable, '-c', self.TRAMPOLINE, str(to_browser), str(from_browser)] + self.get_args()
+        try:
+            self.process = subprocess.Popen(
+                exec_args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                pass_fds=(to_browser, from_browser),
+            )
+        except OSError as exc:
+            logs.logger.error(f'Could not start browser `{self.app.browser}`: {exc}')
+            for fd in (self.reader, self.writer):
+                os.close(fd)
+            shutil.rmtree(self.user_data_dir, ignore_errors=True)
+            raise BrowserError(f'Browser did not start: {exc}')
+        finally:
+            os.close(to_browser)
+            os.close(from_browser)
+        self.buffer = b''
+        self.events = list()
+        self.pages = 0
+        logs.logger.debug(f'Started browser (PID {self.process.pid})')
+
+    def stop(self):
+        if self.process is None:
+            return
+        for fd in (self.reader, self.writer):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.process.kill()
+        self.process.wait()
+        logs.logger.debug(f'Stopped browser (PID {self.process.pid})')
+        self.process = None
+        shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+    def send(self, method, params=None, session=None):
+        self.message_id += 1
+        message = {'id': self.message_id, 'method': method, 'params': params or {}}
+        if session:
+            message['sessionId'] = session
+        try:
+            os.write(self.writer, json.dumps(message).encode('utf-8') + b'\0')
+        except OSError as exc:
+            raise BrowserError(f'Browser pipe closed: {exc}')
+        return self.message_id
+
+    def recv(self, deadline):
+        while b'\0' not in self.buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('Browser did not respond in time')
+            readable, _, _ = select.select([self.reader], [], [], remaining)
+            if readable:
+                chunk = os.read(self.reader, 65536)
+                if not chunk:
+                    raise BrowserError('Browser pipe closed')
+                self.buffer += chunk
+        message, _, self.buffer = self.buffer.partition(b'\0')
+        return json.loads(message)
+
+    def call(self, method, params=None, session=None, deadline=None):
+        message_id = self.send(method, params, session)
+        while True:
+            message = self.recv(deadline)
+            if message.get('id') == message_id:
+                if 'error' in message:
+                    raise BrowserError(f'{method} failed: {message["error"].get("message")}')
+                return message.get('result', {})
+            if 'method' in message:
+                self.events.append(message)
+
+    def wait_event(self, method, session, deadline):
+        while True:
+            for event in self.events:
+                if event['method'] == method and event.get('sessionId') == session:
+                    self.events.remove(event)
+                    return event.get('params', {})
+            self.events.append(self.recv(deadline))
+
+    def screenshot(self, url, timeout):
+        """Renders URL in a new target and returns PNG data, None if navigation failed
+
+        """
+        if self.process is None or self.process.poll() is not None:
+            self.stop()
+            self.start(url)
+        started = time.monotonic()
+        deadline = started + timeout
+        self.pages += 1
+        self.events = list()
+        target = self.call('Target.createTarget', {'url': 'about:blank'}, deadline=deadline)['targetId']
+        try:
+            session = self.call('Target.attachToTarget', {'targetId': target, 'flatten': True}, deadline=deadline)['sessionId']
+            self.call('Page.enable', session=session, deadline=deadline)
+            self.call('Emulation.setDeviceMetricsOverride', {
+                'width': self.WINDOW_SIZE[0],
+                'height': self.WINDOW_SIZE[1],
+                'deviceScaleFactor': 1,
+                'mobile': False,
+            }, session=session, deadline=deadline)
+            navigation = self.call('Page.navigate', {'url': url}, session=session, deadline=deadline)
+            if navigation.get('errorText'):
+                logs.logger.debug(f'Navigation to {url} failed: {navigation["errorText"]}')
+                return None
+            # NOTE: Pages that never finish loading are captured anyway halfway through the timeout
+            try:
+                self.wait_event('Page.loadEventFired', session, started + timeout / 2)
+            except TimeoutError:
+                logs.logger.debug(f'Page {url} did not finish loading, capturing anyway')
+            data = self.call('Page.captureScreenshot', {'format': 'png'}, session=session, deadline=deadline)['data']
+        finally:
+            try:
+                self.call('Target.closeTarget', {'targetId': target}, deadline=max(deadline, time.monotonic() + 1))
+            except (BrowserError, TimeoutError, OSError):
+                self.stop()
+        return base64.b64decode(data)
+
+
+class BrowserPool:
+    """Fixed number of browsers shared by threads, each one is recycled after a number of pages or on failure
+
+    """
+
+    def __init__(self, app, size, max_pages):
+        self.app = app
+        self.max_pages = max_pages
+        self.browsers = [Browser(app) for _ in range(size)]
+        self.idle = queue.Queue()
+        for browser in self.browsers:
+            self.idle.put(browser)
+
+    def screenshot(self, url, timeout):
+        browser = self.idle.get()
+        if not browser.resolves(url):
+            logs.logger.debug(f'Restarting browser to resolve {url}')
+            browser.stop()
+        try:
+            return browser.screenshot(url, timeout)
+        except (BrowserError, TimeoutError, OSError, ValueError):
+            logs.logger.debug(f'Recycling browser after failure on {url}')
+            browser.stop()
+            raise
+        finally:
+            if browser.pages >= self.max_pages:
+                logs.logger.debug(f'Recycling browser after {browser.pages} pages')
+                browser.stop()
+            self.idle.put(browser)
+
+    def close(self):
+        for browser in self.browsers:
+            browser.stop()
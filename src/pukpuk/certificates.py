@@ -0,0 +1,172 @@
+import hashlib
+import ipaddress
+import threading
+
+from pukpuk import (
+    lazy,
+    logs,
+    names,
+)
+
+
+crypto = lazy.Module('OpenSSL.crypto')
+x509 = lazy.Module('cryptography.x509')
+x509_oid = lazy.Module('cryptography.x509.oid')
+
+# NOTE: DER tags of the GeneralNames sequence in subjectAltName and of its dNSName and iPAddress choices
+DER_SEQUENCE = 0x30
+DER_DNS_NAME = 0x82
+DER_IP_ADDRESS = 0x87
+
+
+class Certificate:
+    """Fields of a parsed certificate
+
+    """
+
+    def __init__(self, fingerprint, common_name, subject, issuer, not_before, not_after, names, addresses):
+        self.fingerprint = fingerprint
+        self.common_name = common_name
+        self.subject = subject
+        self.issuer = issuer
+        self.not_before = not_before
+        self.not_after = not_after
+        self.names = names
+        self.addresses = addresses
+
+    def hosts(self):
+        """Returns unique host names and IPv4 addresses from subjectAltName which can be examined as targets
+
+        """
+        hosts = [name for name in self.names if names.is_host_name(name) and not ('*' in name or name.isdigit())]
+        hosts.extend(address for address in self.addresses if ipaddress.ip_address(address).version == 4)
+        return list(dict.fromkeys(hosts))
+
+
+def get_time(value):
+    return value.isoformat() + 'Z'
+
+
+def get_common_name(name):
+    attributes = name.get_attributes_for_oid(x509_oid.NameOID.COMMON_NAME)
+    return attributes[0].value if attributes else None
+
+
+def get_alt_names(cert):
+    """Returns DNS names and IP addresses from the subjectAltName extension
+
+    """
+    try:
+        alt_names = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+    except x509.ExtensionNotFound:
+        return list(), list()
+    return get_alt_names_values(alt_names)
+
+
+def get_alt_names_values(alt_names):
+    names = alt_names.get_values_for_type(x509.DNSName)
+    addresses = [str(address) for address in alt_names.get_values_for_type(x509.IPAddress)]
+    return names, addresses
+
+
+def read_der(data, offset):
+    """Returns tag and value of DER element at offset with offset of the next one
+
+    """
+    if offset + 2 > len(data):
+        raise ValueError('Truncated DER element')
+    tag, length = data[offset], data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(data[offset:offset + size], 'big')
+        offset += size
+    if offset + length > len(data):
+        raise ValueError('Truncated DER element')
+    return tag, data[offset:offset + length], offset + length
+
+
+def get_general_names(data):
+    """Returns DNS names and IP addresses of DER encoded GeneralNames, other kinds of names are skipped
+
+    """
+    tag, sequence, _ = read_der(data, 0)
+    if tag != DER_SEQUENCE:
+        raise ValueError('GeneralNames is not a sequence')
+    general_names = list()
+    offset = 0
+    while offset < len(sequence):
+        tag, value, offset = read_der(sequence, offset)
+        try:
+            if tag == DER_DNS_NAME:
+                general_names.append(x509.DNSName(value.decode('ascii')))
+            elif tag == DER_IP_ADDRESS:
+                general_names.append(x509.IPAddress(ipaddress.ip_address(value)))
+        except ValueError:
+            logs.logger.debug(f'Skipping malformed subjectAltName entry {value!r}')
+    return general_names
+
+
+def get_alt_names_repeated(der):
+    """Returns DNS names and IP addresses from all subjectAltName extensions of certificate repeating the extension
+
+    """
+    cert = crypto.load_certificate(crypto.FILETYPE_ASN1, der)
+    general_names = list()
+    for i in range(cert.get_extension_count()):
+        ext = cert.get_extension(i)
+        if ext.get_short_name() == b'subjectAltName':
+            general_names.extend(get_general_names(ext.get_data()))
+    return get_alt_names_values(x509.SubjectAlternativeName(general_names))
+
+
+def parse(der, fingerprint=None):
+    """Parses DER encoded certificate
+
+    """
+    cert = x509.load_der_x509_certificate(der)
+    try:
+        names, addresses = get_alt_names(cert)
+    except x509.DuplicateExtension:
+        names, addresses = get_alt_names_repeated(der)
+    return Certificate(
+        fingerprint or hashlib.sha256(der).hexdigest(),
+        get_common_name(cert.subject),
+        cert.subject.rfc4514_string(),
+        cert.issuer.rfc4514_string(),
+        get_time(cert.not_valid_before),
+        get_time(cert.not_valid_after),
+        list(dict.fromkeys(name.strip().rstrip('.').lower() for name in names if name.strip())),
+        list(dict.fromkeys(addresses)),
+    )
+
+
+class Cache:
+    """Certificates parsed once per SHA-256 fingerprint of their DER encoding
+
+    Load balancers serve the same certificate on many addresses, only the first one is parsed.
+
+    """
+
+    def __init__(self):
+        self.certificates = dict()
+        self.lock = threading.Lock()
+
+    def get(self, der):
+        """Returns parsed certificate and True if it was seen for the first time
+
+        """
+        fingerprint = hashlib.sha256(der).hexdigest()
+        with self.lock:
+            certificate = self.certificates.get(fingerprint)
+        if certificate:
+            return certificate, False
+        try:
+            certificate = parse(der, fingerprint)
+        except (ValueError, IndexError, TypeError, crypto.Error) as exc:
+            # NOTE: Certificates come from any server scanned, a malformed one is remembered as having no fields
+            logs.logger.debug(f'Could not parse certificate {fingerprint}: {exc}')
+            certificate = Certificate(fingerprint, None, None, None, None, None, list(), list())
+        with self.lock:
+            cached = self.certificates.setdefault(fingerprint, certificate)
+        return cached, cached is certificate
@@ -0,0 +1,135 @@
+import contextlib
+import os
+import pathlib
+import threading
+
+from pukpuk import logs
+
+
+@contextlib.contextmanager
+def writing(path):
+    """Yields temporary path next to file which is moved over it once written
+
+    The file may be hard linked to the baseline run or to a blob store, replacing it leaves their content intact
+    while writing in place would change it too.
+
+    """
+    path = pathlib.Path(path)
+    temp_path = path.with_name('.' + path.name)
+    try:
+        yield temp_path
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(temp_path)
+        raise
+    if temp_path.exists():
+        os.replace(temp_path, path)
+
+
+def link(source, path):
+    """Replaces file with a hard link to another one having the same content
+
+    """
+    temp_path = path.with_name(path.name + '.link')
+    try:
+        if path.exists() and os.path.samefile(source, path):
+            return
+        os.link(source, temp_path)
+        os.replace(temp_path, path)
+    except OSError as exc:
+        logs.logger.debug(f'Could not link `{path}` to `{source}`: {exc}')
+
+
+class Changes:
+    """Compares results with a previous run of the scan
+
+    Files unchanged since the baseline are replaced with hard links to the baseline copies, so that every run stays
+    complete while only the changes take up disk space. Differences are collected in a compact report, one change
+    per line: `+` for added URLs, `-` for removed ones and `~` with module name for changed results, optionally
+    followed by details of the change.
+
+    """
+
+    FILENAME = 'changes.txt'
+    ADDED = '+'
+    REMOVED = '-'
+    CHANGED = '~'
+
+    def __init__(self, app, directory):
+        self.app = app
+        self.directory = directory
+        self.urls = set()
+        self.changed = list()
+        self.unchanged = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Reads URLs of the baseline run, returns False if the directory does not contain results
+
+        """
+        path = pathlib.Path(self.directory, self.app.OUTPUT_URLS_FILENAME)
+        if not path.exists():
+            return False
+        with open(path) as fil:
+            self.urls = set(line.strip() for line in fil if line.strip() and self.app.in_shard_url(line.strip()))
+        logs.logger.info(f'Comparing results with {len(self.urls)} URLs from `{self.directory}`')
+        return True
+
+    def get_baseline_path(self, module, path):
+        return pathlib.Path(self.directory, path.relative_to(module.output_dir))
+
+    def keep(self, module, url, path):
+        """Links baseline copy of a file known to be unchanged, returns False if there is none
+
+        """
+        baseline_path = self.get_baseline_path(module, path)
+        if not baseline_path.exists():
+            return False
+        logs.logger.debug(f'No changes in {module.name} for {url}')
+        link(baseline_path, path)
+        with self.lock:
+            self.unchanged += 1
+        return True
+
+    def changed_result(self, module, url, detail=None):
+        logs.logger.info(f'Changes in {module.name} for {url}')
+        with self.lock:
+            self.changed.append((url, self.CHANGED, module.name.lower(), detail))
+
+    def compare(self, module, url, path):
+        """Links file unchanged since the baseline run to its copy, records the change otherwise
+
+        """
+        if url not in self.urls:
+            return
+        baseline_path = self.get_baseline_path(module, path)
+        if baseline_path.exists() and module.is_unchanged(baseline_path, path):
+            self.keep(module, url, path)
+        else:
+            self.changed_result(module, url, module.describe_change(baseline_path, path) if baseline_path.exists() else None)
+
+    def compare_digest(self, module, url, unchanged, path=None):
+        """Records result compared by digest, file unchanged since the baseline run is linked to its copy
+
+        """
+        if url not in self.urls:
+            return
+        if not unchanged:
+            self.changed_result(module, url)
+        elif path is None or not self.keep(module, url, path):
+            with self.lock:
+                self.unchanged += 1
+
+    def report(self, urls):
+        urls = set(urls)
+        entries = [(url, self.ADDED, None, None) for url in urls - self.urls]
+        entries.extend((url, self.REMOVED, None, None) for url in self.urls - urls)
+        with self.lock:
+            entries.extend(self.changed)
+        with open(pathlib.Path(self.app.output_dir, self.FILENAME), 'w') as fil:
+            for url, change, name, detail in sorted(entries, key=lambda entry: (entry[0], entry[1], entry[2] or '')):
+                fil.write(' '.join(field for field in (change, name, url, detail) if field) + '\n')
+        logs.logger.info(
+            f'{len(urls - self.urls)} URLs added, {len(self.urls - urls)} removed, {len(self.changed)} results changed '
+            f'and {self.unchanged} unchanged since `{self.directory}`'
+        )
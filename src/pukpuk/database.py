@@ -0,0 +1,144 @@
+import json
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+
+from pukpuk import logs
+
+
+class Database:
+    """SQLite database of scan results written by a dedicated thread
+
+    Workers only queue statements, the writer thread executes whatever is queued in a single transaction. The
+    database uses write-ahead logging, so it can be queried while the scan is running.
+
+    """
+
+    FILENAME = 'results.db'
+    BATCH_SIZE = 1000
+    TABLES = ('services', 'certificates', 'responses', 'screens')
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS services (
+            host TEXT NOT NULL,
+            port INTEGER NOT NULL,
+            proto TEXT NOT NULL,
+            source TEXT NOT NULL,
+            probe_time REAL,
+            fingerprint TEXT,
+            discovered_at REAL NOT NULL,
+            PRIMARY KEY (host, port, proto)
+        )""",
+        """CREATE TABLE IF NOT EXISTS certificates (
+            fingerprint TEXT PRIMARY KEY,
+            common_name TEXT,
+            subject TEXT,
+            issuer TEXT,
+            not_before TEXT,
+            not_after TEXT,
+            names TEXT,
+            addresses TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            status INTEGER,
+            title TEXT,
+            headers TEXT,
+            digest TEXT,
+            path TEXT,
+            truncated TEXT,
+            elapsed REAL,
+            fetched_at REAL NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS screens (
+            url TEXT PRIMARY KEY,
+            path TEXT,
+            digest TEXT,
+            dhash TEXT,
+            taken_at REAL NOT NULL
+        )""",
+    )
+
+    def __init__(self):
+        self.path = None
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def open(self, directory):
+        self.path = pathlib.Path(directory, self.FILENAME)
+        self.thread = threading.Thread(target=self.write, name='Database', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        with connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+        return connection
+
+    def write(self):
+        connection = self.connect()
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+            try:
+                with connection:
+                    for item in batch:
+                        if item:
+                            connection.execute(*item)
+            except sqlite3.Error as exc:
+                logs.logger.debug(f'Exception when writing results: {exc}')
+        connection.close()
+
+    def execute(self, statement, params):
+        if self.thread:
+            self.queue.put((statement, params))
+
+    def add_service(self, host, port, proto, source, probe_time=None, fingerprint=None):
+        self.execute(
+            'INSERT OR IGNORE INTO services VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (host, port, proto, source, probe_time, fingerprint, time.time())
+        )
+
+    def add_certificate(self, certificate):
+        self.execute(
+            'INSERT OR IGNORE INTO certificates VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                certificate.fingerprint,
+                certificate.common_name,
+                certificate.subject,
+                certificate.issuer,
+                certificate.not_before,
+                certificate.not_after,
+                json.dumps(certificate.names),
+                json.dumps(certificate.addresses),
+            )
+        )
+
+    def add_response(self, url, status, title, headers, digest, path, truncated, elapsed):
+        self.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (url, status, title, json.dumps(dict(headers)), digest, path and str(path), truncated, elapsed, time.time())
+        )
+
+    def add_screen(self, url, path, digest, dhash):
+        self.execute(
+            'INSERT OR REPLACE INTO screens VALUES (?, ?, ?, ?, ?)',
+            (url, str(path), digest, f'{dhash:016x}', time.time())
+        )
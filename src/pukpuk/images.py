@@ -0,0 +1,128 @@
+import collections
+import itertools
+import threading
+
+from pukpuk import lazy
+
+
+Image = lazy.Module('PIL.Image')
+
+HASH_SIZE = 8
+
+
+def dhash(img):
+    """Difference hash, one bit per pair of horizontally adjacent pixels of the image scaled down to 9x8
+
+    Similar images get hashes differing in a few bits regardless of their size, compression or small changes.
+
+    """
+    pixels = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS).tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + column + 1] > pixels[offset + column])
+    return value
+
+
+def distance(first, second):
+    """Number of bits two hashes differ in
+
+    """
+    return bin(first ^ second).count('1')
+
+
+def get_bands(bits, count):
+    """Returns shifts and widths splitting hash into bands of nearly equal widths
+
+    """
+    bands = list()
+    shift = 0
+    for index in range(count):
+        width = bits // count + (index < bits % count)
+        bands.append((shift, width))
+        shift += width
+    return bands
+
+
+def get_flips(width, radius):
+    """Returns masks flipping up to `radius` bits of a band
+
+    """
+    return [
+        sum(1 << bit for bit in bits)
+        for count in range(min(radius, width) + 1)
+        for bits in itertools.combinations(range(width), count)
+    ]
+
+
+class Clusters:
+    """Groups visually similar images, each one joins the first cluster whose first image is close enough
+
+    First images are indexed by bands of their hashes. Hashes differing in at most `threshold` bits over `n` bands
+    differ in at most `threshold // n` bits in one of them, so only images found in the index under a band value that
+    close are compared, i.e. a few instead of all of them on large scans.
+
+    """
+
+    BAND_BITS = 16
+
+    def __init__(self, threshold, bits=HASH_SIZE * HASH_SIZE):
+        self.threshold = threshold
+        self.bands = get_bands(bits, max(bits // self.BAND_BITS, 1))
+        self.flips = [get_flips(width, threshold // len(self.bands)) for _, width in self.bands]
+        self.buckets = collections.defaultdict(list)
+        self.clusters = dict()
+        self.leaders = list()
+        self.members = list()
+        self.lock = threading.Lock()
+
+    def get_keys(self, value):
+        return [(band, (value >> shift) & ((1 << width) - 1)) for band, (shift, width) in enumerate(self.bands)]
+
+    def find(self, keys, value):
+        candidates = set()
+        for (band, key), flips in zip(keys, self.flips):
+            for flip in flips:
+                candidates.update(self.buckets.get((band, key ^ flip), ()))
+        for index in sorted(candidates):
+            if distance(self.leaders[index], value) <= self.threshold:
+                return index
+        return None
+
+    def add(self, name, value):
+        keys = self.get_keys(value)
+        with self.lock:
+            # NOTE: Identical hashes, e.g. of default pages, always end up in the same cluster
+            index = self.clusters.get(value)
+            if index is None:
+                index = self.find(keys, value)
+            if index is None:
+                index = len(self.leaders)
+                self.leaders.append(value)
+                self.members.append(list())
+                for key in keys:
+                    self.buckets[key].append(index)
+            self.clusters[value] = index
+            self.members[index].append(name)
+            return index
+
+    def groups(self):
+        """Returns clusters of more than one image, largest first
+
+        """
+        with self.lock:
+            return sorted((sorted(members) for members in self.members if len(members) > 1), key=len, reverse=True)
+
+    def write(self, path):
+        """Lists groups in a text file, returns number of groups
+
+        """
+        groups = self.groups()
+        if groups:
+            with open(path, 'w') as fil:
+                for members in groups:
+                    fil.write(f'# {len(members)} similar screens\n')
+                    fil.write(''.join(name + '\n' for name in members))
+                    fil.write('\n')
+        return len(groups)
@@ -0,0 +1,134 @@
+import json
+import pathlib
+import threading
+import time
+
+from pukpuk import (
+    logs,
+    sequences,
+)
+
+
+class Journal:
+    """Append-only record of scan progress kept in the output directory
+
+    Every line is a JSON array starting with the entry type: command line arguments of the scan, batches of completed
+    discovery targets, discovered services, host names pinned to the hosts they were found on and completed module
+    executions. Entries are flushed every `FLUSH_ENTRIES` entries or `FLUSH_INTERVAL` seconds, so a scan that gets
+    killed can be resumed by skipping everything already done and repeats at most what was done since.
+
+    """
+
+    FILENAME = 'journal.jsonl'
+    ENTRY_ARGS = 'args'
+    ENTRY_TARGETS = 'targets'
+    ENTRY_DISCOVERED = 'discovered'
+    ENTRY_EXECUTED = 'executed'
+    ENTRY_PINNED = 'pinned'
+    FLUSH_ENTRIES = 1000
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self):
+        self.args = None
+        self.targets = sequences.TargetFilter()
+        self.discovered = dict()
+        self.executed = set()
+        self.pinned = dict()
+        self.done_targets = list()
+        self.unflushed = 0
+        self.flushed = 0
+        self.fil = None
+        self.lock = threading.Lock()
+
+    def get_path(self, directory):
+        return pathlib.Path(directory, self.FILENAME)
+
+    def load(self, directory):
+        """Reads entries of a previous scan, returns False if there is no journal in the directory
+
+        """
+        path = self.get_path(directory)
+        if not path.exists():
+            return False
+        with open(path) as fil:
+            for line in fil:
+                try:
+                    kind, *entry = json.loads(line)
+                except ValueError:
+                    # NOTE: The last line may be incomplete if the scan was killed
+                    logs.logger.debug(f'Skipping malformed journal entry `{line.strip()}`')
+                    continue
+                if kind == self.ENTRY_ARGS:
+                    self.args = entry[0]
+                elif kind == self.ENTRY_TARGETS:
+                    for target in entry:
+                        self.targets.add(tuple(target))
+                elif kind == self.ENTRY_DISCOVERED:
+                    self.discovered[tuple(entry)] = None
+                elif kind == self.ENTRY_EXECUTED:
+                    self.executed.add(tuple(entry))
+                elif kind == self.ENTRY_PINNED:
+                    self.pinned[entry[0]] = entry[1]
+        return True
+
+    def open(self, directory, args):
+        self.fil = open(self.get_path(directory), 'a')
+        self.flushed = time.monotonic()
+        if self.args is None:
+            self.args = args
+            self.write(self.ENTRY_ARGS, args)
+
+    def close(self):
+        with self.lock:
+            if self.fil:
+                self.write_targets()
+                self.fil.close()
+                self.fil = None
+
+    def write(self, *entry):
+        with self.lock:
+            if self.fil:
+                self.fil.write(json.dumps(entry) + '\n')
+                self.entry_written()
+
+    def entry_written(self):
+        self.unflushed += 1
+        if self.unflushed >= self.FLUSH_ENTRIES or time.monotonic() - self.flushed >= self.FLUSH_INTERVAL:
+            self.write_targets()
+            self.fil.flush()
+            self.unflushed = 0
+            self.flushed = time.monotonic()
+
+    def write_targets(self):
+        """Writes completed targets collected since the last flush as a single entry
+
+        """
+        if self.done_targets:
+            self.fil.write(json.dumps([self.ENTRY_TARGETS, *self.done_targets]) + '\n')
+            self.done_targets.clear()
+
+    def is_target_done(self, target):
+        return target in self.targets
+
+    def target_done(self, target):
+        """Collects target whose discovery completed, targets are written in a single entry when flushing
+
+        """
+        with self.lock:
+            if self.fil:
+                self.done_targets.append(target)
+                self.entry_written()
+
+    def add_discovered(self, target):
+        if target not in self.discovered:
+            self.write(self.ENTRY_DISCOVERED, *target)
+
+    def add_pinned(self, host, target):
+        if host not in self.pinned:
+            self.write(self.ENTRY_PINNED, host, target)
+
+    def is_executed(self, name, url):
+        return (name, url) in self.executed
+
+    def module_done(self, name, url):
+        self.write(self.ENTRY_EXECUTED, name, url)
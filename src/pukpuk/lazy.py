@@ -0,0 +1,23 @@
+import importlib
+
+
+class Module:
+    """Module imported on first attribute access, keeps dependencies of stages which may not run out of startup
+
+    Unlike `importlib.util.LazyLoader` it is safe to touch from many threads at once, the import lock of the
+    interpreter serializes the first import.
+
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}>'
@@ -0,0 +1,134 @@
+import os
+import pathlib
+import shutil
+import sqlite3
+
+from pukpuk import (
+    blobs,
+    changes,
+    database,
+    images,
+    logs,
+    mods,
+    validators,
+)
+
+
+def copy(source, path):
+    """Hard links file, copies it if the link cannot be made, e.g. across file systems
+
+    """
+    try:
+        os.link(source, path)
+    except OSError:
+        shutil.copy2(source, path)
+
+
+class Merge:
+    """Combines output directories of shards into a single one
+
+    Result files are hard linked, lists of URLs and JSON lines files are concatenated, the databases are merged into
+    one and similar screens are grouped again across all shards. Journals and logs stay in the shard directories.
+
+    """
+
+    MODULES = (mods.Responses, mods.Screens)
+    LINES_FILENAMES = (validators.Validators.FILENAME, blobs.Index.FILENAME)
+
+    def __init__(self, app, directories):
+        self.app = app
+        self.output_dir = pathlib.Path(app.output_dir)
+        self.directories = [pathlib.Path(directory) for directory in directories]
+
+    def run(self):
+        urls = self.merge_urls()
+        for module in self.MODULES:
+            self.merge_files(module.__name__.lower())
+        for filename in self.LINES_FILENAMES:
+            self.merge_lines(filename)
+        self.merge_changes()
+        self.merge_database()
+        logs.logger.info(f'Merged {len(urls)} URLs from {len(self.directories)} directories into `{self.output_dir}`')
+
+    def get_paths(self, filename):
+        return [path for path in (pathlib.Path(directory, filename) for directory in self.directories) if path.exists()]
+
+    def merge_urls(self):
+        urls = dict()
+        for path in self.get_paths(self.app.OUTPUT_URLS_FILENAME):
+            with open(path) as fil:
+                urls.update((line.strip(), None) for line in fil if line.strip())
+        pathlib.Path(self.output_dir, self.app.OUTPUT_URLS_FILENAME).write_text('\n'.join(urls))
+        return list(urls)
+
+    def merge_files(self, name):
+        base_dir = pathlib.Path(self.output_dir, name)
+        for source_dir in self.get_paths(name):
+            base_dir.mkdir(parents=True, exist_ok=True)
+            for source in source_dir.iterdir():
+                path = pathlib.Path(base_dir, source.name)
+                # NOTE: Names derived from certificates may have been examined by more than one shard
+                if not path.exists():
+                    copy(source, path)
+
+    def merge_lines(self, filename):
+        paths = self.get_paths(filename)
+        if not paths:
+            return
+        with open(pathlib.Path(self.output_dir, filename), 'w') as fil:
+            for path in paths:
+                with open(path) as shard_fil:
+                    shutil.copyfileobj(shard_fil, fil)
+
+    def merge_changes(self):
+        lines = set()
+        for path in self.get_paths(changes.Changes.FILENAME):
+            with open(path) as fil:
+                lines.update(line for line in fil if line.strip())
+        if lines:
+            # NOTE: Same order as in the report of a single scan, i.e. by URL and then by kind of the change
+            entries = sorted(lines, key=lambda line: (self.get_changed_url(line), line))
+            pathlib.Path(self.output_dir, changes.Changes.FILENAME).write_text(''.join(entries))
+
+    def get_changed_url(self, line):
+        fields = line.split()
+        return fields[2] if fields[0] == changes.Changes.CHANGED else fields[1]
+
+    def get_path(self, path, shard_dir):
+        """Moves path of a result file stored in the database of a shard to the merged directory, paths outside of the
+        shard directory, e.g. in a shared blob store, are kept
+
+        """
+        if path is None:
+            return None
+        try:
+            relative = pathlib.Path(os.path.abspath(path)).relative_to(os.path.abspath(shard_dir))
+        except ValueError:
+            return path
+        return str(pathlib.Path(self.output_dir, relative))
+
+    def merge_database(self):
+        connection = sqlite3.connect(pathlib.Path(self.output_dir, database.Database.FILENAME))
+        with connection:
+            for statement in database.Database.SCHEMA:
+                connection.execute(statement)
+        clusters = images.Clusters(mods.Screens.CLUSTER_DISTANCE)
+        for path in self.get_paths(database.Database.FILENAME):
+            shard = sqlite3.connect(path)
+            with connection:
+                for table in database.Database.TABLES:
+                    cursor = shard.execute(f'SELECT * FROM {table}')
+                    columns = [column[0] for column in cursor.description]
+                    for row in cursor:
+                        row = dict(zip(columns, row))
+                        if 'path' in row:
+                            row['path'] = self.get_path(row['path'], path.parent)
+                        connection.execute(
+                            f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                            [row[column] for column in columns]
+                        )
+            shard.close()
+        for url, dhash in connection.execute('SELECT url, dhash FROM screens WHERE dhash IS NOT NULL'):
+            clusters.add(url, int(dhash, 16))
+        connection.close()
+        clusters.write(pathlib.Path(self.output_dir, mods.Screens.CLUSTERS_FILENAME))
@@ -0,0 +1,282 @@
+import bisect
+import collections
+import contextlib
+import json
+import math
+import os
+import pathlib
+import threading
+import time
+
+from pukpuk import (
+    lazy,
+    logs,
+)
+
+
+http_server = lazy.Module('http.server')
+
+PREFIX = 'pukpuk_'
+# NOTE: Upper bounds in seconds, from a connect over loopback to a screen grab hitting the process timeout
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def get_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def format_labels(labels, **extra):
+    labels = (*labels, *extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}'
+
+
+class Histogram:
+    """Latency distribution in fixed buckets, percentiles are estimated as upper bounds of their buckets
+
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * fraction)
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative(self):
+        seen = 0
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            seen += count
+            yield bound, seen
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'max': self.max,
+            **{f'p{int(fraction * 100)}': self.percentile(fraction) for fraction in PERCENTILES},
+            'buckets': {'+Inf' if bound == math.inf else str(bound): count for bound, count in self.cumulative()},
+        }
+
+
+class Metrics:
+    """Thread-safe counters, gauges of work in flight and latency histograms of the hot paths
+
+    Metrics are identified by name and labels, e.g. `connect_seconds` with `outcome="timeout"`. They can be written
+    as JSON at the end of a scan and served in Prometheus text format while it runs.
+
+    """
+
+    FILENAME = 'metrics.json'
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.gauges = collections.Counter()
+        self.histograms = dict()
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.server = None
+
+    def count(self, name, value=1, **labels):
+        key = get_key(name, labels)
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, seconds, **labels):
+        key = get_key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def track(self, name, **labels):
+        """Counts the block as in flight while it runs and observes its duration in `<name>_seconds`, labelled with
+        its outcome
+
+        """
+        key = get_key('in_flight', {'stage': name})
+        with self.lock:
+            self.gauges[key] += 1
+        started = time.monotonic()
+        outcome = 'ok'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            with self.lock:
+                self.gauges[key] -= 1
+            self.observe(f'{name}_seconds', time.monotonic() - started, outcome=outcome, **labels)
+
+    def get(self, name, **labels):
+        """Returns sum of counter or gauge values over all label sets including given labels
+
+        """
+        labels = set(labels.items())
+        with self.lock:
+            return sum(
+                value for (key, key_labels), value in (*self.counters.items(), *self.gauges.items())
+                if key == name and labels <= set(key_labels)
+            )
+
+    def get_count(self, name, **labels):
+        """Returns number of observations of histogram over all label sets including given labels
+
+        """
+        labels = set(labels.items())
+        with self.lock:
+            return sum(
+                histogram.count for (key, key_labels), histogram in self.histograms.items()
+                if key == name and labels <= set(key_labels)
+            )
+
+    def in_flight(self, name):
+        return self.get('in_flight', stage=name)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def to_dict(self):
+        with self.lock:
+            counters = list(self.counters.items())
+            gauges = list(self.gauges.items())
+            histograms = [(key, histogram.to_dict()) for key, histogram in self.histograms.items()]
+        result = {
+            'elapsed': self.elapsed(),
+            'counters': collections.defaultdict(list),
+            'gauges': collections.defaultdict(list),
+            'histograms': collections.defaultdict(list),
+        }
+        for kind, items in (('counters', counters), ('gauges', gauges)):
+            for (name, labels), value in sorted(items):
+                result[kind][name].append({'labels': dict(labels), 'value': value})
+        for (name, labels), histogram in sorted(histograms, key=lambda item: item[0]):
+            result['histograms'][name].append({'labels': dict(labels), **histogram})
+        return result
+
+    def to_prometheus(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(
+                ((key, list(histogram.cumulative()), histogram.sum, histogram.count) for key, histogram in self.histograms.items()),
+                key=lambda item: item[0]
+            )
+        lines = [
+            f'# TYPE {PREFIX}elapsed_seconds gauge',
+            f'{PREFIX}elapsed_seconds {self.elapsed()}',
+        ]
+        for kind, items in (('counter', counters), ('gauge', gauges)):
+            previous = None
+            for (name, labels), value in items:
+                if name != previous:
+                    lines.append(f'# TYPE {PREFIX}{name} {kind}')
+                    previous = name
+                lines.append(f'{PREFIX}{name}{format_labels(labels)} {value}')
+        previous = None
+        for (name, labels), buckets, total, count in histograms:
+            if name != previous:
+                lines.append(f'# TYPE {PREFIX}{name} histogram')
+                previous = name
+            for bound, seen in buckets:
+                lines.append(f'{PREFIX}{name}_bucket{format_labels(labels, le="+Inf" if bound == math.inf else bound)} {seen}')
+            lines.append(f'{PREFIX}{name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{PREFIX}{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory):
+        path = pathlib.Path(directory, self.FILENAME)
+        temp_path = pathlib.Path(str(path) + '.tmp')
+        with open(temp_path, 'w') as fil:
+            json.dump(self.to_dict(), fil, indent=2)
+        os.replace(temp_path, path)
+
+    def serve(self, port):
+        """Serves metrics in Prometheus text format on a local port from a daemon thread
+
+        """
+        metrics = self
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logs.logger.debug(f'Metrics request from {self.client_address[0]}: {format % args}')
+
+        self.server = http_server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        logs.logger.info(f'Serving metrics on http://127.0.0.1:{self.server.server_address[1]}/metrics')
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class Progress:
+    """Logs a progress line returned by `describe` every `interval` seconds from a daemon thread
+
+    """
+
+    def __init__(self, describe, interval):
+        self.describe = describe
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.interval > 0:
+            self.thread = threading.Thread(target=self.run, name='progress', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                line = self.describe()
+            except Exception as exc:
+                logs.logger.debug(f'Exception in progress: {exc}')
+            else:
+                if line:
+                    logs.logger.info(line)
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
@@ -1,21 +1,56 @@
+import codecs
+import filecmp
 import hashlib
+import html
+import os
 import pathlib
+import re
+import socket
 import subprocess
-import sys
+import threading
+import time
 from urllib import parse
 
 import requests
-from PIL import Image
 
-from pukpuk import logs
+from pukpuk import (
+    browser,
+    changes,
+    images,
+    lazy,
+    logs,
+    sessions,
+)
+
+
+# NOTE: Responses are grabbed without screens often, images are loaded only by the first screen
+Image = lazy.Module('PIL.Image')
+ImageChops = lazy.Module('PIL.ImageChops')
 
 
 class BaseModule:
 
+    # NOTE: Errors raised for every URL alike, the stage of the module is stopped and the scan exits
+    FATAL_ERRORS = ()
+
     def __init__(self, app):
         self.name = type(self).__name__
         self.app = app
         self.output_dir = self.app.output_dir
+        self.workers = self.app.workers
+
+    def close(self):
+        pass
+
+    def is_unchanged(self, baseline_path, path):
+        return filecmp.cmp(baseline_path, path, shallow=False)
+
+    def describe_change(self, baseline_path, path):
+        return None
+
+    def compare_baseline(self, url, path):
+        if self.app.changes:
+            self.app.changes.compare(self, url, pathlib.Path(path))
 
     def get_base_dir(self):
         base_dir = pathlib.Path(self.output_dir, self.name.lower())
@@ -34,11 +69,71 @@ class BaseModule:
 
 class Screens(BaseModule):
 
-    def execute(self, url):
-        browser = self.app.browser
-        image_filename = str(pathlib.Path(self.get_base_dir(), self.get_base_filename(url))) + '.png'
+    FATAL_ERRORS = (browser.BrowserNotFound,)
+    CLUSTER_DISTANCE = 10
+    CLUSTERS_FILENAME = 'clusters.txt'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.workers = self.app.screen_workers
+        self.pool = None
+        if self.app.browser_pool:
+            self.pool = browser.BrowserPool(self.app, self.app.browser_pool, self.app.browser_pages)
+        self.clusters = images.Clusters(self.CLUSTER_DISTANCE)
+        self.digests = dict()
+        self.digests_lock = threading.Lock()
+
+    def close(self):
+        if self.pool:
+            self.pool.close()
+        self.write_clusters()
+
+    def write_clusters(self):
+        """Lists groups of visually similar screens, e.g. default pages of the same server software
+
+        """
+        groups = self.clusters.write(pathlib.Path(self.output_dir, self.CLUSTERS_FILENAME))
+        if groups:
+            logs.logger.info(f'{groups} groups of similar screens listed in `{self.CLUSTERS_FILENAME}`')
+
+    def deduplicate(self, image_filename):
+        """Links screen identical to one saved before, so that it is stored only once
+
+        """
+        with open(image_filename, 'rb') as fil:
+            digest = hashlib.sha256(fil.read()).hexdigest()
+        with self.digests_lock:
+            first = self.digests.setdefault(digest, image_filename)
+        if first != image_filename:
+            logs.logger.debug(f'Screen {image_filename} is identical to {first}')
+            changes.link(first, pathlib.Path(image_filename))
+
+    def store(self, url, image_filename, value):
+        digest = None
+        if self.app.blobs:
+            digest = self.app.blobs.add_file(pathlib.Path(image_filename))
+            self.app.index.add(self.name.lower(), url, digest)
+        else:
+            self.deduplicate(image_filename)
+        self.app.db.add_screen(url, image_filename, digest, value)
+
+    def describe_change(self, baseline_path, path):
+        with Image.open(baseline_path) as baseline, Image.open(path) as img:
+            return f'distance {images.distance(images.dhash(baseline), images.dhash(img))}'
+
+    def is_unchanged(self, baseline_path, path):
+        with Image.open(baseline_path) as baseline, Image.open(path) as img:
+            if baseline.size != img.size:
+                return False
+            return ImageChops.difference(baseline.convert('RGB'), img.convert('RGB')).getbbox() is None
+
+    def grab_process(self, url, image_filename):
+        with changes.writing(image_filename) as temp_filename:
+            return self.run_browser(url, temp_filename)
+
+    def run_browser(self, url, image_filename):
         exec_args = [
-            browser,
+            self.app.browser,
             '--headless',
             '--disable-gpu',
             '--window-size=1000,1000',
@@ -48,56 +143,276 @@ class Screens(BaseModule):
             f'--virtual-time-budget={self.app.time_budget}',
             f'--screenshot={image_filename}',
             f'--user-agent="{self.app.user_agent}"',
-            url,
         ]
+        pinned = self.app.resolver.get_pinned((parse.urlsplit(url).hostname,))
+        if pinned:
+            exec_args.append(browser.get_resolver_rules(pinned))
+        exec_args.append(url)
+        output = subprocess.check_output(
+            exec_args,
+            stderr=subprocess.STDOUT,
+            timeout=self.app.process_timeout
+        )
+        logs.logger.debug(output)
+        return True
+
+    def grab_pool(self, url, image_filename):
+        data = self.pool.screenshot(url, self.app.process_timeout)
+        if data is None:
+            return False
+        with changes.writing(image_filename) as temp_filename:
+            temp_filename.write_bytes(data)
+        return True
+
+    def keep_unchanged(self, url, image_filename):
+        """Keeps screen of the baseline run if the response tells the page content did not change
+
+        """
+        # NOTE: Responses usually run ahead of screens, otherwise the screen is grabbed anyway
+        if not (self.app.changes and self.app.validators.is_unchanged(url)):
+            return False
+        return self.app.changes.keep(self, url, pathlib.Path(image_filename))
+
+    def execute(self, url):
+        image_filename = str(pathlib.Path(self.get_base_dir(), self.get_base_filename(url))) + '.png'
+        if self.keep_unchanged(url, image_filename):
+            logs.logger.info(f'Page {url} did not change, kept {image_filename}')
+            with Image.open(image_filename) as img:
+                value = images.dhash(img)
+            self.clusters.add(url, value)
+            self.store(url, image_filename, value)
+            return
+        grab = self.grab_pool if self.pool else self.grab_process
         for attempt in range(1, self.app.attempts + 1):
             try:
-                output = subprocess.check_output(
-                    exec_args,
-                    stderr=subprocess.STDOUT,
-                    timeout=self.app.process_timeout
-                )
-                logs.logger.debug(output)
+                grabbed = grab(url, image_filename)
             except FileNotFoundError:
-                logs.logger.error(f'Error occured when grabbing the screen. Is `{browser}` installed?')
-                sys.exit(1)
-            except subprocess.TimeoutExpired:
+                raise browser.BrowserNotFound(self.app.browser)
+            except (subprocess.TimeoutExpired, TimeoutError):
                 logs.logger.debug(f'Screen grabbing timed out for {url} (attempt {attempt}/{self.app.attempts}, try adjusting --process-timeout)')
+            except browser.BrowserError as exc:
+                logs.logger.debug(f'Screen grabbing failed for {url} (attempt {attempt}/{self.app.attempts}): {exc}')
             else:
-                with Image.open(image_filename) as img:
-                    extrema = img.convert('L').getextrema()
-                if extrema[0] == extrema[1]:
-                    pathlib.Path(image_filename).unlink()
-                    logs.logger.debug(f'Blank screen for {url} returned, deleting image')
-                else:
-                    logs.logger.info(f'Saved {image_filename}')
+                if grabbed:
+                    with Image.open(image_filename) as img:
+                        extrema = img.convert('L').getextrema()
+                        value = images.dhash(img)
+                    if extrema[0] == extrema[1]:
+                        pathlib.Path(image_filename).unlink()
+                        logs.logger.debug(f'Blank screen for {url} returned, deleting image')
+                    else:
+                        logs.logger.info(f'Saved {image_filename}')
+                        self.clusters.add(url, value)
+                        self.store(url, image_filename, value)
+                        self.compare_baseline(url, image_filename)
                 break
 
 
 class Responses(BaseModule):
 
-    def execute(self, url):
-        base_filename = pathlib.Path(self.get_base_dir(), self.get_base_filename(url) + '.txt')
-        get_args = {
-            'verify': False,
-            'timeout': self.app.socket_timeout,
-            'headers': self.app.headers,
-        }
+    POOL_CONNECTIONS = 512
+    CHUNK_SIZE = 64 * 1024
+    TRUNCATED_MARKER = 'TRUNCATED'
+    RESPONSE_SECTION = b'\nRESPONSE\n=========\n\n\n'
+    TITLE_BYTES = 16 * 1024
+    TITLE_PATTERN = re.compile(rb'<title[^>]*>(.*?)</title', re.IGNORECASE | re.DOTALL)
+    BODY_SEPARATOR = b'\n\n\n'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.workers = self.app.response_workers
+        self.session = sessions.get_session(self.app.resolver, self.POOL_CONNECTIONS, self.app.pool_size)
+
+    def close(self):
+        self.session.close()
+
+    def read_body(self, path):
+        """Returns body of a stored response, headers differ between requests even if the content does not
+
+        """
+        with open(path, 'rb') as fil:
+            _, _, response = fil.read().partition(self.RESPONSE_SECTION)
+        return response.partition(self.BODY_SEPARATOR)[2]
+
+    def is_unchanged(self, baseline_path, path):
+        return self.read_body(baseline_path) == self.read_body(path)
+
+    def abort(self, response):
+        """Shuts the connection down, so that a read blocked on a slow peer returns
+
+        """
         try:
-            response = requests.get(url, **get_args)
+            response.raw.connection.sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+
+    def get_decoder(self, response):
+        if not response.encoding:
+            return None
+        try:
+            return codecs.getincrementaldecoder(response.encoding)(errors='replace')
+        except LookupError:
+            return None
+
+    def get_title(self, response, head):
+        match = self.TITLE_PATTERN.search(head)
+        if not match:
+            return None
+        title = match.group(1).decode(response.encoding or 'utf-8', errors='replace')
+        return ' '.join(html.unescape(title).split())
+
+    def write_body(self, response, fil, digest, head, decode=True):
+        """Streams the body to file in chunks updating its digest and head, returns the reason of truncation or None
+
+        """
+        decoder = self.get_decoder(response) if decode else None
+        size = 0
+        deadline = time.monotonic() + self.app.response_timeout
+        # NOTE: Read timeout applies to a single read only, a peer trickling data is cut off by the timer
+        timer = threading.Timer(self.app.response_timeout, self.abort, (response,))
+        timer.daemon = True
+        timer.start()
+        truncated = None
+        try:
+            for chunk in response.iter_content(self.CHUNK_SIZE):
+                if size + len(chunk) > self.app.max_body_size:
+                    chunk = chunk[:self.app.max_body_size - size]
+                    truncated = f'body exceeds {self.app.max_body_size} bytes'
+                if size < self.TITLE_BYTES:
+                    head.extend(chunk[:self.TITLE_BYTES - size])
+                size += len(chunk)
+                digest.update(chunk)
+                fil.write(decoder.decode(chunk).encode('utf-8') if decoder else chunk)
+                if truncated:
+                    break
+                if time.monotonic() >= deadline:
+                    truncated = f'reading took longer than {self.app.response_timeout} seconds'
+                    break
+        except requests.exceptions.RequestException as exc:
+            if time.monotonic() >= deadline:
+                truncated = f'reading took longer than {self.app.response_timeout} seconds'
+            else:
+                truncated = f'connection failed ({exc})'
+        finally:
+            timer.cancel()
+        if decoder:
+            fil.write(decoder.decode(b'', final=True).encode('utf-8'))
+        return truncated
+
+    def not_modified(self, url, response, base_filename):
+        """Keeps result of the baseline run for response `304 Not Modified`, returns False if there is none
+
+        """
+        if self.app.blobs:
+            digest = self.app.validators.get_digest(url)
+            if digest is None or not self.app.blobs.get_path(digest).exists():
+                return False
+            self.app.validators.not_modified(url)
+            self.app.index.add(self.name.lower(), url, digest, status=response.status_code, headers=dict(response.headers))
+            self.app.db.add_response(url, response.status_code, None, response.headers, digest, self.app.blobs.get_path(digest), None, response.elapsed.total_seconds())
+            if self.app.changes:
+                self.app.changes.compare_digest(self, url, True)
+            logs.logger.info(f'Not modified {url}, kept {digest}')
+            return True
+        # NOTE: Response of the baseline run is kept instead of writing the file again
+        if self.app.changes and self.app.changes.keep(self, url, base_filename):
+            self.app.validators.not_modified(url)
+            logs.logger.info(f'Not modified {url}, kept {base_filename}')
+            self.app.db.add_response(url, response.status_code, None, response.headers, self.app.validators.get_digest(url), base_filename, None, response.elapsed.total_seconds())
+            return True
+        return False
+
+    def save_file(self, url, response, base_filename):
+        request_header = 'REQUEST'
+        response_header = '\nRESPONSE'
+        request = response.request
+        output = [request_header, '=' * len(request_header), '\n', f'{request.method} {request.url}', '\n']
+        output.extend([header + ': ' + value for header, value in request.headers.items()])
+        output.extend([response_header, '=' * len(response_header), '\n'])
+        output.extend([header + ': ' + value for header, value in response.headers.items()])
+        output.append('\n')
+        digest = hashlib.sha256()
+        head = bytearray()
+        with changes.writing(base_filename) as temp_filename, open(temp_filename, 'wb') as fil:
+            fil.write(('\n'.join(output) + '\n').encode('utf-8'))
+            truncated = self.write_body(response, fil, digest, head)
+            if truncated:
+                fil.write(f'\n\n[{self.TRUNCATED_MARKER}: {truncated}]\n'.encode('utf-8'))
+        if truncated:
+            logs.logger.debug(f'Response from {url} truncated: {truncated}')
+        logs.logger.info(f'Saved {base_filename}')
+        digest = digest.hexdigest()
+        self.app.db.add_response(url, response.status_code, self.get_title(response, head), response.headers, digest, base_filename, truncated, response.elapsed.total_seconds())
+        return digest
+
+    def save_blob(self, url, response):
+        """Stores body as is in the blob store, headers and other metadata go to the index
+
+        """
+        digest = hashlib.sha256()
+        head = bytearray()
+        temp = self.app.blobs.temp_file()
+        try:
+            with temp:
+                truncated = self.write_body(response, temp, digest, head, decode=False)
+        except BaseException:
+            os.unlink(temp.name)
+            raise
+        digest = digest.hexdigest()
+        path = self.app.blobs.commit(temp.name, digest)
+        if truncated:
+            logs.logger.debug(f'Response from {url} truncated: {truncated}')
+        self.app.index.add(
+            self.name.lower(),
+            url,
+            digest,
+            status=response.status_code,
+            request_headers=dict(response.request.headers),
+            headers=dict(response.headers),
+            truncated=truncated,
+        )
+        logs.logger.info(f'Stored response from {url} as {digest}')
+        self.app.db.add_response(url, response.status_code, self.get_title(response, head), response.headers, digest, path, truncated, response.elapsed.total_seconds())
+        return digest
+
+    def request(self, url, headers):
+        try:
+            return self.session.get(url, verify=False, timeout=self.app.socket_timeout, headers=headers, stream=True)
         except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout):
             logs.logger.debug(f'Could not retrieve {url}')
         except requests.exceptions.InvalidURL:
             logs.logger.debug(f'Invalid URL: {url}')
+        return None
+
+    def execute(self, url):
+        base_filename = None
+        if not self.app.blobs:
+            base_filename = pathlib.Path(self.get_base_dir(), self.get_base_filename(url) + '.txt')
+        response = self.request(url, {**self.app.headers, **self.app.validators.get_headers(url)})
+        if response is None:
+            return
+        if response.status_code == requests.codes.not_modified:
+            try:
+                if self.not_modified(url, response, base_filename):
+                    return
+            finally:
+                response.close()
+            # NOTE: Result of the baseline run is gone, the page is requested again without validators
+            logs.logger.debug(f'No result of the baseline run to keep for {url}, requesting it again')
+            response = self.request(url, self.app.headers)
+            if response is None:
+                return
+        try:
+            if self.app.blobs:
+                digest = self.save_blob(url, response)
+            else:
+                digest = self.save_file(url, response, base_filename)
+        finally:
+            response.close()
+        unchanged = self.app.validators.record(url, response.headers, digest)
+        if not self.app.changes:
+            return
+        if self.app.validators.get_digest(url) or self.app.blobs:
+            self.app.changes.compare_digest(self, url, unchanged, base_filename)
         else:
-            request_header = 'REQUEST'
-            response_header = '\nRESPONSE'
-            request = response.request
-            output = [request_header, '=' * len(request_header), '\n', f'{request.method} {request.url}', '\n']
-            output.extend([header + ': ' + value for header, value in request.headers.items()])
-            output.extend([response_header, '=' * len(response_header), '\n'])
-            output.extend([header + ': ' + value for header, value in response.headers.items()])
-            output.append('\n')
-            output.append(response.content.decode(response.encoding))
-            pathlib.Path(base_filename).write_text('\n'.join(output))
-            logs.logger.info(f'Saved {base_filename}')
+            self.compare_baseline(url, base_filename)
@@ -0,0 +1,94 @@
+import ipaddress
+import re
+import socket
+import threading
+
+
+# NOTE: Names come from certificates and PTR records of scanned hosts, anything else could smuggle in browser arguments
+HOST_NAME_PATTERN = re.compile(r'[A-Za-z0-9*.-]+')
+
+
+def is_host_name(name):
+    return bool(name) and HOST_NAME_PATTERN.fullmatch(name) is not None
+
+
+def is_address(name):
+    try:
+        ipaddress.ip_address(name)
+    except ValueError:
+        return False
+    return True
+
+
+class Resolver:
+    """Thread-safe cache of forward DNS lookups
+
+    Host names can be pinned to the host they were found on, e.g. names from certificates and PTR records of an
+    address, so that they are requested from that address instead of being looked up.
+
+    """
+
+    def __init__(self):
+        self.addresses = dict()
+        self.pinned = dict()
+        self.order = list()
+        self.positions = dict()
+        self.lock = threading.Lock()
+
+    def pin(self, host, target):
+        """Pins host name to target host, returns False if it was pinned already or cannot be pinned
+
+        IP addresses are never pinned, an address listed in a certificate of another host is a target of its own.
+
+        """
+        if host == target or is_address(host) or not (is_host_name(host) and is_host_name(target)):
+            return False
+        with self.lock:
+            if host in self.pinned:
+                return False
+            self.pinned[host] = target
+            self.positions[host] = len(self.order)
+            self.order.append(host)
+        return True
+
+    def get_pinned(self, hosts=None):
+        """Returns pinned host names with their targets, optionally only the given ones
+
+        """
+        with self.lock:
+            if hosts is None:
+                return dict(self.pinned)
+            return {host: self.pinned[host] for host in hosts if host in self.pinned}
+
+    def get_pinned_batch(self, host, count):
+        """Returns up to `count` host names pinned in order starting with the given one, with their targets
+
+        """
+        with self.lock:
+            start = self.positions.get(host)
+            if start is None:
+                return dict()
+            return {name: self.pinned[name] for name in self.order[start:start + count]}
+
+    def resolve(self, host):
+        with self.lock:
+            target = self.pinned.get(host)
+        return self.lookup(host if target is None else target)
+
+    def lookup(self, host):
+        try:
+            socket.inet_pton(socket.AF_INET, host)
+        except OSError:
+            pass
+        else:
+            return host
+        with self.lock:
+            if host in self.addresses:
+                return self.addresses[host]
+        try:
+            address = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+        except (socket.gaierror, UnicodeError):
+            address = None
+        with self.lock:
+            self.addresses[host] = address
+        return address
@@ -0,0 +1,84 @@
+import json
+import os
+import pathlib
+import threading
+import time
+
+from pukpuk import logs
+
+
+class Cache:
+    """Thread-safe cache of PTR lookups honouring record TTLs, failed lookups are cached as well
+
+    Concurrent lookups of the same address wait for the first one instead of sending identical queries.
+
+    """
+
+    NEGATIVE_TTL = 300
+
+    def __init__(self):
+        self.entries = dict()
+        self.pending = dict()
+        self.lock = threading.Lock()
+
+    def get(self, address):
+        """Returns (True, name or None) for a cached address, (False, None) otherwise
+
+        """
+        with self.lock:
+            entry = self.entries.get(address)
+        if entry is None or entry[1] < time.time():
+            return False, None
+        return True, entry[0]
+
+    def set(self, address, name, ttl):
+        with self.lock:
+            self.entries[address] = (name, time.time() + ttl)
+
+    def resolve(self, address, lookup):
+        """Returns name of address, `lookup` returning (name, TTL) is called once for concurrent requests
+
+        """
+        found, name = self.get(address)
+        if found:
+            return name
+        with self.lock:
+            event = self.pending.get(address)
+            waiting = event is not None
+            if not waiting:
+                event = self.pending[address] = threading.Event()
+        if waiting:
+            event.wait()
+            return self.get(address)[1]
+        name, ttl = None, self.NEGATIVE_TTL
+        try:
+            name, ttl = lookup(address)
+        finally:
+            self.set(address, name, ttl)
+            with self.lock:
+                del self.pending[address]
+            event.set()
+        return name
+
+    def load(self, path):
+        try:
+            with open(path) as fil:
+                entries = json.load(fil)
+        except FileNotFoundError:
+            return
+        except ValueError as exc:
+            logs.logger.debug(f'Ignoring malformed PTR cache `{path}`: {exc}')
+            return
+        now = time.time()
+        with self.lock:
+            self.entries.update((address, tuple(entry)) for address, entry in entries.items() if entry[1] >= now)
+        logs.logger.debug(f'Loaded {len(self.entries)} PTR records from `{path}`')
+
+    def save(self, path):
+        now = time.time()
+        with self.lock:
+            entries = {address: entry for address, entry in self.entries.items() if entry[1] >= now}
+        temp_path = pathlib.Path(str(path) + '.tmp')
+        with open(temp_path, 'w') as fil:
+            json.dump(entries, fil)
+        os.replace(temp_path, path)
@@ -0,0 +1,143 @@
+import collections
+import random
+import socket
+import zlib
+
+
+class Permutation:
+    """Pseudorandom permutation of `range(size)` computed on the fly
+
+    Uses a balanced Feistel network over the smallest even bit width covering `size` and cycle-walks values falling
+    outside of the range, memory usage does not depend on `size`.
+
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, size):
+        self.size = size
+        self.half_bits = (max((size - 1).bit_length(), 2) + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        self.keys = [random.getrandbits(64) for _ in range(self.ROUNDS)]
+
+    def encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ (hash((key, right)) & self.mask)
+        return (left << self.half_bits) | right
+
+    def __iter__(self):
+        for index in range(self.size):
+            value = self.encrypt(index)
+            while value >= self.size:
+                value = self.encrypt(value)
+            yield value
+
+
+def shuffled(items, window=10000):
+    """Shuffles a stream of items using a bounded buffer
+
+    """
+    buffer = list()
+    for item in items:
+        if len(buffer) < window:
+            buffer.append(item)
+        else:
+            index = random.randrange(window)
+            yield buffer[index]
+            buffer[index] = item
+    random.shuffle(buffer)
+    yield from buffer
+
+
+def interleaved(groups, width):
+    """Yields items of lazy groups taking turns, at most `width` groups are read at once
+
+    """
+    groups = iter(groups)
+    active = collections.deque()
+    exhausted = False
+    while True:
+        while not exhausted and len(active) < width:
+            group = next(groups, None)
+            if group is None:
+                exhausted = True
+            else:
+                active.append(iter(group))
+        if not active:
+            return
+        group = active.popleft()
+        for item in group:
+            yield item
+            active.append(group)
+            break
+
+
+def in_shard(host, shard):
+    """Tells if host belongs to shard given as (index, count), index starting from 1
+
+    """
+    index, count = shard
+    return zlib.crc32(host.encode()) % count == index - 1
+
+
+class TargetFilter:
+    """Remembers seen (host, port, protocol) targets
+
+    IPv4 targets are kept as bits in bitmaps allocated per service and /16 network on first use, which costs one bit
+    per address of the scanned ranges. Other hosts (names, IPv6) are kept in a set.
+
+    """
+
+    BLOCK_BITS = 16
+
+    def __init__(self):
+        self.services = dict()
+        self.blocks = dict()
+        self.others = set()
+
+    def locate(self, target, allocate):
+        """Returns bitmap, byte offset and bit mask of IPv4 target, None for other hosts
+
+        """
+        host, port, proto = target
+        try:
+            address = int.from_bytes(socket.inet_pton(socket.AF_INET, host), 'big')
+        except (OSError, TypeError):
+            return None
+        service = self.services.get((port, proto))
+        if service is None:
+            if not allocate:
+                return None, 0, 0
+            service = self.services[(port, proto)] = len(self.services)
+        key = (service, address >> self.BLOCK_BITS)
+        block = self.blocks.get(key)
+        if block is None:
+            if not allocate:
+                return None, 0, 0
+            block = self.blocks[key] = bytearray(1 << (self.BLOCK_BITS - 3))
+        offset = address & ((1 << self.BLOCK_BITS) - 1)
+        return block, offset >> 3, 1 << (offset & 7)
+
+    def __contains__(self, target):
+        location = self.locate(target, False)
+        if location is None:
+            return target in self.others
+        block, index, mask = location
+        return block is not None and bool(block[index] & mask)
+
+    def add(self, target):
+        """Returns True if target has not been seen before
+
+        """
+        location = self.locate(target, True)
+        if location is None:
+            if target in self.others:
+                return False
+            self.others.add(target)
+            return True
+        block, index, mask = location
+        if block[index] & mask:
+            return False
+        block[index] |= mask
+        return True
@@ -0,0 +1,59 @@
+import http.cookiejar
+
+import requests
+import requests.adapters
+import requests.utils
+from urllib3.util import parse_url
+
+
+class Host(str):
+    """`Host` header derived from URL by the adapter, unlike one set by the caller it is replaced when the prepared
+    request is reused for a redirect
+
+    """
+
+
+class AddressAdapter(requests.adapters.HTTPAdapter):
+    """Keeps connection pools by (scheme, IP address, port) instead of host name
+
+    Host names are resolved once and sent as `Host` header, HTTPS connections also carry them as SNI which makes the
+    name part of the pool key for these. Requests going through a proxy and hosts without an IPv4 address, e.g. IPv6
+    literals, are left to the stock adapter.
+
+    """
+
+    def __init__(self, resolver, **kwargs):
+        self.resolver = resolver
+        super().__init__(**kwargs)
+
+    def get_connection(self, url, proxies=None):
+        if requests.utils.select_proxy(url, proxies):
+            return super().get_connection(url, proxies)
+        parsed = parse_url(url)
+        address = self.resolver.resolve(parsed.host)
+        if address is None:
+            return super().get_connection(url, proxies)
+        pool_kwargs = None
+        if parsed.scheme == 'https':
+            pool_kwargs = {
+                'server_hostname': parsed.host,
+                'assert_hostname': False,
+            }
+        return self.poolmanager.connection_from_host(address, port=parsed.port, scheme=parsed.scheme, pool_kwargs=pool_kwargs)
+
+    def add_headers(self, request, **kwargs):
+        if isinstance(request.headers.get('Host', Host()), Host):
+            parsed = parse_url(request.url)
+            request.headers['Host'] = Host(parsed.netloc.rpartition('@')[2])
+
+
+def get_session(resolver, pool_connections, pool_maxsize):
+    """Session shared by threads, cookies are never stored so that requests stay independent from each other
+
+    """
+    session = requests.Session()
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    adapter = AddressAdapter(resolver, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
@@ -0,0 +1,249 @@
+import asyncio
+import collections
+import ipaddress
+import socket
+import threading
+import time
+
+from pukpuk import logs
+
+
+CONNECTED = 'connected'
+REFUSED = 'refused'
+TIMEOUT = 'timeout'
+RESET = 'reset'
+UNREACHABLE = 'unreachable'
+OUTCOMES = (CONNECTED, REFUSED, TIMEOUT, RESET, UNREACHABLE)
+
+
+def get_outcome(exc):
+    if isinstance(exc, (socket.timeout, asyncio.TimeoutError, TimeoutError)):
+        return TIMEOUT
+    if isinstance(exc, ConnectionRefusedError):
+        return REFUSED
+    if isinstance(exc, ConnectionResetError):
+        return RESET
+    return UNREACHABLE
+
+
+def get_subnet(host):
+    """Returns /24 network of IPv4 address, other hosts make a group of their own
+
+    """
+    try:
+        return str(ipaddress.IPv4Network(f'{host}/24', strict=False))
+    except ValueError:
+        return host
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Subnet:
+    """Congestion state of a single subnet: window of probes in flight and probes per second
+
+    """
+
+    LATENCY_SAMPLES = 1000
+
+    def __init__(self, throttle):
+        self.throttle = throttle
+        self.window = float(throttle.max_concurrency)
+        self.rate = float(throttle.max_rate)
+        self.in_flight = 0
+        self.next_send = 0
+        self.sent = 0
+        self.decreased = 0
+        self.responsive = set()
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+        self.latencies = collections.deque(maxlen=self.LATENCY_SAMPLES)
+
+    def try_acquire(self, now):
+        """Returns sequence number of the probe, or None and time to wait before trying again
+
+        """
+        if self.in_flight >= max(int(self.window), 1):
+            return None, self.throttle.POLL_INTERVAL
+        if now < self.next_send:
+            return None, self.next_send - now
+        self.in_flight += 1
+        self.next_send = max(self.next_send, now) + 1 / self.rate
+        self.sent += 1
+        return self.sent, 0
+
+    def release(self, seq, host, outcome, latency):
+        self.in_flight -= 1
+        self.counts[outcome] += 1
+        if outcome in (CONNECTED, REFUSED):
+            self.responsive.add(host)
+            self.latencies.append(latency)
+            self.window = min(self.window + 1 / self.window, self.throttle.max_concurrency)
+            self.rate = min(self.rate + self.throttle.RATE_INCREASE, self.throttle.max_rate)
+        elif outcome in (TIMEOUT, RESET) and host in self.responsive and seq > self.decreased:
+            # NOTE: Probes sent before the previous decrease were lost to the same congestion
+            self.decreased = self.sent
+            self.window = max(self.window * self.throttle.DECREASE_FACTOR, self.throttle.min_concurrency)
+            self.rate = max(self.rate * self.throttle.DECREASE_FACTOR, self.throttle.min_rate)
+
+
+class Throttle:
+    """Adaptive pacing of discovery probes per /24 subnet
+
+    Every subnet starts at the maximum number of probes in flight and probes per second. Both grow additively with
+    every reply (connection accepted or refused) and are halved when a probe to a host which has already replied
+    times out or gets reset, at most once per window of probes. Silent hosts do not slow the subnet down, timed out
+    probes to replying hosts are retried.
+
+    """
+
+    POLL_INTERVAL = 0.01
+    DECREASE_FACTOR = 0.5
+    RATE_INCREASE = 1
+    MAX_RETRIES = 1
+
+    def __init__(self, min_concurrency, max_concurrency, min_rate, max_rate):
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.subnets = dict()
+        self.lock = threading.Lock()
+
+    def try_acquire(self, host):
+        with self.lock:
+            name = get_subnet(host)
+            subnet = self.subnets.get(name)
+            if subnet is None:
+                subnet = self.subnets[name] = Subnet(self)
+            seq, delay = subnet.try_acquire(time.monotonic())
+        return (subnet, seq), delay
+
+    def acquire(self, host):
+        """Blocks until a probe of host can be sent, returns ticket to release once it is done
+
+        """
+        while True:
+            ticket, delay = self.try_acquire(host)
+            if not delay:
+                return ticket
+            time.sleep(delay)
+
+    async def acquire_async(self, host):
+        while True:
+            ticket, delay = self.try_acquire(host)
+            if not delay:
+                return ticket
+            await asyncio.sleep(delay)
+
+    def release(self, ticket, host, outcome, latency):
+        subnet, seq = ticket
+        with self.lock:
+            subnet.release(seq, host, outcome, latency)
+
+    def should_retry(self, host, outcome, attempt):
+        if outcome != TIMEOUT or attempt >= self.MAX_RETRIES:
+            return False
+        with self.lock:
+            subnet = self.subnets.get(get_subnet(host))
+            return subnet is not None and host in subnet.responsive
+
+    def report(self):
+        with self.lock:
+            subnets = list(self.subnets.items())
+        for name, subnet in subnets:
+            p50 = percentile(subnet.latencies, 0.5)
+            p95 = percentile(subnet.latencies, 0.95)
+            message = (
+                f'Subnet {name}: {subnet.sent} probes, '
+                + ', '.join(f'{count} {outcome}' for outcome, count in subnet.counts.items() if count)
+                + (f', latency p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms' if subnet.latencies else '')
+                + f', ended at {int(subnet.window)} in flight and {subnet.rate:.0f} probes/s'
+            )
+            if subnet.decreased:
+                logs.logger.info(message)
+            else:
+                logs.logger.debug(message)
+
+
+class Scheduler:
+    """Hands out targets keeping the number of probes per host and per /24 subnet under limits, 0 means no limit
+
+    Targets over a limit wait in a bounded buffer while the following ones go ahead. A target counts from the moment
+    it is handed out until it is released.
+
+    """
+
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, targets, max_host, max_subnet, lookahead):
+        self.targets = iter(targets)
+        self.max_host = max_host
+        self.max_subnet = max_subnet
+        self.lookahead = lookahead
+        self.buffer = list()
+        self.exhausted = False
+        self.hosts = collections.Counter()
+        self.subnets = collections.Counter()
+        self.condition = threading.Condition()
+
+    def is_allowed(self, host, subnet):
+        return (
+            (not self.max_host or self.hosts[host] < self.max_host)
+            and (not self.max_subnet or self.subnets[subnet] < self.max_subnet)
+        )
+
+    def try_next(self):
+        """Returns the first target under limits, None if there is none and whether all targets were handed out
+
+        """
+        while not self.exhausted and len(self.buffer) < self.lookahead:
+            target = next(self.targets, None)
+            if target is None:
+                self.exhausted = True
+            else:
+                self.buffer.append((target, get_subnet(target[0])))
+        for index, (target, subnet) in enumerate(self.buffer):
+            if self.is_allowed(target[0], subnet):
+                del self.buffer[index]
+                self.hosts[target[0]] += 1
+                self.subnets[subnet] += 1
+                return target, False
+        return None, self.exhausted and not self.buffer
+
+    def release(self, target):
+        with self.condition:
+            host = target[0]
+            subnet = get_subnet(host)
+            self.hosts[host] -= 1
+            if not self.hosts[host]:
+                del self.hosts[host]
+            self.subnets[subnet] -= 1
+            if not self.subnets[subnet]:
+                del self.subnets[subnet]
+            self.condition.notify_all()
+
+    def __iter__(self):
+        while True:
+            with self.condition:
+                target, done = self.try_next()
+                if target is None and not done:
+                    self.condition.wait()
+                    continue
+            if done:
+                return
+            yield target
+
+    async def __aiter__(self):
+        while True:
+            with self.condition:
+                target, done = self.try_next()
+            if done:
+                return
+            if target is None:
+                await asyncio.sleep(self.POLL_INTERVAL)
+            else:
+                yield target
@@ -0,0 +1,52 @@
+import ssl
+
+
+class Handshake:
+    """TLS client handshake over memory buffers
+
+    Lets the caller see the first bytes sent by the peer, so a plaintext reply to ClientHello can be told apart
+    from a TLS service on the same connection.
+
+    """
+
+    # NOTE: change_cipher_spec, alert, handshake, application_data
+    RECORD_TYPES = (0x14, 0x15, 0x16, 0x17)
+
+    def __init__(self, ssl_ctx, host):
+        self.incoming = ssl.MemoryBIO()
+        self.outgoing = ssl.MemoryBIO()
+        self.ssl_obj = ssl_ctx.wrap_bio(self.incoming, self.outgoing, server_hostname=host)
+        self.encrypted = None
+        self.plaintext = None
+        self.done = False
+
+    def step(self):
+        """Advances the handshake, returns True once it is complete
+
+        """
+        try:
+            self.ssl_obj.do_handshake()
+        except ssl.SSLWantReadError:
+            return False
+        self.done = True
+        return True
+
+    def pending(self):
+        return self.outgoing.read()
+
+    def receive(self, data):
+        """Feeds bytes received from the peer, returns False if the peer does not speak TLS
+
+        """
+        if not data:
+            raise ConnectionResetError('Connection closed during TLS handshake')
+        if self.encrypted is None:
+            self.encrypted = data[0] in self.RECORD_TYPES
+            if not self.encrypted:
+                self.plaintext = data
+                return False
+        self.incoming.write(data)
+        return True
+
+    def certificate(self):
+        return self.ssl_obj.getpeercert(True)
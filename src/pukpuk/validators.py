@@ -0,0 +1,104 @@
+import json
+import pathlib
+import threading
+
+from pukpuk import logs
+
+
+class Validators:
+    """Per-URL cache of response validators, i.e. `ETag` and `Last-Modified` headers and SHA-256 of the body
+
+    Every run writes the cache to its output directory, validators of the baseline run are sent as `If-None-Match`
+    and `If-Modified-Since` headers and tell which pages did not change since.
+
+    """
+
+    FILENAME = 'validators.jsonl'
+
+    def __init__(self):
+        self.previous = dict()
+        self.unchanged = set()
+        self.fil = None
+        self.lock = threading.Lock()
+
+    def load(self, directory):
+        path = pathlib.Path(directory, self.FILENAME)
+        if not path.exists():
+            return
+        with open(path) as fil:
+            for line in fil:
+                try:
+                    entry = json.loads(line)
+                    url = entry['url']
+                except (ValueError, KeyError, TypeError):
+                    logs.logger.debug(f'Skipping malformed validators entry `{line.strip()}`')
+                    continue
+                self.previous[url] = entry
+        logs.logger.debug(f'Loaded validators of {len(self.previous)} URLs from `{directory}`')
+
+    def open(self, directory):
+        self.fil = open(pathlib.Path(directory, self.FILENAME), 'a')
+
+    def close(self):
+        with self.lock:
+            if self.fil:
+                self.fil.close()
+                self.fil = None
+
+    def get_headers(self, url):
+        """Returns headers making the request conditional on changes since the baseline run
+
+        """
+        entry = self.previous.get(url)
+        headers = dict()
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def get_digest(self, url):
+        """Returns body digest of URL in the baseline run
+
+        """
+        entry = self.previous.get(url)
+        return entry.get('digest') if entry else None
+
+    def not_modified(self, url):
+        """Records validators of the baseline run for URL which returned `304 Not Modified`
+
+        """
+        entry = self.previous.get(url)
+        if entry:
+            self.write(entry)
+        with self.lock:
+            self.unchanged.add(url)
+
+    def record(self, url, headers, digest):
+        """Records validators of a fetched response, returns True if the body did not change since the baseline run
+
+        """
+        entry = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'digest': digest,
+        }
+        self.write(entry)
+        previous = self.previous.get(url)
+        unchanged = previous is not None and previous.get('digest') == digest
+        if unchanged:
+            with self.lock:
+                self.unchanged.add(url)
+        return unchanged
+
+    def is_unchanged(self, url):
+        with self.lock:
+            return url in self.unchanged
+
+    def write(self, entry):
+        with self.lock:
+            if self.fil:
+                self.fil.write(json.dumps(entry) + '\n')
+                self.fil.flush()
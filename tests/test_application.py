@@ -1,4 +1,50 @@
-from pukpuk import base
+import asyncio
+import datetime
+import hashlib
+import http.server
+import ipaddress
+import itertools
+import json
+import os
+import pathlib
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509.oid import NameOID
+from OpenSSL import crypto
+from PIL import (
+    Image,
+    ImageDraw,
+)
+
+from pukpuk import (
+    base,
+    blobs,
+    browser,
+    certificates,
+    changes,
+    database,
+    images,
+    journal,
+    merge,
+    metrics,
+    mods,
+    names,
+    ptr,
+    sequences,
+    sessions,
+    throttle,
+    validators,
+)
 
 
 def test_get_discovery_targets(http, tmp_dir):
@@ -55,3 +101,860 @@ def test_get_discovery_targets_different(http, tmp_dir):
         ('localhost', 8443, 'https'),
         ('localhost', 9443, 'https'),
     }
+
+
+def test_get_discovery_targets_engines(http, tmp_dir):
+    target_ip, _ = http
+    targets = (
+        (target_ip, 8000, 'http'),
+        (target_ip, None, 'http'),
+        (target_ip, 8888, None),
+        (target_ip, 80, 'http'),
+    )
+    services = (
+        (443, None),
+        (8080, None),
+        (8443, 'https'),
+        (9443, 'https'),
+    )
+    results = [
+        set(base.Application(output_dir=tmp_dir, engine=engine).get_discovery_targets(targets, services))
+        for engine in base.Application.ENGINES
+    ]
+    assert results[0] == results[1]
+    assert (target_ip, 443, 'https') in results[1]
+    assert (target_ip, 8080, 'http') in results[1]
+
+
+def test_port_test_single_connection(http, tmp_dir):
+    target_ip, _ = http
+    app = base.Application(output_dir=tmp_dir)
+    proto, cert = app.port_test(target_ip, 8000, app.sock_connect(target_ip, 8000))
+    assert proto == 'http'
+    assert cert is None
+    proto, cert = app.port_test(target_ip, 8443, app.sock_connect(target_ip, 8443))
+    assert proto == 'https'
+    assert cert
+
+
+def test_expand_targets_streaming(tmp_dir):
+    app = base.Application(output_dir=tmp_dir)
+    targets = itertools.chain(
+        app.targets_from_network('10.0.0.0/8'),
+        app.targets_from_network('10.0.0.0/30'),
+    )
+    services = (
+        (80, 'http'),
+        (8443, None),
+    )
+    expanded = app.expand_targets(targets, services)
+    assert list(itertools.islice(expanded, 4)) == [
+        ('10.0.0.0', 80, 'http'),
+        ('10.0.0.0', 8443, None),
+        ('10.0.0.1', 80, 'http'),
+        ('10.0.0.1', 8443, None),
+    ]
+
+
+def test_expand_targets_unique(tmp_dir):
+    app = base.Application(output_dir=tmp_dir)
+    targets = itertools.chain(
+        app.targets_from_network('10.0.0.0/30'),
+        app.targets_from_network('10.0.0.2-10.0.0.5'),
+        (('localhost', None, None), ('localhost', 80, 'http')),
+    )
+    expanded = list(app.expand_targets(targets, ((80, 'http'),)))
+    assert len(expanded) == len(set(expanded)) == 7
+
+
+def test_interleaved_targets(tmp_dir):
+    app = base.Application(output_dir=tmp_dir)
+    targets = itertools.chain(app.targets_from_network('10.0.0.0/8'), (('10.0.0.1', 80, 'http'),))
+    groups = app.expand_groups(targets, ((80, 'http'), (81, 'http'), (82, 'http')))
+    assert list(itertools.islice(sequences.interleaved(groups, 2), 7)) == [
+        ('10.0.0.0', 80, 'http'),
+        ('10.0.0.1', 80, 'http'),
+        ('10.0.0.0', 81, 'http'),
+        ('10.0.0.1', 81, 'http'),
+        ('10.0.0.0', 82, 'http'),
+        ('10.0.0.1', 82, 'http'),
+        ('10.0.0.2', 80, 'http'),
+    ]
+    assert list(sequences.interleaved(([1, 2, 3], [], [4]), 2)) == [1, 2, 4, 3]
+
+
+def test_scheduler_limits():
+    targets = [(host, port, 'http') for host in ('10.0.0.1', '10.0.0.2', '10.0.1.1') for port in (80, 81, 82)]
+    scheduler = throttle.Scheduler(targets, 2, 3, 100)
+    iterator = iter(scheduler)
+    first = list(itertools.islice(iterator, 4))
+    assert first == [('10.0.0.1', 80, 'http'), ('10.0.0.1', 81, 'http'), ('10.0.0.2', 80, 'http'), ('10.0.1.1', 80, 'http')]
+    threading.Timer(0.1, scheduler.release, (first[0],)).start()
+    assert next(iterator) == ('10.0.1.1', 81, 'http')
+    assert next(iterator) == ('10.0.0.1', 82, 'http')
+    for target in first[1:]:
+        scheduler.release(target)
+    released = list()
+
+    async def collect():
+        async for target in scheduler:
+            released.append(target)
+            scheduler.release(target)
+
+    asyncio.run(collect())
+    assert sorted(first + released + [('10.0.1.1', 81, 'http'), ('10.0.0.1', 82, 'http')]) == sorted(targets)
+
+
+def test_randomized_network(tmp_dir):
+    app = base.Application(output_dir=tmp_dir, randomize=True)
+    addresses = [host for host, _, _ in app.targets_from_network('10.0.0.0/22')]
+    assert len(addresses) == 1024
+    assert set(addresses) == {f'10.0.{i}.{j}' for i in range(4) for j in range(256)}
+    assert addresses != sorted(addresses, key=lambda address: tuple(map(int, address.split('.'))))
+
+
+def test_permutation():
+    for size in (0, 1, 2, 3, 100, 1000):
+        assert sorted(sequences.Permutation(size)) == list(range(size))
+    assert sorted(sequences.shuffled(range(1000), window=10)) == list(range(1000))
+
+
+def test_screen_workers_default(tmp_dir):
+    app = base.Application(output_dir=tmp_dir, workers=100)
+    assert app.response_workers == 100
+    assert 1 <= app.screen_workers <= os.cpu_count()
+    meminfo = pathlib.Path(tmp_dir, 'meminfo')
+    meminfo.write_text('MemTotal:       16384000 kB\nMemFree:          262144 kB\nMemAvailable:    8388608 kB\n')
+    app.MEMINFO_PATH = meminfo
+    assert app.get_available_memory() == 8 * 1024 ** 3
+
+
+def test_stages_independent(tmp_dir):
+    app = base.Application(output_dir=tmp_dir)
+    blocked = threading.Event()
+    fetched = list()
+    app.stages = [
+        base.Stage('Slow', lambda url: blocked.wait(5), 1, 1),
+        base.Stage('Fast', fetched.append, 1, 1),
+    ]
+    app.execute('http://127.0.0.1:80')
+    slow, fast = app.stages
+    fast.close()
+    assert fetched == ['http://127.0.0.1:80']
+    blocked.set()
+    slow.close()
+
+
+def test_stages_fed_independently(tmp_dir):
+    app = base.Application(output_dir=tmp_dir)
+    blocked = threading.Event()
+    fetched = list()
+    app.stages = [
+        base.Stage('Slow', lambda url: blocked.wait(5), 1, 1),
+        base.Stage('Fast', fetched.append, 1, 1),
+    ]
+    urls = [f'http://127.0.0.1:{port}' for port in range(80, 90)]
+    slow, fast = app.stages
+    slow.feed(urls)
+    fast.feed(urls)
+    fast.close()
+    assert fetched == urls
+    blocked.set()
+    slow.close()
+
+
+def test_missing_browser(tmp_dir):
+    urls_path = pathlib.Path(tmp_dir, 'urls.txt')
+    urls_path.write_text(''.join(f'http://127.0.0.1:1/{index}\n' for index in range(10)))
+    for pool in ('0', '1'):
+        result = subprocess.run(
+            [
+                sys.executable, '-m', 'pukpuk.cli', '-U', str(urls_path), '-b', os.path.join(tmp_dir, 'chromium'),
+                '--screen-workers', '1', '--browser-pool', pool, '-o', os.path.join(tmp_dir, f'output-{pool}'),
+            ],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        assert result.returncode == 1
+        assert 'installed?' in result.stderr
+
+
+def test_journal_resume(tmp_dir):
+    scan = journal.Journal()
+    scan.open(tmp_dir, ['-N', '127.0.0.1/32'])
+    scan.target_done(('127.0.0.1', 80, 'http'))
+    scan.target_done(('localhost', 8000, None))
+    scan.add_discovered(('127.0.0.1', 80, 'http'))
+    scan.module_done('Responses', 'http://127.0.0.1:80')
+    scan.close()
+    with open(os.path.join(tmp_dir, journal.Journal.FILENAME), 'a') as fil:
+        fil.write('["targets", ["127.0')
+    entries = pathlib.Path(tmp_dir, journal.Journal.FILENAME).read_text().splitlines()
+    assert [json.loads(entry)[0] for entry in entries[:-1]] == ['args', 'discovered', 'executed', 'targets']
+    resumed = journal.Journal()
+    assert resumed.load(tmp_dir) is True
+    assert resumed.args == ['-N', '127.0.0.1/32']
+    assert resumed.is_target_done(('127.0.0.1', 80, 'http')) is True
+    assert resumed.is_target_done(('localhost', 8000, None)) is True
+    assert resumed.is_target_done(('127.0.0.1', 8000, 'http')) is False
+    assert list(resumed.discovered) == [('127.0.0.1', 80, 'http')]
+    assert resumed.is_executed('Responses', 'http://127.0.0.1:80') is True
+    assert resumed.is_executed('Screens', 'http://127.0.0.1:80') is False
+
+
+def test_journal_flush(tmp_dir):
+    scan = journal.Journal()
+    scan.FLUSH_ENTRIES = 3
+    scan.open(tmp_dir, list())
+    path = pathlib.Path(tmp_dir, journal.Journal.FILENAME)
+    scan.target_done(('127.0.0.1', 80, 'http'))
+    assert path.read_text() == ''
+    scan.target_done(('127.0.0.1', 8000, 'http'))
+    assert path.read_text() == '["args", []]\n["targets", ["127.0.0.1", 80, "http"], ["127.0.0.1", 8000, "http"]]\n'
+    scan.FLUSH_INTERVAL = 0
+    scan.target_done(('127.0.0.1', 8080, 'http'))
+    assert path.read_text().splitlines()[-1] == '["targets", ["127.0.0.1", 8080, "http"]]'
+    scan.close()
+
+
+def test_stages_skip_executed(tmp_dir):
+    scan = journal.Journal()
+    scan.executed.add(('Fetch', 'http://127.0.0.1:80'))
+    fetched = list()
+    stage = base.Stage('Fetch', fetched.append, 1, 1, scan)
+    stage.submit('http://127.0.0.1:80')
+    stage.submit('http://127.0.0.1:8000')
+    stage.close()
+    assert fetched == ['http://127.0.0.1:8000']
+
+
+def test_changes_baseline(tmp_dir):
+    response = 'REQUEST\n=======\n\n\nGET {url}\n\n\nHost: localhost\n\nRESPONSE\n=========\n\n\nDate: {date}\n\n\n{body}'
+    baseline_dir = os.path.join(tmp_dir, 'baseline')
+    os.makedirs(os.path.join(baseline_dir, 'responses'))
+    with open(os.path.join(baseline_dir, 'urls.txt'), 'w') as fil:
+        fil.write('http://localhost:80\nhttp://localhost:8000\nhttp://localhost:8080\n')
+    app = base.Application(output_dir=os.path.join(tmp_dir, 'current'))
+    app.changes = changes.Changes(app, baseline_dir)
+    assert app.changes.load() is True
+    module = mods.Responses(app)
+    for url, body in (('http://localhost:80', 'Same'), ('http://localhost:8000', 'Old')):
+        with open(os.path.join(baseline_dir, 'responses', module.get_base_filename(url) + '.txt'), 'w') as fil:
+            fil.write(response.format(url=url, date='Mon', body=body))
+    for url, body in (('http://localhost:80', 'Same'), ('http://localhost:8000', 'New'), ('http://localhost:8443', 'New')):
+        path = os.path.join(module.get_base_dir(), module.get_base_filename(url) + '.txt')
+        with open(path, 'w') as fil:
+            fil.write(response.format(url=url, date='Tue', body=body))
+        module.compare_baseline(url, path)
+    module.close()
+    unchanged = module.get_base_filename('http://localhost:80') + '.txt'
+    assert os.path.samefile(os.path.join(baseline_dir, 'responses', unchanged), os.path.join(module.get_base_dir(), unchanged))
+    app.changes.report(['http://localhost:80', 'http://localhost:8000', 'http://localhost:8443'])
+    with open(os.path.join(app.output_dir, 'changes.txt')) as fil:
+        assert fil.read().splitlines() == [
+            '~ responses http://localhost:8000',
+            '- http://localhost:8080',
+            '+ http://localhost:8443',
+        ]
+    linked = os.path.join(module.get_base_dir(), unchanged)
+    with changes.writing(linked) as temp_path:
+        temp_path.write_text(response.format(url='http://localhost:80', date='Wed', body='Rewritten'))
+    assert not os.path.samefile(os.path.join(baseline_dir, 'responses', unchanged), linked)
+    assert module.read_body(os.path.join(baseline_dir, 'responses', unchanged)) == b'Same'
+    assert not os.path.exists(temp_path)
+
+
+def test_validators(tmp_dir):
+    previous = validators.Validators()
+    previous.open(tmp_dir)
+    assert previous.record('http://localhost:80', {'ETag': '"1"', 'Last-Modified': 'Mon'}, 'aaaa') is False
+    assert previous.record('http://localhost:8000', {}, 'bbbb') is False
+    previous.close()
+    with open(pathlib.Path(tmp_dir, validators.Validators.FILENAME), 'a') as fil:
+        fil.write('{"etag": "\\"2\\""}\n[]\n{\n')
+    current = validators.Validators()
+    current.load(tmp_dir)
+    assert len(current.previous) == 2
+    assert current.get_headers('http://localhost:80') == {'If-None-Match': '"1"', 'If-Modified-Since': 'Mon'}
+    assert current.get_headers('http://localhost:8000') == {}
+    assert current.get_headers('http://localhost:8080') == {}
+    assert current.record('http://localhost:8000', {}, 'bbbb') is True
+    assert current.record('http://localhost:8080', {}, 'cccc') is False
+    current.not_modified('http://localhost:80')
+    assert current.is_unchanged('http://localhost:80') is True
+    assert current.is_unchanged('http://localhost:8000') is True
+    assert current.is_unchanged('http://localhost:8080') is False
+
+
+def test_not_modified_without_baseline_result(tmp_dir):
+    conditions = list()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            conditions.append(self.headers.get('If-None-Match'))
+            body = b'' if self.headers.get('If-None-Match') else b'Body'
+            self.send_response(304 if self.headers.get('If-None-Match') else 200)
+            self.send_header('ETag', '"1"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    baseline_dir = os.path.join(tmp_dir, 'baseline')
+    os.makedirs(baseline_dir)
+    pathlib.Path(baseline_dir, 'urls.txt').write_text(url)
+    pathlib.Path(baseline_dir, validators.Validators.FILENAME).write_text(json.dumps({'url': url, 'etag': '"1"'}) + '\n')
+    app = base.Application(output_dir=os.path.join(tmp_dir, 'current'))
+    app.headers = dict()
+    app.changes = changes.Changes(app, baseline_dir)
+    app.changes.load()
+    app.validators.load(baseline_dir)
+    os.makedirs(app.output_dir)
+    app.validators.open(app.output_dir)
+    module = mods.Responses(app)
+    try:
+        module.execute(url)
+    finally:
+        module.close()
+        app.validators.close()
+        server.shutdown()
+        server.server_close()
+    assert conditions == ['"1"', None]
+    assert app.validators.is_unchanged(url) is False
+    assert len(pathlib.Path(app.output_dir, validators.Validators.FILENAME).read_text().splitlines()) == 1
+    assert module.read_body(pathlib.Path(module.get_base_dir(), module.get_base_filename(url) + '.txt')) == b'Body'
+
+
+def test_images_clusters():
+    gradient = Image.linear_gradient('L').resize((1000, 1000)).rotate(90)
+    login = Image.new('RGB', (1000, 1000), 'white')
+    ImageDraw.Draw(login).rectangle((300, 400, 700, 600), fill='navy')
+    moved = Image.new('RGB', (1000, 1000), 'white')
+    ImageDraw.Draw(moved).rectangle((310, 400, 710, 600), fill='navy')
+    assert images.distance(images.dhash(login), images.dhash(login.resize((500, 500)))) == 0
+    assert images.distance(images.dhash(login), images.dhash(moved)) <= 10
+    assert images.distance(images.dhash(login), images.dhash(gradient)) > 10
+    clusters = images.Clusters(10)
+    clusters.add('http://10.0.0.1:80', images.dhash(login))
+    clusters.add('http://10.0.0.2:80', images.dhash(gradient))
+    clusters.add('http://10.0.0.3:80', images.dhash(moved))
+    assert clusters.groups() == [['http://10.0.0.1:80', 'http://10.0.0.3:80']]
+    values = [int.from_bytes(hashlib.sha256(str(index).encode()).digest()[:8], 'big') for index in range(200)]
+    values.extend(value ^ (1 << bit) ^ (1 << (bit + 20)) for bit, value in enumerate(values[:40]))
+    naive = list()
+    for value in values:
+        leader = next((index for index, leader in enumerate(naive) if images.distance(leader, value) <= 10), None)
+        if leader is None:
+            naive.append(value)
+    clusters = images.Clusters(10)
+    assert [clusters.add(str(index), value) for index, value in enumerate(values)][200:] == list(range(40))
+    assert clusters.leaders == naive
+
+
+def test_blob_store(tmp_dir):
+    store = blobs.BlobStore(os.path.join(tmp_dir, 'blobs'))
+    paths = list()
+    for name in ('first.png', 'second.png'):
+        paths.append(pathlib.Path(tmp_dir, name))
+        paths[-1].write_bytes(b'PNG')
+    digests = [store.add_file(path) for path in paths]
+    assert digests[0] == digests[1] == hashlib.sha256(b'PNG').hexdigest()
+    assert paths[0].samefile(paths[1])
+    assert paths[0].samefile(store.get_path(digests[0]))
+    temp = store.temp_file()
+    with temp:
+        temp.write(b'PNG')
+    assert store.commit(temp.name, digests[0]) == store.get_path(digests[0])
+    assert os.path.exists(temp.name) is False
+    assert len(list(pathlib.Path(tmp_dir, 'blobs').rglob('*'))) == 2
+    assert store.verify(digests[0])
+    store.get_path(digests[0]).write_bytes(b'GIF')
+    assert not store.verify(digests[0])
+    store.get_path(digests[0]).write_bytes(b'GIF89a')
+    third = pathlib.Path(tmp_dir, 'third.png')
+    third.write_bytes(b'PNG')
+    assert store.add_file(third) == digests[0]
+    assert store.get_path(digests[0]).read_bytes() == b'PNG'
+    assert third.samefile(store.get_path(digests[0]))
+    index = blobs.Index()
+    index.open(tmp_dir)
+    index.add('screens', 'http://localhost:80', digests[0])
+    index.close()
+    with open(os.path.join(tmp_dir, blobs.Index.FILENAME)) as fil:
+        assert json.loads(fil.read()) == {'module': 'screens', 'url': 'http://localhost:80', 'digest': digests[0]}
+
+
+def test_database(tmp_dir):
+    results = database.Database()
+    results.add_service('localhost', 80, 'http', 'scan')
+    results.open(tmp_dir)
+    results.add_service('localhost', 80, 'http', 'scan', 0.5)
+    results.add_service('localhost', 80, 'http', 'resolver')
+    results.add_service('localhost', 443, 'https', 'certificate', fingerprint='ab')
+    results.add_certificate(
+        certificates.Certificate('ab', 'localhost', 'CN=localhost', 'CN=CA', '2022-01-01T00:00:00Z', '2023-01-01T00:00:00Z', ['localhost'], ['127.0.0.1'])
+    )
+    results.add_response('http://localhost:80', 200, 'Hello', {'Server': 'test'}, 'cd', None, None, 0.1)
+    results.add_screen('http://localhost:80', 'screens/http-localhost-80.png', None, 255)
+    results.close()
+    connection = sqlite3.connect(os.path.join(tmp_dir, database.Database.FILENAME))
+    assert connection.execute('SELECT host, port, source, probe_time FROM services ORDER BY port').fetchall() == [
+        ('localhost', 80, 'scan', 0.5),
+        ('localhost', 443, 'certificate', None),
+    ]
+    assert connection.execute('SELECT names FROM certificates WHERE not_after < "2024"').fetchall() == [('["localhost"]',)]
+    assert connection.execute('SELECT url, title, headers FROM responses').fetchall() == [('http://localhost:80', 'Hello', '{"Server": "test"}')]
+    assert connection.execute('SELECT dhash FROM screens').fetchall() == [('00000000000000ff',)]
+    connection.close()
+
+
+def test_ptr_cache(tmp_dir):
+    cache = ptr.Cache()
+    lookups = list()
+    started = threading.Event()
+
+    def lookup(address):
+        lookups.append(address)
+        started.wait(1)
+        return ('localhost', 3600) if address == '127.0.0.1' else (None, cache.NEGATIVE_TTL)
+
+    threads = [threading.Thread(target=cache.resolve, args=('127.0.0.1', lookup)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    started.set()
+    for thread in threads:
+        thread.join()
+    assert lookups == ['127.0.0.1']
+    assert cache.resolve('127.0.0.1', lookup) == 'localhost'
+    assert cache.resolve('192.0.2.1', lookup) is None
+    assert cache.resolve('192.0.2.1', lookup) is None
+    assert lookups == ['127.0.0.1', '192.0.2.1']
+    cache.set('192.0.2.2', 'expired', -1)
+    assert cache.get('192.0.2.2') == (False, None)
+    path = os.path.join(tmp_dir, 'ptr.json')
+    cache.save(path)
+    loaded = ptr.Cache()
+    loaded.load(path)
+    assert loaded.get('127.0.0.1') == (True, 'localhost')
+    assert loaded.get('192.0.2.1') == (True, None)
+    assert '192.0.2.2' not in loaded.entries
+
+
+def make_certificate(alt_names, common_name='example.com'):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, 'Example, Inc.'),
+        x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+    ])
+    builder = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+    builder = builder.serial_number(1).not_valid_before(datetime.datetime(2022, 1, 1))
+    builder = builder.not_valid_after(datetime.datetime(2023, 1, 1))
+    if alt_names:
+        builder = builder.add_extension(x509.SubjectAlternativeName(alt_names), critical=False)
+    return builder.sign(key, hashes.SHA256()).public_bytes(Encoding.DER)
+
+
+def test_certificates(tmp_dir):
+    der = make_certificate([
+        x509.DNSName('WWW.example.com.'),
+        x509.DNSName('*.example.com'),
+        x509.DNSName('www.example.com'),
+        x509.DirectoryName(x509.Name([x509.NameAttribute(NameOID.ORGANIZATION_NAME, 'DNS:evil, Inc.')])),
+        x509.RFC822Name('admin@example.com'),
+        x509.IPAddress(ipaddress.ip_address('192.0.2.1')),
+        x509.IPAddress(ipaddress.ip_address('2001:db8::1')),
+    ])
+    cache = certificates.Cache()
+    certificate, parsed = cache.get(der)
+    assert parsed
+    assert cache.get(der) == (certificate, False)
+    assert certificate.fingerprint == hashlib.sha256(der).hexdigest()
+    assert certificate.common_name == 'example.com'
+    assert certificate.issuer == certificate.subject == 'CN=example.com,O=Example\\, Inc.'
+    assert (certificate.not_before, certificate.not_after) == ('2022-01-01T00:00:00Z', '2023-01-01T00:00:00Z')
+    assert certificate.names == ['www.example.com', '*.example.com']
+    assert certificate.addresses == ['192.0.2.1', '2001:db8::1']
+    assert certificate.hosts() == ['www.example.com', '192.0.2.1']
+    assert cache.get(make_certificate(None))[0].hosts() == []
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 2048)
+    cert = crypto.X509()
+    cert.set_version(2)
+    cert.get_subject().CN = 'example.com'
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(3600)
+    cert.add_extensions([
+        crypto.X509Extension(b'subjectAltName', False, b'DNS:a.example.com, IP:192.0.2.2, email:a@example.com'),
+        crypto.X509Extension(b'subjectAltName', False, b'DNS:b.example.com, IP:2001:db8::2, URI:http://c.example.com/, DNS:d.example.com'),
+    ])
+    cert.sign(key, 'sha256')
+    certificate = certificates.parse(crypto.dump_certificate(crypto.FILETYPE_ASN1, cert))
+    assert certificate.names == ['a.example.com', 'b.example.com', 'd.example.com']
+    assert certificate.addresses == ['192.0.2.2', '2001:db8::2']
+    assert certificate.hosts() == ['a.example.com', 'b.example.com', 'd.example.com', '192.0.2.2']
+    cert.add_extensions([crypto.X509Extension(b'subjectAltName', False, b'DER:30:05:82:03:61')])
+    cert.sign(key, 'sha256')
+    der = crypto.dump_certificate(crypto.FILETYPE_ASN1, cert)
+    assert cache.get(der)[0].names == []
+    assert cache.get(der) == (cache.get(der)[0], False)
+    general_names = x509.SubjectAlternativeName([x509.DNSName('a, DNS:b.example.com'), x509.DNSName('c.example.com')])
+    der = general_names.public_bytes()
+    assert [name.value for name in certificates.get_general_names(der)] == ['a, DNS:b.example.com', 'c.example.com']
+
+
+def test_certificate_hosts_unique(tmp_dir):
+    app = base.Application(output_dir=tmp_dir)
+    der = make_certificate([x509.DNSName('www.example.com'), x509.DNSName('example.com')])
+    for host in ('192.0.2.1', '192.0.2.2', '192.0.2.3'):
+        app.add_service(host, 443, 'https', der, 0.1)
+    assert app.discovered.get() == [
+        ('192.0.2.1', 443, 'https'),
+        ('www.example.com', 443, 'https'),
+        ('example.com', 443, 'https'),
+        ('192.0.2.2', 443, 'https'),
+        ('192.0.2.3', 443, 'https'),
+    ]
+    assert app.resolver.get_pinned() == {'www.example.com': '192.0.2.1', 'example.com': '192.0.2.1'}
+
+
+def test_certificate_hosts_not_pinned(tmp_dir):
+    app = base.Application(output_dir=tmp_dir)
+    der = make_certificate([
+        x509.DNSName('a.example.com, MAP * 192.0.2.66'),
+        x509.DNSName('b.example.com'),
+        x509.IPAddress(ipaddress.ip_address('10.0.0.9')),
+    ])
+    app.add_service('10.0.0.1', 443, 'https', der, 0.1)
+    assert app.discovered.get() == [
+        ('10.0.0.1', 443, 'https'),
+        ('b.example.com', 443, 'https'),
+        ('10.0.0.9', 443, 'https'),
+    ]
+    assert app.resolver.get_pinned() == {'b.example.com': '10.0.0.1'}
+    assert app.resolver.resolve('10.0.0.9') == '10.0.0.9'
+    assert not app.resolver.pin('c.example.com, MAP *', '10.0.0.1')
+    assert browser.get_resolver_rules({'b.example.com': '10.0.0.1', 'c.example.com,MAP': '10.0.0.1'}) == (
+        '--host-resolver-rules=MAP b.example.com 10.0.0.1'
+    )
+
+
+def test_session_pools_by_address():
+    session = sessions.get_session(names.Resolver(), 10, 2)
+    adapter = session.get_adapter('http://localhost')
+    assert adapter.get_connection('http://localhost:8000/a') is adapter.get_connection('http://127.0.0.1:8000/b')
+    assert adapter.get_connection('http://localhost:8000/') is not adapter.get_connection('http://localhost:8080/')
+    assert adapter.get_connection('https://localhost:8443/') is adapter.get_connection('https://localhost:8443/c')
+    assert adapter.get_connection('https://localhost:8443/').host == '127.0.0.1'
+    assert adapter.get_connection('http://[::1]:8000/') is adapter.poolmanager.connection_from_url('http://[::1]:8000/')
+    proxies = {'http': 'http://127.0.0.1:3128'}
+    assert adapter.get_connection('http://localhost:8000/', proxies) is adapter.proxy_manager_for(proxies['http']).connection_from_url('http://localhost:8000/')
+
+
+def test_session_redirect_host():
+    hosts = list()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            hosts.append(self.headers['Host'])
+            self.send_response(302 if self.path == '/redirect' else 200)
+            self.send_header('Location', f'http://localhost:{target.server_address[1]}/')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    source = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    target = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    for server in (source, target):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    session = sessions.get_session(names.Resolver(), 10, 2)
+    try:
+        session.get(f'http://127.0.0.1:{source.server_address[1]}/redirect', timeout=5)
+        session.get(f'http://localhost:{target.server_address[1]}/', headers={'Host': 'explicit.example'}, timeout=5)
+    finally:
+        for server in (source, target):
+            server.shutdown()
+            server.server_close()
+    assert hosts == [
+        f'127.0.0.1:{source.server_address[1]}',
+        f'localhost:{target.server_address[1]}',
+        'explicit.example',
+    ]
+
+
+def test_session_pinned_names():
+    resolver = names.Resolver()
+    assert resolver.pin('internal.example', '127.0.0.1')
+    assert not resolver.pin('internal.example', '192.0.2.1')
+    assert not resolver.pin('localhost', 'localhost')
+    resolver.pin('alias.example', 'localhost')
+    assert resolver.resolve('alias.example') == resolver.resolve('internal.example') == '127.0.0.1'
+    session = sessions.get_session(resolver, 10, 2)
+    adapter = session.get_adapter('http://localhost')
+    assert adapter.get_connection('http://internal.example:8000/') is adapter.get_connection('http://localhost:8000/')
+    assert adapter.get_connection('https://internal.example:8443/').host == '127.0.0.1'
+    assert resolver.get_pinned(('internal.example', 'localhost')) == {'internal.example': '127.0.0.1'}
+    assert browser.get_resolver_rules(resolver.get_pinned()) == (
+        '--host-resolver-rules=MAP internal.example 127.0.0.1,MAP alias.example localhost'
+    )
+
+
+def test_browser_resolver_batches(tmp_dir):
+    app = base.Application(output_dir=tmp_dir)
+    for index in range(1000):
+        app.resolver.pin(f'name-{index}.example', '192.0.2.1')
+    pooled = browser.Browser(app)
+    pooled.pinned = pooled.get_pinned('https://name-10.example:8443/')
+    assert list(pooled.pinned) == [f'name-{index}.example' for index in range(10, 10 + pooled.RESOLVER_RULES)]
+    assert pooled.get_pinned('http://unpinned.example/') == {}
+    pooled.process = True
+    assert pooled.resolves('http://name-20.example/')
+    assert pooled.resolves('http://unpinned.example/')
+    assert not pooled.resolves('http://name-5.example/')
+
+
+FAKE_BROWSER = """#!{python}
+import json, os, sys
+buffer = b''
+while chunk := os.read(3, 65536):
+    buffer += chunk
+    while b'\\0' in buffer:
+        message, _, buffer = buffer.partition(b'\\0')
+        message = json.loads(message)
+        method, session, result = message['method'], message.get('sessionId'), dict()
+        if method == 'Page.navigate' and 'crash' in message['params']['url']:
+            sys.exit(1)
+        if method == 'Target.createTarget':
+            result = {{'targetId': 'T'}}
+        elif method == 'Target.attachToTarget':
+            result = {{'sessionId': 'S'}}
+        elif method == 'Page.captureScreenshot':
+            result = {{'data': 'UE5H'}}
+        os.write(4, json.dumps({{'id': message['id'], 'result': result}}).encode() + b'\\0')
+        if method == 'Page.navigate':
+            os.write(4, json.dumps({{'method': 'Page.loadEventFired', 'sessionId': session}}).encode() + b'\\0')
+"""
+
+
+def test_browser_pipe_framing():
+    pooled = browser.Browser(None)
+    pooled.reader, to_reader = os.pipe()
+    from_writer, pooled.writer = os.pipe()
+    deadline = time.monotonic() + 5
+    os.write(to_reader, b'{"method": "Page.loadEventFired", "sessionId": "S"}\0{"id": 1, "res')
+    os.write(to_reader, b'ult": {"data": "a"}}\0{"id": 2, "error": {"message": "Failed"}}\0')
+    assert pooled.call('Page.captureScreenshot', session='S', deadline=deadline) == {'data': 'a'}
+    assert os.read(from_writer, 1024) == b'{"id": 1, "method": "Page.captureScreenshot", "params": {}, "sessionId": "S"}\0'
+    assert pooled.wait_event('Page.loadEventFired', 'S', deadline) == {}
+    with pytest.raises(browser.BrowserError, match='Page.enable failed: Failed'):
+        pooled.call('Page.enable', deadline=deadline)
+    with pytest.raises(TimeoutError):
+        pooled.recv(time.monotonic() + 0.1)
+    os.write(to_reader, b'{"id": 3')
+    os.close(to_reader)
+    with pytest.raises(browser.BrowserError, match='pipe closed'):
+        pooled.recv(deadline)
+    os.close(from_writer)
+    with pytest.raises(browser.BrowserError, match='pipe closed'):
+        pooled.send('Page.enable')
+    os.close(pooled.reader)
+
+
+def test_browser_pool(tmp_dir):
+    app = base.Application(output_dir=tmp_dir)
+    app.browser = os.path.join(tmp_dir, 'chromium')
+    with open(app.browser, 'w') as fil:
+        fil.write(FAKE_BROWSER.format(python=sys.executable))
+    os.chmod(app.browser, 0o755)
+    pool = browser.BrowserPool(app, 1, 2)
+    pooled = pool.browsers[0]
+    try:
+        assert pool.screenshot('http://localhost:8000', 5) == b'PNG'
+        process = pooled.process
+        assert pool.idle.qsize() == 1
+        process.kill()
+        process.wait()
+        assert pool.screenshot('http://localhost:8000', 5) == b'PNG'
+        assert pooled.process.pid != process.pid
+        assert pool.screenshot('http://localhost:8000', 5) == b'PNG'
+        assert pooled.process is None
+        with pytest.raises(browser.BrowserError):
+            pool.screenshot('http://localhost:8000/crash', 5)
+        assert pooled.process is None
+        assert pool.idle.qsize() == 1
+        results = list()
+        threads = [threading.Thread(target=lambda: results.append(pool.screenshot('http://localhost:8000', 5))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [b'PNG'] * 4
+        assert pool.idle.qsize() == 1
+    finally:
+        pool.close()
+    assert pooled.process is None
+
+def test_throttle():
+    limiter = throttle.Throttle(1, 4, 10, 1000)
+    tickets = [limiter.acquire('192.0.2.1') for _ in range(4)]
+    assert limiter.try_acquire('192.0.2.2')[1] == limiter.POLL_INTERVAL
+    assert limiter.try_acquire('192.0.3.1')[1] == 0
+    subnet = tickets[0][0]
+    limiter.release(tickets[0], '192.0.2.1', throttle.TIMEOUT, 3)
+    assert (subnet.window, subnet.rate) == (4, 1000)
+    assert not limiter.should_retry('192.0.2.1', throttle.TIMEOUT, 0)
+    limiter.release(tickets[1], '192.0.2.1', throttle.REFUSED, 0.01)
+    assert limiter.should_retry('192.0.2.1', throttle.TIMEOUT, 0)
+    assert not limiter.should_retry('192.0.2.1', throttle.TIMEOUT, 1)
+    limiter.release(tickets[2], '192.0.2.1', throttle.TIMEOUT, 3)
+    limiter.release(tickets[3], '192.0.2.1', throttle.RESET, 0.1)
+    assert (subnet.window, subnet.rate) == (2, 500)
+    ticket = limiter.acquire('192.0.2.1')
+    limiter.release(ticket, '192.0.2.1', throttle.TIMEOUT, 3)
+    assert (subnet.window, subnet.rate) == (1, 250)
+    ticket = limiter.acquire('192.0.2.1')
+    limiter.release(ticket, '192.0.2.1', throttle.CONNECTED, 0.01)
+    assert (subnet.window, subnet.rate) == (2, 251)
+    assert throttle.get_subnet('192.0.2.77') == '192.0.2.0/24'
+    assert throttle.get_subnet('localhost') == 'localhost'
+
+
+def test_metrics(tmp_dir):
+    registry = metrics.Metrics()
+    for value in (0.0005, 0.003, 0.003, 0.2, 7):
+        registry.observe('connect_seconds', value, outcome=throttle.CONNECTED)
+    registry.observe('connect_seconds', 3, outcome=throttle.TIMEOUT)
+    registry.count('queued_total', stage='responses')
+    registry.count('queued_total', 2, stage='screens')
+    try:
+        with registry.track('responses'):
+            assert registry.in_flight('responses') == 1
+            raise ValueError
+    except ValueError:
+        pass
+    assert registry.in_flight('responses') == 0
+    assert registry.get('queued_total') == 3
+    assert registry.get('queued_total', stage='screens') == 2
+    assert registry.get_count('connect_seconds') == 6
+    assert registry.get_count('responses_seconds', outcome='error') == 1
+    histogram = registry.histograms[metrics.get_key('connect_seconds', {'outcome': throttle.CONNECTED})]
+    assert (histogram.percentile(0.5), histogram.percentile(0.8), histogram.percentile(1)) == (0.005, 0.25, 7)
+    registry.write(tmp_dir)
+    with open(pathlib.Path(tmp_dir, registry.FILENAME)) as fil:
+        connect = json.load(fil)['histograms']['connect_seconds']
+    assert [(entry['labels']['outcome'], entry['count']) for entry in connect] == [(throttle.CONNECTED, 5), (throttle.TIMEOUT, 1)]
+    assert connect[0]['buckets']['0.001'] == 1 and connect[0]['buckets']['+Inf'] == 5
+    registry.serve(0)
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{registry.server.server_address[1]}/metrics') as response:
+            text = response.read().decode()
+    finally:
+        registry.close()
+    assert '# TYPE pukpuk_connect_seconds histogram' in text
+    assert 'pukpuk_connect_seconds_bucket{outcome="timeout",le="5"} 1' in text
+    assert 'pukpuk_queued_total{stage="screens"} 2' in text
+    assert 'pukpuk_in_flight{stage="responses"} 0' in text
+    assert metrics.format_duration(3725) == '1:02:05'
+
+
+def test_lazy_imports():
+    code = 'import sys; from pukpuk import base, cli; base.Application(output_dir=".").get_parser(); print(*sys.modules)'
+    loaded = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout.split()
+    assert not {'requests', 'urllib3', 'dns.resolver', 'netaddr', 'OpenSSL', 'cryptography.x509', 'PIL.Image'} & set(loaded)
+    assert base.netaddr.IPAddress('10.0.0.1').version == 4
+    assert repr(base.mods) == "<lazy module 'pukpuk.mods'>"
+
+
+def test_results():
+    results = base.Results()
+    added = list()
+    results.callback = added.append
+    targets = [(f'10.0.{index // 256}.{index % 256}', 443, 'https') for index in range(1000)]
+    targets.extend((f'host{index}.example.com', port, proto) for index in range(100) for port, proto in ((80, 'http'), (8080, None)))
+
+    def add_all():
+        for target in targets:
+            results.add(target)
+
+    threads = [threading.Thread(target=add_all) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for _ in range(10):
+        assert len(set(results)) == len(list(results))
+    for thread in threads:
+        thread.join()
+    assert len(results) == len(added) == len(targets)
+    assert set(results.get()) == set(results.unique()) == set(added) == set(targets)
+    assert len(results.get()) == len(targets)
+    results.add(('010.0.0.1', 80, 'http'))
+    assert results.get()[-1] == ('010.0.0.1', 80, 'http')
+    ordered = base.Results()
+    for target in targets:
+        ordered.add(target)
+        ordered.add(target)
+    assert ordered.get() == targets
+
+
+def test_shards(tmp_dir):
+    shards = [base.Application(output_dir=tmp_dir, shard=(index, 3)) for index in (1, 2, 3)]
+    parts = [
+        set(app.expand_targets(app.targets_from_network('10.0.0.0/24'), ((80, 'http'), (443, 'https'))))
+        for app in shards
+    ]
+    assert sum(len(part) for part in parts) == len(set.union(*parts)) == 512
+    assert all(len(part) > 100 for part in parts)
+    assert all(len({host for host, _, _ in part} & {host for host, _, _ in parts[0]}) == 0 for part in parts[1:])
+    assert shards[0].in_shard_url('http://10.0.0.1:80') == sequences.in_shard('10.0.0.1', (1, 3))
+
+
+def test_merge(tmp_dir):
+    directories = [pathlib.Path(tmp_dir, 'shards', str(index)) for index in (1, 2)]
+    for index, directory in enumerate(directories):
+        url = f'http://10.0.0.{index}:80'
+        path = pathlib.Path(directory, 'responses', f'http-10.0.0.{index}-80.txt')
+        path.parent.mkdir(parents=True)
+        path.write_text('response')
+        pathlib.Path(directory, base.Application.OUTPUT_URLS_FILENAME).write_text(f'{url}\nhttp://www.example.com:80')
+        pathlib.Path(directory, validators.Validators.FILENAME).write_text(json.dumps({'url': url}) + '\n')
+        results = database.Database()
+        results.open(directory)
+        results.add_response(url, 200, 'Hello', {}, 'ab', path, None, 0.1)
+        results.add_screen(url, pathlib.Path(directory, 'screens', 'screen.png'), None, 255 + index)
+        results.add_response(f'{url}/stored', 200, 'Hello', {}, 'cd', pathlib.Path(tmp_dir, 'blobs', 'cd', 'cdef'), None, 0.1)
+        results.close()
+    output_dir = pathlib.Path(tmp_dir, 'merged')
+    output_dir.mkdir()
+    merge.Merge(base.Application(output_dir=str(output_dir)), directories).run()
+    assert pathlib.Path(output_dir, 'urls.txt').read_text().split() == [
+        'http://10.0.0.0:80',
+        'http://www.example.com:80',
+        'http://10.0.0.1:80',
+    ]
+    assert sorted(path.name for path in pathlib.Path(output_dir, 'responses').iterdir()) == [
+        'http-10.0.0.0-80.txt',
+        'http-10.0.0.1-80.txt',
+    ]
+    assert len(pathlib.Path(output_dir, validators.Validators.FILENAME).read_text().splitlines()) == 2
+    connection = sqlite3.connect(pathlib.Path(output_dir, database.Database.FILENAME))
+    assert connection.execute('SELECT path FROM responses ORDER BY url').fetchall() == [
+        (str(pathlib.Path(output_dir, 'responses', 'http-10.0.0.0-80.txt')),),
+        (str(pathlib.Path(tmp_dir, 'blobs', 'cd', 'cdef')),),
+        (str(pathlib.Path(output_dir, 'responses', 'http-10.0.0.1-80.txt')),),
+        (str(pathlib.Path(tmp_dir, 'blobs', 'cd', 'cdef')),),
+    ]
+    connection.close()
+    assert pathlib.Path(output_dir, mods.Screens.CLUSTERS_FILENAME).read_text().splitlines()[1:3] == [
+        'http://10.0.0.0:80',
+        'http://10.0.0.1:80',
+    ]
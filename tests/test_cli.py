@@ -1,4 +1,5 @@
 import errno
+import json
 import pathlib
 import shlex
 
@@ -161,6 +162,128 @@ def test_ports_no_proto_https(http, tmp_dir):
     assert pathlib.Path(tmp_dir, 'screens', 'http-localhost-80.png').exists() is True
 
 
+def test_engine_asyncio(http, tmp_dir):
+    target_ip, _ = http
+    args = shlex.split(f'-N 127.0.0.1/32 -p 8000/http,8443 -o {tmp_dir} -e asyncio -c 10 --skip-screens')
+    app = base.Application()
+    app.parse(args)
+    assert pathlib.Path(tmp_dir, 'responses', 'http-127.0.0.1-8000.txt').exists() is True
+    assert pathlib.Path(tmp_dir, 'responses', 'https-127.0.0.1-8443.txt').exists() is True
+    assert pathlib.Path(tmp_dir, 'responses', 'http-localhost-8000.txt').exists() is True
+    assert pathlib.Path(tmp_dir, 'responses', 'https-localhost-8443.txt').exists() is True
+
+
+def test_sweep(http, tmp_dir):
+    target_ip, _ = http
+    args = shlex.split(f'-N 127.0.0.1-127.0.0.5 -p 8000/http,8443,9999 -o {tmp_dir} --sweep --connect-timeout 0.5 --skip-screens')
+    app = base.Application()
+    app.parse(args)
+    assert pathlib.Path(tmp_dir, 'responses', 'http-127.0.0.1-8000.txt').exists() is True
+    assert pathlib.Path(tmp_dir, 'responses', 'https-127.0.0.1-8443.txt').exists() is True
+    assert pathlib.Path(tmp_dir, 'responses', 'http-localhost-8000.txt').exists() is True
+    assert pathlib.Path(tmp_dir, 'responses', 'http-127.0.0.1-9999.txt').exists() is False
+
+
+def test_pipeline(http, tmp_dir, cwd):
+    target_ip, _ = http
+    args = shlex.split(f'-N 127.0.0.1/32 -p 8000/http,8443 -U {cwd}/files/urls.txt -o {tmp_dir} --pipeline')
+    app = base.Application()
+    app.parse(args)
+    urls = pathlib.Path(tmp_dir, 'urls.txt').read_text().split()
+    assert len(urls) == len(set(urls))
+    assert 'http://127.0.0.1:8000' in urls
+    assert 'https://127.0.0.1:9443/' in urls
+    assert pathlib.Path(tmp_dir, 'responses', 'http-127.0.0.1-8000.txt').exists() is True
+    assert pathlib.Path(tmp_dir, 'responses', 'https-127.0.0.1-8443.txt').exists() is True
+    assert pathlib.Path(tmp_dir, 'responses', 'http-localhost-8000.txt').exists() is True
+    assert pathlib.Path(tmp_dir, 'responses', 'https-127.0.0.1-9443-6666cd76f96956469e7be39d750cc7d9.txt').exists() is True
+    assert pathlib.Path(tmp_dir, 'screens', 'http-127.0.0.1-8000.png').exists() is True
+    assert pathlib.Path(tmp_dir, 'screens', 'https-127.0.0.1-8443.png').exists() is True
+
+
+def test_invalid_engine(tmp_dir):
+    args = shlex.split(f'-N 127.0.0.1/32 -o {tmp_dir} -e processes')
+    app = base.Application()
+    with pytest.raises(SystemExit) as exc:
+        app.parse(args)
+    assert exc.type == SystemExit
+    assert exc.value.code == errno.EINVAL
+
+
+def test_browser_pool(http, tmp_dir):
+    target_ip, _ = http
+    args = shlex.split(f'-N 127.0.0.1/32 -p 8000/http,8080/http,8443/https -o {tmp_dir} --browser-pool 2 --browser-pages 2')
+    app = base.Application()
+    app.parse(args)
+    assert pathlib.Path(tmp_dir, 'screens', 'http-127.0.0.1-8000.png').exists() is True
+    assert pathlib.Path(tmp_dir, 'screens', 'http-127.0.0.1-8080.png').exists() is True
+    assert pathlib.Path(tmp_dir, 'screens', 'https-127.0.0.1-8443.png').exists() is True
+    assert pathlib.Path(tmp_dir, 'screens', 'http-localhost-8000.png').exists() is True
+    assert pathlib.Path(tmp_dir, 'screens', 'http-localhost-8080.png').exists() is True
+    assert pathlib.Path(tmp_dir, 'screens', 'https-localhost-8443.png').exists() is True
+
+
+def test_max_body_size(http, tmp_dir):
+    target_ip, _ = http
+    args = shlex.split(f'-N 127.0.0.1/32 -p 8000/http -o {tmp_dir} --skip-screens --max-body-size 20')
+    app = base.Application()
+    app.parse(args)
+    response = pathlib.Path(tmp_dir, 'responses', 'http-127.0.0.1-8000.txt').read_text()
+    assert response.endswith('\n\n[TRUNCATED: body exceeds 20 bytes]\n')
+    body = response.partition('\nRESPONSE\n=========\n\n\n')[2].partition('\n\n\n')[2].rpartition('\n\n[TRUNCATED')[0]
+    assert body == '<!DOCTYPE html>\n    '
+    assert len(body) == 20
+
+
+def test_resume(http, tmp_dir):
+    target_ip, _ = http
+    args = shlex.split(f'-N 127.0.0.1/32 -p 8000/http,8080/http -o {tmp_dir} --skip-screens')
+    app = base.Application()
+    app.parse(args)
+    journal_path = pathlib.Path(tmp_dir, 'journal.jsonl')
+    entries = journal_path.read_text().splitlines()
+    pathlib.Path(tmp_dir, 'responses', 'http-127.0.0.1-8080.txt').unlink()
+    journal_path.write_text('\n'.join(line for line in entries if 'http://127.0.0.1:8080' not in line) + '\n')
+    app = base.Application()
+    app.parse(shlex.split(f'--resume {tmp_dir}'))
+    assert pathlib.Path(tmp_dir, 'responses', 'http-127.0.0.1-8080.txt').exists() is True
+    assert len(journal_path.read_text().splitlines()) == len(entries)
+
+
+def test_baseline(http, tmp_dir):
+    target_ip, _ = http
+    args = shlex.split(f'-N 127.0.0.1/32 -p 8000/http -o {tmp_dir}/baseline --skip-screens')
+    app = base.Application()
+    app.parse(args)
+    args = shlex.split(f'-N 127.0.0.1/32 -p 8000/http,8080/http -o {tmp_dir}/current --skip-screens --baseline {tmp_dir}/baseline')
+    app = base.Application()
+    app.parse(args)
+    assert pathlib.Path(tmp_dir, 'current', 'changes.txt').read_text().splitlines() == [
+        '+ http://127.0.0.1:8080',
+        '+ http://localhost:8080',
+    ]
+    assert pathlib.Path(tmp_dir, 'current', 'responses', 'http-127.0.0.1-8000.txt').samefile(
+        pathlib.Path(tmp_dir, 'baseline', 'responses', 'http-127.0.0.1-8000.txt')
+    )
+
+
+def test_store(http, tmp_dir):
+    target_ip, _ = http
+    args = shlex.split(f'-N 127.0.0.1/32 -p 8000/http,8080/http -o {tmp_dir}/scan --skip-screens --store {tmp_dir}/blobs')
+    app = base.Application()
+    app.parse(args)
+    entries = [json.loads(line) for line in pathlib.Path(tmp_dir, 'scan', 'index.jsonl').read_text().splitlines()]
+    assert sorted(entry['url'] for entry in entries) == [
+        'http://127.0.0.1:8000',
+        'http://127.0.0.1:8080',
+        'http://localhost:8000',
+        'http://localhost:8080',
+    ]
+    for entry in entries:
+        assert pathlib.Path(tmp_dir, 'blobs', entry['digest'][:2], entry['digest']).exists() is True
+    assert pathlib.Path(tmp_dir, 'scan', 'responses').exists() is False
+
+
 def test_skip_screens(http, tmp_dir):
     target_ip, _ = http
     args = shlex.split(f'-N 127.0.0.1/32 -p 8000/http -o {tmp_dir} --skip-screens')